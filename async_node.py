@@ -0,0 +1,170 @@
+import asyncio
+
+from framing import FrameDecoder, MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END, \
+    MSG_TYPE_FILE_META, MSG_TYPE_FILE_RANGE, MSG_TYPE_MANIFEST, TYPE_MASK
+from node import Node, ReceiveState, CONNECTION_IDLE_TIMEOUT
+from rate_limit import POLICY_DISCONNECT
+from tls import HANDSHAKE_TIMEOUT
+
+READ_SIZE = 65536
+LISTEN_BACKLOG = 1024
+# frames which open, write or move files are handled on worker
+# threads, so disk doesn't stall the event loop
+DISK_FRAME_TYPES = {MSG_TYPE_FILE_META, MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END,
+                    MSG_TYPE_MANIFEST, MSG_TYPE_FILE_RANGE}
+
+
+class AsyncNode(Node):
+    """
+    A node that serves all inbound connections on one asyncio event loop,
+    so a slow peer doesn't stall messages from the others
+    """
+
+    def __init__(self, *args, **kwargs):
+        processes = kwargs.get("receive_processes", 1)
+        if processes != 1:
+            raise ValueError(f"Asynchronous node receives on one process, "
+                             f"but receive processes were:{processes}")
+        super().__init__(*args, **kwargs)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stop_event: asyncio.Event | None = None
+        self._writers = set[asyncio.StreamWriter]()
+
+    def receive_messages(self, downloads_path: str):
+        """Listens to messages from peers until the node is closed"""
+        try:
+            asyncio.run(self._serve(downloads_path))
+        except OSError:
+            pass
+        finally:
+            self._server_socket.close()
+
+    async def _serve(self, downloads_path: str):
+        """Accepts connections and waits for close() to be called"""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if not self._is_running:
+            return
+
+        self._server_socket.bind((self.host, self.port))
+        self._start_sweeper()
+        tls = {}
+        if self._tls:
+            tls = {"ssl": self._tls.server_context,
+                   "ssl_handshake_timeout": HANDSHAKE_TIMEOUT}
+        server = await asyncio.start_server(
+            lambda reader, writer: self._handle_connection(
+                reader, writer, downloads_path
+            ),
+            sock=self._server_socket,
+            backlog=LISTEN_BACKLOG,
+            **tls
+        )
+        async with server:
+            await self._stop_event.wait()
+            # pooled peers keep their connections open,
+            # so they are closed here for the server to shut down
+            for writer in list(self._writers):
+                writer.close()
+
+    async def _handle_connection(
+            self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter,
+            downloads_path: str
+    ):
+        """Reads frames from a single peer connection"""
+        peer_host = writer.get_extra_info("peername")[0]
+        if not self.limiter.connect(peer_host):
+            writer.close()
+            return
+        loop = asyncio.get_running_loop()
+        decoder = FrameDecoder(max_sizes=self.frame_limits)
+        # every connection keeps its own state, it is swapped in
+        # only while frames of this connection are processed.
+        # Replies may be written by worker threads
+        state = ReceiveState(
+            lambda data: loop.call_soon_threadsafe(writer.write, data),
+            peer_host=peer_host
+        )
+        self._writers.add(writer)
+        try:
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(READ_SIZE),
+                                                  CONNECTION_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # silent peer doesn't hold its connection forever
+                    break
+                if not data:
+                    break
+
+                decoder.feed(data)
+                for msg_type, payload in decoder.frames():
+                    wait = self._admit(state, msg_type, len(payload))
+                    if wait is None:
+                        if self.limiter.policy == POLICY_DISCONNECT:
+                            return
+                        continue
+                    if wait:
+                        # other connections are served meanwhile
+                        await asyncio.sleep(wait)
+                    if msg_type & TYPE_MASK in DISK_FRAME_TYPES:
+                        # decoder isn't fed until the frame is handled,
+                        # so its payload stays valid
+                        await asyncio.to_thread(self._handle_frame, state,
+                                                msg_type, payload,
+                                                downloads_path)
+                    else:
+                        self._handle_frame(state, msg_type, payload,
+                                           downloads_path)
+                # replies to manifests are written by handle_frame
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except Exception as e:
+            print(f"Error while receiving messages: {e}")
+        finally:
+            self._writers.discard(writer)
+            self.limiter.disconnect(peer_host)
+            writer.close()
+            # unfinished file is closed and removed, even if the loop
+            # is shutting down
+            await asyncio.shield(
+                asyncio.to_thread(self.close_receive_state, state)
+            )
+
+    def _handle_frame(
+            self,
+            state: ReceiveState,
+            msg_type: int,
+            payload: memoryview,
+            downloads_path: str
+    ):
+        """Handles frame of connection with given state"""
+        self._state = state
+        try:
+            self.handle_frame(msg_type, payload, downloads_path)
+        finally:
+            self._state = None
+
+    def close(self):
+        """Closes current node"""
+        self._is_running = False
+        self._closed.set()
+        self._outbox_changed.set()
+        if self._discovery:
+            self._discovery.stop()
+        self._dispatcher.close()
+        # messages which were waiting in dispatcher are kept too
+        self._save_outbox()
+        self._pool.close()
+        self._datagram_socket.close()
+        if self._loop and self._stop_event:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                # event loop has already finished
+                pass
+        else:
+            self._server_socket.close()
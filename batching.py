@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import Future
+from threading import Event, Lock
+
+# messages queued to one peer within this window are sent together
+FLUSH_WINDOW = 0.002
+MAX_BATCH_MESSAGES = 64
+MAX_BATCH_SIZE = 256 * 1024
+
+
+class MessageBatch:
+    """
+    Text payloads queued to one peer, which are sent in a single write.
+    Batch is flushed when its window ends or it gets full
+    """
+
+    def __init__(
+            self,
+            max_messages: int = MAX_BATCH_MESSAGES,
+            max_size: int = MAX_BATCH_SIZE
+    ):
+        self.max_messages = max_messages
+        self.max_size = max_size
+        self.future = Future()
+        self.created = time.monotonic()
+        self._payloads = list[bytes]()
+        self._size = 0
+        self._is_sealed = False
+        self._full = Event()
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._payloads)
+
+    def add(self, payload: bytes) -> bool:
+        """Adds payload, returns False if batch is already sent or full"""
+        with self._lock:
+            if (self._is_sealed
+                    or len(self._payloads) >= self.max_messages
+                    or (self._payloads
+                        and self._size + len(payload) > self.max_size)):
+                return False
+
+            self._payloads.append(payload)
+            self._size += len(payload)
+            if (len(self._payloads) >= self.max_messages
+                    or self._size >= self.max_size):
+                self._full.set()
+            return True
+
+    def seal(self, window: float | None = None) -> list[bytes]:
+        """
+        Waits until flush window ends or batch gets full,
+        then stops accepting payloads and returns them
+        """
+        if window is None:
+            window = FLUSH_WINDOW
+        self._full.wait(max(0.0, self.created + window - time.monotonic()))
+        with self._lock:
+            self._is_sealed = True
+            return self._payloads
+
+    def resolve(self, sent: Future):
+        """Passes result of sending to future shared by all messages"""
+        if sent.cancelled():
+            self.future.cancel()
+        elif sent.exception():
+            self.future.set_exception(sent.exception())
+        else:
+            self.future.set_result(sent.result())
@@ -0,0 +1,71 @@
+"""
+Compares sending a burst of text messages one frame per message
+with batched sending through send_message_async.
+Run from the repository root: python -m benchmarks.bench_batching
+"""
+import tempfile
+import time
+from threading import Thread
+
+from node import Node
+
+MESSAGES = 20_000
+
+
+def start_receiver(downloads: str) -> tuple[Node, Thread, int]:
+    receiver = Node(port=0, username="receiver", public_ip="127.0.0.1")
+    thread = Thread(target=receiver.receive_messages, args=(downloads,),
+                    daemon=True)
+    thread.start()
+    time.sleep(0.1)
+    return receiver, thread, receiver._server_socket.getsockname()[1]
+
+
+def wait_for(receiver: Node, count: int):
+    while len(receiver.new_messages) < count:
+        time.sleep(0.001)
+
+
+def run(label: str, batched: bool, compression: bool, repeat: int = 3):
+    elapsed = min(send_burst(batched, compression) for _ in range(repeat))
+    print(f"  {label:<34} {elapsed * 1000:9.1f} ms  "
+          f"{MESSAGES / elapsed:10.0f} msg/s")
+
+
+def send_burst(batched: bool, compression: bool) -> float:
+    with tempfile.TemporaryDirectory() as downloads:
+        receiver, thread, port = start_receiver(downloads)
+        sender = Node(port=8000, username="sender", public_ip="127.0.0.1",
+                      compression=compression)
+        # peer flags are learned from its first message in real chat
+        sender.peer_flags[("127.0.0.1", port)] = receiver._flags
+        sender.send_message("127.0.0.1", port, "warm up")
+        wait_for(receiver, 1)
+        receiver.new_messages.clear()
+
+        started = time.perf_counter()
+        for i in range(MESSAGES):
+            text = f"pasted line {i}: the quick brown fox jumps"
+            if batched:
+                sender.send_message_async("127.0.0.1", port, text)
+            else:
+                sender.send_message("127.0.0.1", port, text)
+        wait_for(receiver, MESSAGES)
+        elapsed = time.perf_counter() - started
+
+        sender.close()
+        receiver.close()
+        thread.join(timeout=1.0)
+    return elapsed
+
+
+def main():
+    print(f"burst of {MESSAGES} messages to one peer over loopback, "
+          f"best of 3")
+    run("frame per message", batched=False, compression=False)
+    run("batched", batched=True, compression=False)
+    run("batched and compressed", batched=True, compression=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares FrameDecoder with the old bytes based process_buffer.
+Run from the repository root: python -m benchmarks.bench_framing
+"""
+import time
+
+from framing import FrameDecoder, encode_frame, MSG_TYPE_TEXT, \
+    MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END
+
+RECV_SIZE = 4096
+
+
+def legacy_process_buffer(buffer: bytes, frames: list) -> bytes:
+    """process_buffer as it was before FrameDecoder, without handlers"""
+    while buffer:
+        if buffer[0] == MSG_TYPE_FILE_END:
+            frames.append((MSG_TYPE_FILE_END, b""))
+            buffer = buffer[1:]
+            continue
+
+        if len(buffer) < 5:
+            return buffer
+
+        msg_type = buffer[0]
+        length = int.from_bytes(buffer[1:5], "big")
+
+        if len(buffer) < 5 + length:
+            return buffer
+
+        data = buffer[5:5 + length]
+        buffer = buffer[5 + length:]
+        frames.append((msg_type, data))
+
+    return buffer
+
+
+def run_legacy(chunks: list[bytes]) -> int:
+    frames = []
+    buffer = b""
+    for data in chunks:
+        buffer += data
+        buffer = legacy_process_buffer(buffer, frames)
+    return len(frames)
+
+
+def run_decoder(chunks: list[bytes]) -> int:
+    count = 0
+    decoder = FrameDecoder()
+    for data in chunks:
+        decoder.feed(data)
+        for _ in decoder.frames():
+            count += 1
+    return count
+
+
+def split(stream: bytes, size: int) -> list[bytes]:
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def measure(name: str, chunks: list[bytes], repeat: int = 3):
+    results = {}
+    for label, run in (("process_buffer", run_legacy),
+                       ("FrameDecoder", run_decoder)):
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            frames = run(chunks)
+            best = min(best, time.perf_counter() - started)
+        results[label] = (best, frames)
+
+    total = sum(len(chunk) for chunk in chunks)
+    print(f"{name} ({total / 2 ** 20:.1f} MiB)")
+    for label, (elapsed, frames) in results.items():
+        print(f"  {label:<15} {elapsed * 1000:9.2f} ms  "
+              f"{total / elapsed / 2 ** 20:9.1f} MiB/s  {frames} frames")
+
+
+def main():
+    small_burst = b"".join(
+        encode_frame(MSG_TYPE_TEXT, b"SENDER:user 127.0.0.1:8000 | "
+                                    b"MESSAGE:hi %d" % i)
+        for i in range(50_000)
+    )
+    # the whole burst arrives before the reader gets to it
+    measure("burst of small frames in one read", [small_burst])
+    measure("burst of small frames, 4 KiB reads",
+            split(small_burst, RECV_SIZE))
+
+    big_file = (encode_frame(MSG_TYPE_FILE_DATA, bytes(8 * 2 ** 20))
+                + encode_frame(MSG_TYPE_FILE_END))
+    measure("8 MiB file frame, 4 KiB reads", split(big_file, RECV_SIZE))
+
+    chunked_file = b"".join(
+        encode_frame(MSG_TYPE_FILE_DATA, bytes(RECV_SIZE))
+        for _ in range(4096)
+    )
+    measure("16 MiB file in 4 KiB frames, 64 KiB reads",
+            split(chunked_file, 65536))
+
+
+if __name__ == "__main__":
+    main()
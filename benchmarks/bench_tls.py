@@ -0,0 +1,127 @@
+"""
+Compares plaintext and TLS connections between nodes: cost of
+opening a connection with a full and with a resumed handshake,
+and throughput of messages over a pooled connection.
+Run from the repository root: python -m benchmarks.bench_tls
+"""
+import os
+import socket
+import tempfile
+import time
+from threading import Thread
+
+from node import Node
+from outbox import MAX_OUTBOX_SIZE
+
+CONNECTIONS = 200
+# unacked messages are kept in outbox, so a burst must fit in it
+# while acks of its first messages are still on the way
+MESSAGES = MAX_OUTBOX_SIZE // 2
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_node(username: str, certs: str, downloads: str,
+               tls: bool) -> tuple[Node, Thread]:
+    settings = {}
+    if tls:
+        settings = {"tls": True,
+                    "cert_path": os.path.join(certs, f"{username}.pem"),
+                    "key_path": os.path.join(certs, f"{username}.key")}
+    # transport is measured, so rate limits don't get in the way
+    node = Node(port=free_port(), username=username,
+                public_ip="127.0.0.1", datagrams=False,
+                frame_rate=1e9, byte_rate=1e12, **settings)
+    node.contacts.contacts = []
+    thread = Thread(target=node.receive_messages, args=(downloads,),
+                    daemon=True)
+    thread.start()
+    # port is bound by the thread, the next free one is picked after it
+    time.sleep(0.1)
+    return node, thread
+
+
+def start_nodes(certs: str, downloads: str, tls: bool):
+    # sender listens too, so acks empty its outbox
+    receiver, thread = start_node("receiver", certs, downloads, tls)
+    sender, sender_thread = start_node("sender", certs, downloads, tls)
+    # peer flags are learned from its first message in real chat
+    sender.peer_flags[("127.0.0.1", receiver.port)] = receiver._flags
+    return sender, receiver, [thread, sender_thread], receiver.port
+
+
+def stop_nodes(sender: Node, receiver: Node, threads: list[Thread]):
+    sender.close()
+    receiver.close()
+    for thread in threads:
+        thread.join(timeout=1.0)
+
+
+def wait_for(receiver: Node, count: int):
+    while len(receiver.new_messages) < count:
+        time.sleep(0.001)
+
+
+def reconnects(tls: bool, resume: bool) -> float:
+    """Returns seconds per message sent over a new connection"""
+    with (tempfile.TemporaryDirectory() as certs,
+          tempfile.TemporaryDirectory() as downloads):
+        sender, receiver, threads, port = start_nodes(certs, downloads,
+                                                      tls)
+        sender.send_message("127.0.0.1", port, "warm up")
+        started = time.perf_counter()
+        for i in range(CONNECTIONS):
+            sender._pool.close()
+            if tls and not resume:
+                sender._tls.forget(("127.0.0.1", port))
+            sender.send_message("127.0.0.1", port, f"message {i}")
+        wait_for(receiver, CONNECTIONS + 1)
+        elapsed = time.perf_counter() - started
+        stop_nodes(sender, receiver, threads)
+    return elapsed / CONNECTIONS
+
+
+def burst(tls: bool) -> float:
+    """Returns seconds to send a burst of messages over one connection"""
+    with (tempfile.TemporaryDirectory() as certs,
+          tempfile.TemporaryDirectory() as downloads):
+        sender, receiver, threads, port = start_nodes(certs, downloads,
+                                                      tls)
+        sender.send_message("127.0.0.1", port, "warm up")
+        wait_for(receiver, 1)
+        receiver.new_messages.clear()
+
+        started = time.perf_counter()
+        for i in range(MESSAGES):
+            sender.send_message_async(
+                "127.0.0.1", port,
+                f"pasted line {i}: the quick brown fox jumps"
+            )
+        wait_for(receiver, MESSAGES)
+        elapsed = time.perf_counter() - started
+        stop_nodes(sender, receiver, threads)
+    return elapsed
+
+
+def main():
+    print(f"message over a new connection, {CONNECTIONS} times")
+    for label, tls, resume in (("plaintext", False, False),
+                               ("TLS, full handshake", True, False),
+                               ("TLS, resumed session", True, True)):
+        elapsed = reconnects(tls, resume)
+        print(f"  {label:<34} {elapsed * 1000:9.2f} ms per message")
+
+    print(f"burst of {MESSAGES} messages over a pooled connection, "
+          f"best of 5")
+    for label, tls in (("plaintext", False), ("TLS", True)):
+        elapsed = min(burst(tls) for _ in range(5))
+        print(f"  {label:<34} {elapsed * 1000:9.1f} ms  "
+              f"{MESSAGES / elapsed:10.0f} msg/s")
+
+
+if __name__ == "__main__":
+    main()
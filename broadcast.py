@@ -0,0 +1,56 @@
+from contacts import Contact
+
+
+class BroadcastResult:
+    """Outcome of sending broadcast message to a single peer"""
+
+    def __init__(
+            self,
+            peer: Contact,
+            latency: float,
+            error: BaseException | None = None
+    ):
+        self.peer = peer
+        self.latency = latency
+        self.error = error
+
+    @property
+    def is_sent(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return (f"BroadcastResult:{self.peer.username} "
+                f"{'sent' if self.is_sent else 'failed'}")
+
+
+class BroadcastReport:
+    """Per-peer results and total duration of one broadcast"""
+
+    def __init__(self, results: list[BroadcastResult], duration: float):
+        self.results = results
+        self.duration = duration
+
+    @property
+    def sent(self) -> list[BroadcastResult]:
+        return [result for result in self.results if result.is_sent]
+
+    @property
+    def failed(self) -> list[BroadcastResult]:
+        return [result for result in self.results if not result.is_sent]
+
+    def summary(self) -> str:
+        """Returns report with a line per peer and a total line"""
+        lines = []
+        for result in self.results:
+            peer = (f"{result.peer.username} "
+                    f"({result.peer.host}:{result.peer.port})")
+            if result.is_sent:
+                lines.append(f"  {peer}: sent in "
+                             f"{result.latency * 1000:.1f} ms")
+            else:
+                lines.append(f"  {peer}: failed after "
+                             f"{result.latency * 1000:.1f} ms: {result.error}")
+        lines.append(f"Broadcast to {len(self.results)} peers took "
+                     f"{self.duration * 1000:.1f} ms: {len(self.sent)} "
+                     f"sent, {len(self.failed)} failed")
+        return "\n".join(lines)
@@ -3,10 +3,15 @@ import sys
 from argparse import Namespace
 from threading import Thread
 
+from async_node import AsyncNode
 from contacts import Contact
 from node import Node
+from outbox import OUTBOX_FILE
 from user_config import UserConfig
 
+# queued messages and files are given this long to be sent on exit
+EXIT_SEND_TIMEOUT = 5.0
+
 
 class Chat:
     def __init__(self, args: Namespace):
@@ -26,7 +31,13 @@ class Chat:
               "Adds new peer to known")
         print("  /send <username> <message>   Sends a message to peer")
         print("  /sendfile <username> <path_to_file>   Sends a file to peer")
-        print("  /list   Prints list of known peers")
+        print("  /broadcast <message>   Sends a message to all known peers")
+        print("  /join <room> [<username> ...]   "
+              "Joins a room or adds peers to it")
+        print("  /room <room> <message>   Sends a message to room")
+        print("  /list   Prints list of known peers and who is online")
+        print("  /throttled   Prints peers which went over rate limits")
+        print("  /disk   Prints how far disk writes fell behind")
         print("  /clear   Clear all known peers")
         print("  /chname <username>   Edits current username")
         print("  /chport <port>   Edits current port. "
@@ -36,6 +47,9 @@ class Chat:
     def run(self):
         """Runs chat application"""
         print(f"App starts on {self.node.host}:{self.node.port}")
+        if self.node.fingerprint:
+            print(f"Connections are encrypted, your certificate "
+                  f"fingerprint is {self.node.fingerprint}")
 
         try:
             self.receive_thread.start()
@@ -44,6 +58,8 @@ class Chat:
             print(e)
         finally:
             self.node.contacts.save_contacts()
+            self.node.rooms.save_rooms()
+            self.node.wait_for_sends(EXIT_SEND_TIMEOUT)
             self.node.close()
             self.receive_thread.join(timeout=2)
             sys.exit(0)
@@ -59,12 +75,22 @@ class Chat:
                 self.send_file(command)
             elif command.startswith("/send"):
                 self.send_message(command)
+            elif command.startswith("/broadcast"):
+                self.broadcast(command)
+            elif command.startswith("/join"):
+                self.join_room(command)
+            elif command.startswith("/room"):
+                self.send_room_message(command)
             elif command.startswith("/chname"):
                 self.change_name(command)
             elif command.startswith("/chport"):
                 self.change_port(command)
             elif command.startswith("/list"):
-                self.node.contacts.print_contacts()
+                self.list_peers()
+            elif command.startswith("/throttled"):
+                print(self.node.limiter.summary())
+            elif command.startswith("/disk"):
+                print(self.node.disk_stats.summary())
             elif command.startswith("/clear"):
                 self.node.contacts.clear()
                 print("Erased all contacts")
@@ -84,6 +110,8 @@ class Chat:
         _, port = parts
         self.config.save_config(self.config.username, int(port))
         self.node.contacts.save_contacts()
+        self.node.rooms.save_rooms()
+        self.node.wait_for_sends(EXIT_SEND_TIMEOUT)
         self.node.close()
         self.receive_thread.join()
         print("Closed old server")
@@ -105,6 +133,19 @@ class Chat:
         self.config.save_config(username, self.node.port)
         print(f"Changed username to {username}")
 
+    def list_peers(self):
+        """Prints contacts and peers found on LAN which aren't saved"""
+        self.node.contacts.print_contacts(self.node.presence)
+        found = [
+            (address, username)
+            for address, username in self.node.discovered_peers().items()
+            if not self.node.contacts.get_contact_by_address(*address)
+        ]
+        if found:
+            print("Found on LAN:")
+        for (host, port), username in found:
+            print(f"  {username} ({host}:{port})")
+
     def send_message(self, command: str):
         parts = command.split(maxsplit=2)
         if len(parts) != 3:
@@ -112,13 +153,10 @@ class Chat:
             return
 
         _, username, message = parts
-        peer = self.node.contacts.get_contact_by_username(username)
-        # if user typed IP instead username
-        if not peer:
-            peer = self.node.contacts.get_contact_by_host(username)
-
+        # user may type IP instead username
+        peer = self.node.find_peer(username)
         if peer:
-            self.node.send_message(peer.host, peer.port, message)
+            self.node.send_message_async(peer.host, peer.port, message)
         else:
             print("There's no such user in your contacts")
 
@@ -129,16 +167,60 @@ class Chat:
             return
 
         _, username, path = parts
-        peer = self.node.contacts.get_contact_by_username(username)
-        # if user typed IP instead username
-        if not peer:
-            peer = self.node.contacts.get_contact_by_host(username)
-
+        # user may type IP instead username
+        peer = self.node.find_peer(username)
         if peer:
-            self.node.send_file(peer.host, peer.port, path)
+            self.node.send_file_async(peer.host, peer.port, path)
         else:
             print("There's no such user in your contacts")
 
+    def broadcast(self, command: str):
+        parts = command.split(maxsplit=1)
+        if len(parts) != 2:
+            print("Usage: /broadcast <message>")
+            return
+        if not self.node.contacts.contacts:
+            print("There are no contacts to broadcast to")
+            return
+
+        report = self.node.broadcast(self.node.contacts.contacts, parts[1])
+        report.add_done_callback(lambda f: print(f.result().summary()))
+
+    def join_room(self, command: str):
+        parts = command.split()
+        if len(parts) < 2:
+            print("Usage: /join <room> [<username> ...]")
+            return
+
+        _, name, *usernames = parts
+        members = []
+        for username in usernames:
+            # user may type IP instead username
+            peer = self.node.find_peer(username)
+            if not peer:
+                print(f"There's no user {username} in your contacts")
+                return
+            members.append(peer)
+
+        try:
+            room = self.node.join_room(name, members)
+        except ValueError as e:
+            print(e)
+            return
+        print(f"Room {room.name} has {len(room.members)} members")
+
+    def send_room_message(self, command: str):
+        parts = command.split(maxsplit=2)
+        if len(parts) != 3:
+            print("Usage: /room <room> <message>")
+            return
+
+        _, name, message = parts
+        if not self.node.rooms.get_room(name):
+            print("There's no such room, use /join first")
+            return
+        self.node.send_room_message(name, message)
+
     def add_contact(self, command: str):
         parts = command.split()
         if len(parts) != 4:
@@ -150,26 +232,58 @@ class Chat:
         print(f"Added {username} to contacts")
 
     def get_node(self) -> Node:
-        """Returns new Node instance, which depends on --local argument"""
+        """
+        Returns new Node instance, which depends on --local
+        and --async arguments
+        """
         port = self.config.server_port
         if self.args.port:
             port = self.args.port
+        node_class = AsyncNode if self.args.async_io else Node
+        receive_processes = self.config.receive_processes
+        if self.args.async_io and receive_processes > 1:
+            print("Receive processes aren't used with --async")
+            receive_processes = 1
 
         if self.args.local:
-            node = Node(
+            node = node_class(
                 port=port,
                 username=self.config.username,
                 public_ip="localhost",
-                is_console=self.args.console
+                is_console=self.args.console,
+                transfer_streams=self.config.transfer_streams,
+                compression=self.config.compression,
+                datagrams=self.config.datagrams,
+                receive_processes=receive_processes,
+                outbox_path=OUTBOX_FILE,
+                heartbeat_interval=self.config.heartbeat_interval,
+                discovery=self.config.discovery,
+                frame_rate=self.config.frame_rate,
+                byte_rate=self.config.byte_rate,
+                connections_per_ip=self.config.connections_per_ip,
+                over_limit=self.config.over_limit,
+                tls=self.config.tls
             )
         else:
             public_ip = socket.gethostbyname(socket.gethostname())
-            node = Node(
+            node = node_class(
                 host="0.0.0.0",
                 port=port,
                 username=self.config.username,
                 public_ip=public_ip,
-                is_console=self.args.console
+                is_console=self.args.console,
+                transfer_streams=self.config.transfer_streams,
+                compression=self.config.compression,
+                datagrams=self.config.datagrams,
+                receive_processes=receive_processes,
+                outbox_path=OUTBOX_FILE,
+                heartbeat_interval=self.config.heartbeat_interval,
+                discovery=self.config.discovery,
+                frame_rate=self.config.frame_rate,
+                byte_rate=self.config.byte_rate,
+                connections_per_ip=self.config.connections_per_ip,
+                over_limit=self.config.over_limit,
+                tls=self.config.tls
             )
 
             print(f"Your IPv4 in current wifi is {public_ip}. "
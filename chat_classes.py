@@ -1,5 +1,6 @@
 import json
 import os
+import re
 from datetime import datetime
 from typing import Literal
 
@@ -16,21 +17,41 @@ class Message:
             sender: Contact,
             sent_time: datetime,
             content: str,
-            message_type: Literal["text", "file"] = "text"
+            message_type: Literal["text", "file"] = "text",
+            room: str | None = None,
+            sequence: tuple[int, int] | None = None,
+            message_id: bytes | None = None
     ):
         self.sender = sender
         self.sent_time = sent_time
         self.content = content
         self.message_type = message_type
+        # name of room for group messages
+        self.room = room
+        # (session, number) which sender gave to message
+        self.sequence = sequence
+        # id of room message, which may come over several paths
+        self.message_id = message_id
+
+    def is_sent_after(self, other: "Message") -> bool:
+        """Checks if other message is from the same sender and earlier"""
+        return (self.sender == other.sender
+                and self.sequence is not None
+                and other.sequence is not None
+                and self.sequence[0] == other.sequence[0]
+                and self.sequence[1] > other.sequence[1])
 
     def to_dict(self):
         """Casts this object to dict for JSON serialization"""
-        return {
+        data = {
             "sender": self.sender.to_dict(),
             "sent_time": self.sent_time.strftime("%H:%M:%S"),
             "content": self.content,
             "type": self.message_type
         }
+        if self.room is not None:
+            data["room"] = self.room
+        return data
 
     @classmethod
     def from_dict(cls, data: dict):
@@ -39,7 +60,8 @@ class Message:
             Contact.from_dict(data["sender"]),
             datetime.strptime(data["sent_time"], "%H:%M:%S"),
             data["content"],
-            data["type"]
+            data["type"],
+            data.get("room")
         )
 
 
@@ -64,21 +86,46 @@ class ChatInfo:
 
 
 class ChatHistory:
-    """A class for single chat with messages"""
+    """A class for single chat with messages, either with peer or room"""
 
-    def __init__(self, contact: Contact, name: str = ""):
+    def __init__(
+            self,
+            contact: Contact | None,
+            name: str = "",
+            room: str | None = None
+    ):
         self.name = name
         self.contact = contact
+        self.room = room
         self.messages = list[Message]()
-        self._save_path = os.path.join(
-            HISTORY_DIR,
-            f"{contact.host.replace(".", "_")}.json"
-        )
+        if room is not None:
+            filename = f"room_{re.sub(r"[^\w-]", "_", room)}.json"
+        else:
+            filename = f"{contact.host.replace(".", "_")}.json"
+        self._save_path = os.path.join(HISTORY_DIR, filename)
         os.makedirs(HISTORY_DIR, exist_ok=True)
 
-    def add_message(self, message: Message):
-        """Adds a new message to messages"""
-        self.messages.append(message)
+    @property
+    def _default_name(self) -> str:
+        return self.room if self.room is not None else self.contact.username
+
+    def add_message(self, message: Message) -> int:
+        """
+        Adds a new message and returns its index. Message which came
+        after later ones of its sender is put before them, only the tail
+        of the chat is looked through for that
+        """
+        index = len(self.messages)
+        for i in range(len(self.messages) - 1, -1, -1):
+            other = self.messages[i]
+            if other.is_sent_after(message):
+                index = i
+            # own messages in chat with peer have its address too
+            elif (other.sender == message.sender
+                  and other.sender.username == message.sender.username):
+                break
+        self.messages.insert(index, message)
+        return index
 
     def load_chat(self):
         """Loads chat from file"""
@@ -95,15 +142,15 @@ class ChatHistory:
                         for item in loaded_info.messages
                     ]
                 else:
-                    self.name = self.contact.username
+                    self.name = self._default_name
                     self.messages = []
         except json.JSONDecodeError:
             print(f"Can't load from '{self._save_path}'")
-            self.name = self.contact.username
+            self.name = self._default_name
             self.messages = []
         except FileNotFoundError:
             print(f"File '{self._save_path}' doesn't exist")
-            self.name = self.contact.username
+            self.name = self._default_name
             self.messages = []
 
     def save_chat(self):
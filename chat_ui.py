@@ -1,5 +1,7 @@
 import os
+import queue
 import sys
+from concurrent.futures import Future
 from datetime import datetime
 from threading import Thread
 from tkinter import Tk, Listbox, Text, Toplevel, messagebox, ttk, filedialog
@@ -8,8 +10,16 @@ from tkinter.constants import BOTH, LEFT, RIGHT, WORD, TOP, X, Y, END
 from chat_classes import Message, ChatHistory
 from contacts import Contact, DEFAULT_NAME
 from node import Node
+from presence import ONLINE, OFFLINE, UNKNOWN
 from user_config import UserConfig
 
+# queued messages and files are given this long to be sent on exit
+EXIT_SEND_TIMEOUT = 5.0
+# how often presence of contacts in sidebar is updated and contacts
+# found on LAN are added to it, in milliseconds
+SIDEBAR_REFRESH_INTERVAL = 2000
+PRESENCE_MARKS = {ONLINE: "●", OFFLINE: "○", UNKNOWN: "-"}
+
 
 class ChatUI:
     """A class for chat UI with sidebar"""
@@ -49,6 +59,12 @@ class ChatUI:
             command=self.start_new_chat
         ).pack(pady=5)
 
+        ttk.Button(
+            self.sidebar,
+            text="New Room",
+            command=self.start_new_room
+        ).pack(pady=5)
+
         self.chat_frame = ttk.Frame(self.main_frame)
         self.chat_frame.pack(side=RIGHT, fill=BOTH, expand=True)
 
@@ -84,10 +100,13 @@ class ChatUI:
             command=self.send_message
         ).pack(side=RIGHT, padx=5)
 
-        # { friend: [messages] }
-        self.chats = dict[Contact, ChatHistory]()
+        # { friend or room name: [messages] }
+        self.chats = dict[Contact | str, ChatHistory]()
         self.load_chats()
-        self.active_chat: Contact | None = None
+        self.active_chat: Contact | str | None = None
+        # warnings of failed background sends, Tk is used only on its
+        # own thread, so sending threads put them here
+        self.failures = queue.Queue[str]()
 
         self.update_thread = Thread(
             target=self.receive_messages,
@@ -156,9 +175,13 @@ class ChatUI:
             sender: Contact,
             dialog: Toplevel = None,
             chat_name: str = "",
-            need_to_load: bool = False
+            need_to_load: bool = False,
+            is_contact: bool = True
     ):
-        """Adds a new chat to dict and UI chat list"""
+        """
+        Adds a new chat to dict and UI chat list,
+        its peer is saved to contacts if is_contact is True
+        """
         if sender in self.chats:
             messagebox.showwarning("Warning", "Chat already exists")
             return
@@ -170,17 +193,108 @@ class ChatUI:
         if dialog:
             dialog.destroy()
 
-        self.chat_list.insert(
-            END,
-            f"{self.chats[sender].name} ({sender.host}:{sender.port})"
-        )
+        self.chat_list.insert(END, self.chat_label(sender))
 
+        if not is_contact:
+            return
         self.node.contacts.update_peer(
             sender.host,
             sender.port,
             sender.username
         )
 
+    def start_new_room(self):
+        """
+        Creates a pop-up dialogue window
+        in which you type room name and its members
+        """
+        dialog = Toplevel(self.root)
+        dialog.title("New Room")
+        dialog.resizable(False, False)
+
+        ttk.Label(dialog, text="Room name:").grid(row=0, column=0)
+        room_name_entry = ttk.Entry(dialog)
+        room_name_entry.grid(row=0, column=1)
+
+        ttk.Label(dialog, text="Members:").grid(row=1, column=0)
+        members_entry = ttk.Entry(dialog)
+        members_entry.grid(row=1, column=1)
+
+        ttk.Button(
+            dialog,
+            text="Add",
+            command=lambda: self.handle_new_room(
+                room_name_entry.get(),
+                members_entry.get(),
+                dialog
+            )
+        ).grid(row=2, columnspan=2)
+
+    def handle_new_room(self, name: str, members: str, dialog: Toplevel):
+        """
+        Tries to create a room with inputted entry,
+        members are usernames or IPs of contacts separated by spaces
+        """
+        contacts = []
+        for username in members.split():
+            peer = self.node.find_peer(username)
+            if not peer:
+                messagebox.showerror("Error", f"Unknown contact {username}")
+                return
+            contacts.append(peer)
+
+        try:
+            room = self.node.join_room(name.strip(), contacts)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        if room.name not in self.chats:
+            self.add_room_chat(room.name)
+        dialog.destroy()
+
+    def add_room_chat(self, name: str, need_to_load: bool = False):
+        """Adds a room chat to dict and UI chat list"""
+        self.chats[name] = ChatHistory(None, name, room=name)
+        if need_to_load:
+            self.chats[name].load_chat()
+        self.chat_list.insert(END, self.chat_label(name))
+
+    def chat_label(self, chat: Contact | str) -> str:
+        """Returns sidebar line of chat, contacts are marked by presence"""
+        if isinstance(chat, str):
+            return f"# {chat}"
+        mark = PRESENCE_MARKS[self.node.presence.status(chat.self)]
+        label = f"{mark} {self.chats[chat].name} ({chat.host}:{chat.port})"
+        queued = self.node.outbox.queued(chat.self)
+        if queued:
+            label += f", {queued} queued"
+        return label
+
+    def refresh_sidebar(self):
+        """
+        Adds chats of contacts found on LAN, updates presence marks
+        and queued messages, shows failures of background sends
+        and schedules next update
+        """
+        self.show_failures()
+        for contact in list(self.node.contacts.contacts):
+            if contact not in self.chats:
+                self.add_new_chat(contact, need_to_load=True)
+        for (host, port), username in self.node.discovered_peers().items():
+            peer = Contact(host, port, username)
+            if peer not in self.chats:
+                self.add_new_chat(peer, chat_name=username,
+                                  need_to_load=True, is_contact=False)
+        selection = self.chat_list.curselection()
+        for index, chat in enumerate(self.chats):
+            label = self.chat_label(chat)
+            if self.chat_list.get(index) != label:
+                self.chat_list.delete(index)
+                self.chat_list.insert(index, label)
+                if index in selection:
+                    self.chat_list.selection_set(index)
+        self.root.after(SIDEBAR_REFRESH_INTERVAL, self.refresh_sidebar)
+
     def select_chat(self, event):
         """Calls on chat selection"""
         selection = self.chat_list.curselection()
@@ -203,6 +317,12 @@ class ChatUI:
 
     def add_message(self, msg: Message):
         """Adds new message to chat"""
+        if msg.room is not None:
+            if msg.room not in self.chats:
+                self.add_room_chat(msg.room)
+            self.show_message(msg.room, msg)
+            return
+
         if (msg.sender not in self.chats.keys()
                 and msg.sender.username != "You"):
             self.add_new_chat(msg.sender.self, chat_name=msg.sender.username)
@@ -211,9 +331,18 @@ class ChatUI:
                 self.chats[msg.sender].contact.username == DEFAULT_NAME):
             self.chats[msg.sender].contact.username = msg.sender.username
 
-        self.chats[msg.sender].add_message(msg)
+        self.show_message(msg.sender, msg)
 
-        if self.active_chat == msg.sender:
+    def show_message(self, chat: Contact | str, msg: Message):
+        """Adds message to chat history and text window if it's open"""
+        index = self.chats[chat].add_message(msg)
+        if self.active_chat != chat:
+            return
+
+        if index < len(self.chats[chat].messages) - 1:
+            # message came late and was put before later ones
+            self.update_chat_history()
+        else:
             self.history.configure(state="normal")
             self.history.insert(
                 END,
@@ -229,9 +358,23 @@ class ChatUI:
         and prints it to text window
         """
         message = self.entry.get()
-        if message and self.active_chat:
+        if message and isinstance(self.active_chat, str):
+            self.send_room_message(self.active_chat, message)
+        elif message and self.active_chat:
             host, port = self.active_chat.self
-            self.node.send_message(host, port, message)
+            try:
+                future = self.node.send_message_async(
+                    host, port, message, block=False
+                )
+            except queue.Full:
+                messagebox.showwarning(
+                    "Warning",
+                    "Too many messages are waiting to be sent, try later"
+                )
+                return
+
+            # message which failed stays in outbox and is counted
+            # as queued in sidebar until it is delivered or given up
             self.add_message(
                 Message(
                     Contact(
@@ -244,6 +387,20 @@ class ChatUI:
                 ))
             self.entry.delete(0, END)
 
+    def send_room_message(self, name: str, message: str):
+        """Sends message to room and prints it to text window"""
+        for future in self.node.send_room_message(name, message):
+            future.add_done_callback(lambda f: self.report_failure(
+                f, f"Message to room {name} wasn't passed on"
+            ))
+        self.add_message(Message(
+            Contact(self.node.public_ip, self.node.port, "You"),
+            datetime.now(),
+            message,
+            room=name
+        ))
+        self.entry.delete(0, END)
+
     def receive_messages(self):
         """Listens to new received messages"""
         while True:
@@ -255,21 +412,41 @@ class ChatUI:
         """Adds all chats from saved contacts"""
         for contact in self.node.contacts.contacts:
             self.add_new_chat(contact, need_to_load=True)
+        for name in self.node.rooms.rooms:
+            self.add_room_chat(name, need_to_load=True)
 
     def send_file(self):
         """
         Asks for file path and if it is not empty
         sends file to current selected chat
         """
+        if isinstance(self.active_chat, str):
+            messagebox.showwarning(
+                "Warning",
+                "Files can't be sent to rooms"
+            )
+            return
         path = filedialog.askopenfilename()
         if path != "":
-            self.node.send_file(
-                self.active_chat.host,
-                self.active_chat.port,
-                path
-            )
-
             filename = os.path.basename(path)
+            try:
+                future = self.node.send_file_async(
+                    self.active_chat.host,
+                    self.active_chat.port,
+                    path,
+                    block=False
+                )
+            except queue.Full:
+                messagebox.showwarning(
+                    "Warning",
+                    "Too many files are waiting to be sent, try later"
+                )
+                return
+
+            future.add_done_callback(lambda f: self.report_failure(
+                f, f"File {filename} wasn't sent"
+            ))
+
             self.add_message(Message(
                 Contact(
                     self.active_chat.host,
@@ -281,6 +458,34 @@ class ChatUI:
                 "file"
             ))
 
+    def report_failure(self, future: Future, text: str):
+        """
+        Queues warning if background send has failed.
+        Called from sending thread, the warning is shown by Tk loop
+        """
+        if future.cancelled() or not future.exception():
+            return
+        self.failures.put(f"{text}: {future.exception()}")
+
+    def show_failures(self):
+        """
+        Shows warnings queued by sending threads
+        and of messages outbox has given up on
+        """
+        while self.node.undelivered:
+            entry = self.node.undelivered.popleft()
+            chat = Contact(entry.peer_host, entry.peer_port)
+            name = (self.chats[chat].name if chat in self.chats
+                    else f"{entry.peer_host}:{entry.peer_port}")
+            self.failures.put(f"Message to {name} wasn't delivered: "
+                              f"{entry.body}")
+        while True:
+            try:
+                text = self.failures.get_nowait()
+            except queue.Empty:
+                return
+            messagebox.showwarning("Warning", text)
+
     def change_username(self):
         """Creates new dialogue window to change username"""
         dialog = Toplevel(self.root)
@@ -322,12 +527,15 @@ class ChatUI:
         """Runs chat"""
         self.update_thread.start()
         self.receive_messages_thread.start()
+        self.root.after(SIDEBAR_REFRESH_INTERVAL, self.refresh_sidebar)
         self.root.mainloop()
 
     def on_close(self):
         """Calls on app close"""
         self.root.destroy()
+        self.node.wait_for_sends(EXIT_SEND_TIMEOUT)
         self.node.contacts.save_contacts()
+        self.node.rooms.save_rooms()
         for chat in self.chats.values():
             chat.save_chat()
         self.node.close()
@@ -0,0 +1,60 @@
+import zlib
+
+from framing import encode_frame
+
+# set in frame type byte when payload is compressed with zlib
+COMPRESSED_FLAG = 0x80
+# fast level, compression must keep up with LAN speed
+COMPRESSION_LEVEL = 1
+# smaller payloads don't win enough to pay for compression
+MIN_COMPRESS_SIZE = 256
+# beginning of file which is compressed to decide if the rest is worth it
+SAMPLE_SIZE = 64 * 1024
+# compressed sample must be at most this part of original
+MAX_COMPRESSED_RATIO = 0.9
+# no frame is that big uncompressed, so bigger output is a zip bomb
+MAX_DECOMPRESSED_SIZE = 16 * 1024 * 1024
+
+
+def is_compressible(sample: bytes | memoryview) -> bool:
+    """
+    Checks if data is worth compressing by compressing its sample.
+    Archives, images and video are already compressed and don't shrink
+    """
+    if len(sample) < MIN_COMPRESS_SIZE:
+        return False
+    compressed = zlib.compress(sample, COMPRESSION_LEVEL)
+    return len(compressed) <= len(sample) * MAX_COMPRESSED_RATIO
+
+
+def encode_compressed_frame(
+        msg_type: int,
+        payload: bytes | memoryview
+) -> bytes:
+    """
+    Returns frame with compressed payload,
+    or a plain one if payload doesn't shrink
+    """
+    if len(payload) >= MIN_COMPRESS_SIZE:
+        compressed = zlib.compress(payload, COMPRESSION_LEVEL)
+        if len(compressed) < len(payload):
+            return encode_frame(msg_type | COMPRESSED_FLAG, compressed)
+    return encode_frame(msg_type, bytes(payload))
+
+
+def decompress_payload(
+        payload: bytes | memoryview,
+        max_size: int = MAX_DECOMPRESSED_SIZE
+) -> bytes:
+    """
+    Returns original payload, raises ValueError if it is malformed
+    or over max_size
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, max_size)
+    except zlib.error as e:
+        raise ValueError(f"Malformed compressed payload: {e}") from e
+    if decompressor.unconsumed_tail or not decompressor.eof:
+        raise ValueError("Compressed payload is truncated or too big")
+    return data
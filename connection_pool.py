@@ -0,0 +1,202 @@
+import select
+import socket
+import ssl
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Iterator
+
+from tls import TlsContext
+
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_IDLE_TIMEOUT = 60.0
+DEFAULT_CONNECT_TIMEOUT = 5.0
+
+
+class PooledConnection:
+    """A single long-lived connection to peer"""
+
+    def __init__(self, address: tuple[str, int], sock: socket.socket):
+        self.address = address
+        self.sock = sock
+        self.last_used = time.monotonic()
+        self.lock = Lock()
+
+    def is_alive(self) -> bool:
+        """
+        Checks that peer hasn't closed the connection while it was idle,
+        so a frame isn't written into an already dead socket
+        """
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError, TypeError):
+            return False
+        if not readable:
+            return True
+        if isinstance(self.sock, ssl.SSLSocket):
+            # TLS can't peek, but peer sends nothing except
+            # session tickets over pooled connections
+            try:
+                return TlsContext.read_tickets(self.sock)
+            except OSError:
+                return False
+        try:
+            return self.sock.recv(1, socket.MSG_PEEK) != b""
+        except BlockingIOError:
+            return True
+        except OSError:
+            return False
+
+    def close(self):
+        """Closes connection socket"""
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """A pool of outbound connections to peers keyed by (host, port)"""
+
+    def __init__(
+            self,
+            max_connections: int = DEFAULT_MAX_CONNECTIONS,
+            idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+            connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+            wrap: Callable[[socket.socket, tuple[str, int]],
+                           socket.socket] | None = None
+    ):
+        if max_connections < 1:
+            raise ValueError(f"Max connections must be positive, "
+                             f"but was:{max_connections}")
+
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        # wraps new connections, such as in TLS, within connect timeout
+        self.wrap = wrap
+        self._connections = OrderedDict[tuple[str, int], PooledConnection]()
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._connections)
+
+    def send(self, host: str, port: int, data: bytes):
+        """
+        Sends data over pooled connection to peer.
+        If the connection turns out to be broken, reconnects once
+        and sends data again
+        """
+        try:
+            with self.connection(host, port) as sock:
+                sock.sendall(data)
+        except (BrokenPipeError, ConnectionResetError,
+                ConnectionAbortedError):
+            with self.connection(host, port) as sock:
+                sock.sendall(data)
+
+    @contextmanager
+    def connection(self, host: str, port: int) -> Iterator[socket.socket]:
+        """
+        Gives exclusive access to connection with peer.
+        Connection is dropped from pool if an error occurs while it is used
+        """
+        pooled = self._acquire((host, port))
+        try:
+            yield pooled.sock
+        except BaseException:
+            self._discard(pooled)
+            raise
+        else:
+            pooled.last_used = time.monotonic()
+        finally:
+            pooled.lock.release()
+            # connections opened above the cap are used only once
+            if not self._is_pooled(pooled):
+                pooled.close()
+
+    def evict_idle(self):
+        """Closes connections which weren't used for idle_timeout seconds"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                pooled for pooled in self._connections.values()
+                if now - pooled.last_used > self.idle_timeout
+                and pooled.lock.acquire(blocking=False)
+            ]
+            for pooled in expired:
+                del self._connections[pooled.address]
+        for pooled in expired:
+            pooled.close()
+            pooled.lock.release()
+
+    def close(self):
+        """Closes all pooled connections"""
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for pooled in connections:
+            pooled.close()
+
+    def _acquire(self, address: tuple[str, int]) -> PooledConnection:
+        """Returns locked connection to address, opens it if necessary"""
+        self.evict_idle()
+        with self._lock:
+            pooled = self._connections.get(address)
+            if pooled:
+                self._connections.move_to_end(address)
+
+        if pooled:
+            pooled.lock.acquire()
+            if pooled.is_alive() and self._is_pooled(pooled):
+                return pooled
+            self._discard(pooled)
+            pooled.lock.release()
+
+        pooled = PooledConnection(address, self._connect(address))
+        pooled.lock.acquire()
+        with self._lock:
+            if address not in self._connections:
+                self._make_room()
+                if len(self._connections) < self.max_connections:
+                    self._connections[address] = pooled
+        return pooled
+
+    def _make_room(self):
+        """Evicts least recently used idle connections to respect the cap"""
+        for address in list(self._connections):
+            if len(self._connections) < self.max_connections:
+                return
+            pooled = self._connections[address]
+            if pooled.lock.acquire(blocking=False):
+                del self._connections[address]
+                pooled.close()
+                pooled.lock.release()
+
+    def _is_pooled(self, pooled: PooledConnection) -> bool:
+        with self._lock:
+            return self._connections.get(pooled.address) is pooled
+
+    def _discard(self, pooled: PooledConnection):
+        """Removes connection from pool and closes it"""
+        with self._lock:
+            if self._connections.get(pooled.address) is pooled:
+                del self._connections[pooled.address]
+        pooled.close()
+
+    def _connect(self, address: tuple[str, int]) -> socket.socket:
+        """Opens new connection to peer"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(self.connect_timeout)
+            sock.connect(address)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.wrap:
+                sock = self.wrap(sock, address)
+            sock.settimeout(None)
+        except BaseException:
+            sock.close()
+            raise
+        return sock
@@ -1,6 +1,8 @@
 import json
 import os
 
+from presence import PresenceTable
+
 CONTACTS_FILE = "contacts.json"
 DEFAULT_NAME = "JohnDoe"
 
@@ -12,11 +14,14 @@ class Contact:
             self,
             host: str,
             port: int,
-            username: str = DEFAULT_NAME
+            username: str = DEFAULT_NAME,
+            fingerprint: str | None = None
     ):
         self.host = host
         self.port = port
         self.username = username
+        # certificate of peer pinned on first TLS connection to it
+        self.fingerprint = fingerprint
         self.self = (host, port)
 
     def __eq__(self, other):
@@ -33,13 +38,15 @@ class Contact:
         return {
             "host": self.host,
             "port": self.port,
-            "username": self.username
+            "username": self.username,
+            "fingerprint": self.fingerprint
         }
 
     @classmethod
     def from_dict(cls, data: dict):
         """Creates a friend from JSON data"""
-        return cls(data["host"], data["port"], data["username"])
+        return cls(data["host"], data["port"], data["username"],
+                   data.get("fingerprint"))
 
     def __hash__(self):
         return hash(self.self)
@@ -80,15 +87,18 @@ class Contacts:
         """Adds new contact to base"""
         self.contacts.append(contact)
 
-    def print_contacts(self):
-        """Prints all contacts"""
+    def print_contacts(self, presence: PresenceTable | None = None):
+        """Prints all contacts, with their status if presence is given"""
         if len(self.contacts) == 0:
             print("No available contacts")
             return
 
         for i, contact in enumerate(self.contacts):
+            status = ""
+            if presence is not None:
+                status = f" - {presence.describe(contact.self)}"
             print(f"{i + 1}. {contact.username} "
-                  f"({contact.host}:{contact.port})")
+                  f"({contact.host}:{contact.port}){status}")
 
     def get_contact_by_host(self, host: str) -> Contact | None:
         """Returns contact by host"""
@@ -97,6 +107,13 @@ class Contacts:
                 return peer
         return None
 
+    def get_contact_by_address(self, host: str, port: int) -> Contact | None:
+        """Returns contact by host and port"""
+        for peer in self.contacts:
+            if peer.self == (host, port):
+                return peer
+        return None
+
     def get_contact_by_username(self, username: str) -> Contact | None:
         """Returns contact by username"""
         for peer in self.contacts:
@@ -110,6 +127,50 @@ class Contacts:
         if host not in hosts:
             self.contacts.append(Contact(host, port, username))
 
+    def relocate(
+            self,
+            username: str,
+            host: str,
+            port: int,
+            fingerprint: str
+    ) -> bool:
+        """
+        Moves contact with username to address where peer announcing
+        it on LAN was reached, if its certificate is the pinned one.
+        Contact without pin isn't moved, as anyone could announce
+        its username. Returns False if contact has another certificate
+        """
+        if (username == DEFAULT_NAME
+                or self.get_contact_by_address(host, port)):
+            return True
+        for i, contact in enumerate(self.contacts):
+            if (contact.username == username
+                    and contact.fingerprint is not None):
+                if contact.fingerprint != fingerprint:
+                    return False
+                self.contacts[i] = Contact(host, port, username,
+                                           fingerprint)
+                return True
+        return True
+
+    def pin(self, host: str, port: int, fingerprint: str) -> bool:
+        """
+        Checks certificate fingerprint of contact at host and port,
+        pins it if contact has none yet. Returns False on mismatch
+        """
+        for contact in self.contacts:
+            if contact.self == (host, port):
+                if contact.fingerprint is None:
+                    contact.fingerprint = fingerprint
+                return contact.fingerprint == fingerprint
+        return True
+
+    def is_pinned(self, host: str, port: int) -> bool:
+        """Checks if contact at host and port has a pinned certificate"""
+        return any(contact.self == (host, port)
+                   and contact.fingerprint is not None
+                   for contact in self.contacts)
+
     def clear(self):
         """Clears all contacts"""
         self.contacts = list[Contact]()
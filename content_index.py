@@ -0,0 +1,142 @@
+import json
+import os
+import shutil
+from collections import OrderedDict
+from threading import Lock
+
+INDEX_FILE = ".content_index.json"
+MAX_INDEXED_FILES = 1024
+
+
+def link_or_copy(source: str, target: str):
+    """
+    Makes target have the content of source, by hardlink if the file
+    system allows it, otherwise by copy. Existing target is replaced
+    """
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return
+    # file appears under its name only when it is complete
+    temp_path = target + ".tmp"
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ContentIndex:
+    """
+    Files in downloads which were received by chunks, keyed by their
+    transfer id, which is a hash of their content. A file sent again
+    is taken from here instead of over the network. Entry is valid
+    while the file keeps its size and modification time
+    """
+
+    def __init__(self, downloads_path: str):
+        self.downloads_path = downloads_path
+        self.path = os.path.join(downloads_path, INDEX_FILE)
+        self._entries = OrderedDict[str, dict]()
+        self._lock = Lock()
+        with self._lock:
+            self._load()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def add(self, content_id: bytes, path: str):
+        """Records file with given content, which is in downloads"""
+        file_stat = os.stat(path)
+        with self._lock:
+            # other receiving processes may have added files meanwhile
+            self._load()
+            key = content_id.hex()
+            self._entries.pop(key, None)
+            self._entries[key] = {
+                "file": os.path.basename(path),
+                "size": file_stat.st_size,
+                "mtime_ns": file_stat.st_mtime_ns
+            }
+            while len(self._entries) > MAX_INDEXED_FILES:
+                self._entries.popitem(last=False)
+            self._save()
+
+    def find(self, content_id: bytes, size: int) -> str | None:
+        """Returns path of unchanged file with given content if any"""
+        key = content_id.hex()
+        with self._lock:
+            if key not in self._entries:
+                self._load()
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+
+            path = os.path.join(self.downloads_path, entry["file"])
+            try:
+                file_stat = os.stat(path)
+            except OSError:
+                file_stat = None
+            if (file_stat and file_stat.st_size == size == entry["size"]
+                    and file_stat.st_mtime_ns == entry["mtime_ns"]):
+                return path
+
+            del self._entries[key]
+            self._save()
+            return None
+
+    def materialize(
+            self,
+            content_id: bytes,
+            size: int,
+            filename: str
+    ) -> str | None:
+        """
+        Creates file with given content under filename in downloads
+        from the one which is already there. Returns its path,
+        or None if there is no such content or it can't be done
+        """
+        source = self.find(content_id, size)
+        if not source:
+            return None
+        target = os.path.join(self.downloads_path,
+                              os.path.basename(filename))
+        try:
+            link_or_copy(source, target)
+            self.add(content_id, target)
+        except OSError as e:
+            print(f"Can't reuse {source} for {filename}: {e}")
+            return None
+        return target
+
+    def _load(self):
+        """Reads entries from file, keeping them if it can't be read"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                content = f.read()
+            entries = json.loads(content) if content.strip() else {}
+            self._entries = OrderedDict(
+                (key, {"file": entry["file"], "size": entry["size"],
+                       "mtime_ns": entry["mtime_ns"]})
+                for key, entry in entries.items()
+            )
+        except (OSError, json.JSONDecodeError, KeyError, TypeError,
+                AttributeError):
+            print(f"Can't load from '{self.path}'")
+
+    def _save(self):
+        # receiving processes share the index, each writes its own
+        # temporary file
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self._entries, f, indent=4)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Can't save content index: {e}")
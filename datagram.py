@@ -0,0 +1,94 @@
+import itertools
+import os
+import socket
+import struct
+from threading import Event, Lock
+
+from gossip import SeenMessages
+
+KIND_DATA = 0x01
+KIND_ACK = 0x02
+# kind, session of sender and sequence number of datagram
+DATAGRAM_HEADER = struct.Struct("!BII")
+# datagrams stay below usual MTU, so they are never fragmented
+MAX_DATAGRAM_SIZE = 1200
+MAX_DATAGRAM_FRAME = MAX_DATAGRAM_SIZE - DATAGRAM_HEADER.size
+# first wait for ack, it doubles on every retransmit
+RETRANSMIT_TIMEOUT = 0.05
+MAX_ATTEMPTS = 4
+
+
+class DatagramChannel:
+    """
+    Sends small frames as UDP datagrams, each one is retransmitted
+    until peer acknowledges it. Received datagrams are acknowledged
+    and their duplicates are dropped
+    """
+
+    def __init__(self, sock: socket.socket):
+        self._socket = sock
+        # peer tells apart datagrams of this node and of its restarts
+        self._session = int.from_bytes(os.urandom(4))
+        self._sequence = itertools.count()
+        # { sequence number: set when datagram is acknowledged }
+        self._pending = dict[int, Event]()
+        self._lock = Lock()
+        self._seen = SeenMessages()
+
+    def send(self, frame: bytes, address: tuple[str, int]) -> bool:
+        """
+        Sends frame and waits for ack,
+        returns False if peer didn't acknowledge it
+        """
+        if len(frame) > MAX_DATAGRAM_FRAME:
+            raise ValueError(f"Frame doesn't fit in datagram: "
+                             f"{len(frame)} bytes")
+        with self._lock:
+            sequence = next(self._sequence) & 0xFFFFFFFF
+            acked = self._pending[sequence] = Event()
+        datagram = DATAGRAM_HEADER.pack(KIND_DATA, self._session,
+                                        sequence) + frame
+        timeout = RETRANSMIT_TIMEOUT
+        try:
+            for _ in range(MAX_ATTEMPTS):
+                self._socket.sendto(datagram, address)
+                if acked.wait(timeout):
+                    return True
+                timeout *= 2
+            return False
+        finally:
+            with self._lock:
+                del self._pending[sequence]
+
+    def handle(
+            self,
+            datagram: bytes | memoryview,
+            address: tuple[str, int]
+    ) -> memoryview | None:
+        """
+        Processes received datagram and returns frame
+        if it is seen for the first time.
+        Raises ValueError if datagram is malformed
+        """
+        if len(datagram) < DATAGRAM_HEADER.size:
+            raise ValueError(f"Datagram is too short: {len(datagram)} bytes")
+        kind, session, sequence = DATAGRAM_HEADER.unpack_from(datagram)
+
+        if kind == KIND_ACK:
+            if session == self._session:
+                with self._lock:
+                    acked = self._pending.get(sequence)
+                if acked:
+                    acked.set()
+            return None
+        if kind != KIND_DATA:
+            raise ValueError(f"Unknown datagram kind: {kind}")
+
+        # ack is sent for duplicates too, as the previous one may be lost
+        self._socket.sendto(
+            DATAGRAM_HEADER.pack(KIND_ACK, session, sequence), address
+        )
+        key = bytes(datagram[1:DATAGRAM_HEADER.size]) + address[0].encode()
+        if not self._seen.add(key):
+            return None
+        return memoryview(datagram)[DATAGRAM_HEADER.size:]
@@ -0,0 +1,235 @@
+import random
+import socket
+import struct
+import time
+from threading import Event, Lock, Thread
+from typing import Callable
+
+# every node on LAN joins this group, announces go to one fixed port
+DISCOVERY_GROUP = "239.255.42.99"
+DISCOVERY_PORT = 8765
+DISCOVERY_MAGIC = b"P2PD"
+DISCOVERY_VERSION = 1
+# magic, version, session of node, chat port and seconds until
+# announcement expires, username follows
+ANNOUNCEMENT_HEADER = struct.Struct("!4sBIHH")
+MAX_ANNOUNCEMENT_SIZE = 512
+# node announces itself this often while there are few peers
+ANNOUNCE_INTERVAL = 10.0
+# with more peers each node announces less often, so the whole LAN
+# sends about this many announcements per second
+MAX_GROUP_RATE = 20.0
+# announcements are spread this much around their interval
+ANNOUNCE_JITTER = 0.2
+# peer is dropped after missing this many of its announcements
+MISSED_ANNOUNCEMENTS = 3
+# receiving thread checks this often if service was stopped
+DISCOVERY_POLL_INTERVAL = 0.5
+
+
+def announce_interval(peers: int) -> float:
+    """Returns how often node announces itself when it knows of peers"""
+    return max(ANNOUNCE_INTERVAL, (peers + 1) / MAX_GROUP_RATE)
+
+
+class Announcement:
+    """Node telling LAN which port it chats on"""
+
+    def __init__(self, session: int, port: int, username: str, ttl: int):
+        self.session = session
+        self.port = port
+        self.username = username
+        # seconds the announcement is valid for
+        self.ttl = ttl
+
+    def encode(self) -> bytes:
+        """Casts announcement to a datagram"""
+        return ANNOUNCEMENT_HEADER.pack(
+            DISCOVERY_MAGIC, DISCOVERY_VERSION, self.session, self.port,
+            min(self.ttl, 0xFFFF)
+        ) + self.username.encode("utf-8")
+
+    @classmethod
+    def decode(cls, data: bytes | memoryview):
+        """
+        Creates announcement from a datagram.
+        Raises ValueError if it isn't a valid announcement
+        """
+        if len(data) < ANNOUNCEMENT_HEADER.size:
+            raise ValueError(f"Announcement is too short: "
+                             f"{len(data)} bytes")
+        magic, version, session, port, ttl = \
+            ANNOUNCEMENT_HEADER.unpack_from(data)
+        if magic != DISCOVERY_MAGIC or version != DISCOVERY_VERSION:
+            raise ValueError("Not a discovery announcement")
+        username = bytes(data[ANNOUNCEMENT_HEADER.size:]).decode("utf-8")
+        if not username or " " in username or port == 0 or ttl == 0:
+            raise ValueError("Announcement has invalid fields")
+        return cls(session, port, username, ttl)
+
+
+class DiscoveredPeer:
+    def __init__(self, username: str, expires: float):
+        self.username = username
+        self.expires = expires
+
+
+class PeerTable:
+    """Peers heard on LAN, each one expires when it stops announcing"""
+
+    def __init__(self):
+        self._peers = dict[tuple[str, int], DiscoveredPeer]()
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._peers)
+
+    def update(
+            self,
+            peer: tuple[str, int],
+            username: str,
+            ttl: float,
+            now: float | None = None
+    ) -> bool:
+        """Records announcement, returns True if peer is new or renamed"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            known = self._peers.get(peer)
+            self._peers[peer] = DiscoveredPeer(username, now + ttl)
+            return known is None or known.username != username
+
+    def expire(self, now: float | None = None) -> list[tuple[str, int]]:
+        """Drops peers which stopped announcing and returns them"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            expired = [peer for peer, discovered in self._peers.items()
+                       if discovered.expires <= now]
+            for peer in expired:
+                del self._peers[peer]
+            return expired
+
+    def peers(self) -> dict[tuple[str, int], str]:
+        """Returns usernames of live peers by their address"""
+        with self._lock:
+            return {peer: discovered.username
+                    for peer, discovered in self._peers.items()}
+
+
+class DiscoveryService:
+    """
+    Announces node to LAN over UDP multicast and listens to
+    announcements of others. on_peer(host, port, username, is_new)
+    is called for every announcement heard
+    """
+
+    def __init__(
+            self,
+            session: int,
+            identity: Callable[[], tuple[int, str]],
+            on_peer: Callable[[str, int, str, bool], None],
+            group: str = DISCOVERY_GROUP,
+            port: int = DISCOVERY_PORT
+    ):
+        self.session = session
+        # returns (port, username), username may change while running
+        self._identity = identity
+        self._on_peer = on_peer
+        self.group = group
+        self.port = port
+        self.table = PeerTable()
+        self._socket: socket.socket | None = None
+        self._stopped = Event()
+
+    def start(self) -> bool:
+        """
+        Joins multicast group and starts announcing,
+        returns False if LAN doesn't allow it
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM,
+                             socket.IPPROTO_UDP)
+        try:
+            # several nodes on one host share the discovery port
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, "SO_REUSEPORT"):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(("", self.port))
+            membership = struct.pack("4s4s", socket.inet_aton(self.group),
+                                     socket.inet_aton("0.0.0.0"))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                            membership)
+            # announcements stay on LAN
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            sock.settimeout(DISCOVERY_POLL_INTERVAL)
+        except OSError as e:
+            sock.close()
+            print(f"Can't discover peers on LAN: {e}")
+            return False
+        self._socket = sock
+        Thread(target=self._run, daemon=True).start()
+        return True
+
+    def stop(self):
+        """Stops announcing and listening"""
+        self._stopped.set()
+        if self._socket:
+            self._socket.close()
+
+    def announcement(self) -> Announcement:
+        """Returns announcement of node, valid for a few intervals"""
+        port, username = self._identity()
+        ttl = (announce_interval(len(self.table)) * (1 + ANNOUNCE_JITTER)
+               * MISSED_ANNOUNCEMENTS)
+        return Announcement(self.session, port, username, round(ttl))
+
+    def handle(self, data: bytes | memoryview, address: tuple[str, int]):
+        """
+        Adds peer of received announcement to table.
+        Raises ValueError if datagram isn't a valid announcement
+        """
+        announcement = Announcement.decode(data)
+        if announcement.session == self.session:
+            return
+        # peer is reached on the address its announcement came from,
+        # as that is up to date when it changes networks
+        host = address[0]
+        is_new = self.table.update((host, announcement.port),
+                                   announcement.username, announcement.ttl)
+        self._on_peer(host, announcement.port, announcement.username,
+                      is_new)
+
+    def _run(self):
+        """Announces node and handles announcements until stopped"""
+        # first announcement is delayed a bit, so nodes starting
+        # together don't flood the group
+        next_announce = time.monotonic() + random.uniform(0.0, 1.0)
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            if now >= next_announce:
+                try:
+                    self._socket.sendto(self.announcement().encode(),
+                                        (self.group, self.port))
+                except OSError:
+                    if self._stopped.is_set():
+                        break
+                # nodes which started together drift apart
+                next_announce = now + (
+                    announce_interval(len(self.table))
+                    * random.uniform(1 - ANNOUNCE_JITTER, 1 + ANNOUNCE_JITTER)
+                )
+                self.table.expire(now)
+
+            try:
+                data, address = self._socket.recvfrom(MAX_ANNOUNCEMENT_SIZE)
+            except TimeoutError:
+                continue
+            except OSError:
+                break
+            try:
+                self.handle(data, address)
+            except ValueError:
+                # other software may use the group too
+                continue
+            except Exception as e:
+                print(f"Error while discovering peers: {e}")
@@ -0,0 +1,150 @@
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Callable
+
+# data received over one connection and not yet written stays below it
+MAX_QUEUED_BYTES = 4 * 1024 * 1024
+
+
+class WriterStats:
+    """Queue depth and stalls of disk writers, shared by connections"""
+
+    def __init__(self):
+        self.queued_chunks = 0
+        self.queued_bytes = 0
+        self.max_queued_bytes = 0
+        self.written_bytes = 0
+        # times reader waited for a full queue and how long in total
+        self.stalls = 0
+        self.stall_time = 0.0
+        self._lock = Lock()
+
+    def queued(self, size: int):
+        with self._lock:
+            self.queued_chunks += 1
+            self.queued_bytes += size
+            self.max_queued_bytes = max(self.max_queued_bytes,
+                                        self.queued_bytes)
+
+    def written(self, size: int):
+        with self._lock:
+            self.queued_chunks -= 1
+            self.queued_bytes -= size
+            self.written_bytes += size
+
+    def stalled(self, duration: float):
+        with self._lock:
+            self.stalls += 1
+            self.stall_time += duration
+
+    def summary(self) -> str:
+        """Returns report in one line"""
+        with self._lock:
+            return (f"Disk writes: {self.queued_chunks} chunks "
+                    f"({self.queued_bytes / 1024:.0f} KiB) queued, "
+                    f"{self.max_queued_bytes / 1024:.0f} KiB at most, "
+                    f"{self.written_bytes / 1024 / 1024:.1f} MiB written, "
+                    f"reading stalled {self.stalls} times for "
+                    f"{self.stall_time * 1000:.1f} ms")
+
+
+class DiskWriter:
+    """
+    Writes received file data on its own thread, so socket reads
+    go on while disk is busy. When too much data is queued, submit
+    blocks and the connection stops being read until disk catches up.
+    Jobs run in order they were submitted
+    """
+
+    def __init__(
+            self,
+            stats: WriterStats | None = None,
+            max_queued_bytes: int = MAX_QUEUED_BYTES
+    ):
+        if max_queued_bytes < 1:
+            raise ValueError(f"Max queued bytes must be positive, "
+                             f"but was:{max_queued_bytes}")
+        self.max_queued_bytes = max_queued_bytes
+        self.stats = stats or WriterStats()
+        self._jobs = deque[tuple[Callable[[], object], int]]()
+        self._queued_bytes = 0
+        self._error: BaseException | None = None
+        self._is_closed = False
+        self._condition = Condition()
+        # thread is started with the first job, most connections
+        # carry only text
+        self._thread: Thread | None = None
+
+    def submit(self, job: Callable[[], object], size: int):
+        """
+        Queues job writing size bytes, waits while queue is full.
+        Raises error of a job which has failed before
+        """
+        with self._condition:
+            self._raise_error()
+            if self._is_closed:
+                raise RuntimeError("Disk writer is closed")
+            if self._is_full(size):
+                started = time.monotonic()
+                while self._is_full(size) and self._error is None:
+                    self._condition.wait()
+                self.stats.stalled(time.monotonic() - started)
+                self._raise_error()
+
+            self._jobs.append((job, size))
+            self._queued_bytes += size
+            self.stats.queued(size)
+            if self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self):
+        """Waits until queued jobs are done, raises error of failed one"""
+        with self._condition:
+            while self._jobs and self._error is None:
+                self._condition.wait()
+            self._raise_error()
+
+    def close(self):
+        """Finishes queued jobs and stops thread, errors are dropped"""
+        with self._condition:
+            self._is_closed = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread:
+            thread.join()
+
+    def _is_full(self, size: int) -> bool:
+        # a single job bigger than limit is let in when queue is empty
+        return (self._queued_bytes > 0
+                and self._queued_bytes + size > self.max_queued_bytes)
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        """Runs jobs until writer is closed and queue is drained"""
+        while True:
+            with self._condition:
+                while not self._jobs and not self._is_closed:
+                    self._condition.wait()
+                if not self._jobs:
+                    return
+                # job stays queued until done, so flush waits for it
+                job, size = self._jobs[0]
+
+            try:
+                job()
+            except Exception as e:
+                with self._condition:
+                    if self._error is None:
+                        self._error = e
+
+            with self._condition:
+                self._jobs.popleft()
+                self._queued_bytes -= size
+                self.stats.written(size)
+                self._condition.notify_all()
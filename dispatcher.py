@@ -0,0 +1,131 @@
+import queue
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition
+from typing import Callable, Hashable
+
+DEFAULT_WORKERS = 8
+DEFAULT_QUEUE_DEPTH = 256
+
+
+class OutboundDispatcher:
+    """
+    Runs sends in background threads. Every peer has its own FIFO queue,
+    which is served by one worker at a time, so jobs for one peer keep
+    their order while a slow peer doesn't hold up the others
+    """
+
+    def __init__(
+            self,
+            max_workers: int = DEFAULT_WORKERS,
+            max_queue_depth: int = DEFAULT_QUEUE_DEPTH
+    ):
+        if max_workers < 1:
+            raise ValueError(f"Max workers must be positive, "
+                             f"but was:{max_workers}")
+        if max_queue_depth < 1:
+            raise ValueError(f"Max queue depth must be positive, "
+                             f"but was:{max_queue_depth}")
+
+        self.max_queue_depth = max_queue_depth
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="outbound"
+        )
+        # { peer: jobs waiting to be sent }
+        self._queues = dict[Hashable, deque[tuple[Future, Callable]]]()
+        # peers which have a worker draining their queue
+        self._active = set[Hashable]()
+        self._changed = Condition()
+        self._is_closed = False
+
+    def submit(
+            self,
+            peer: Hashable,
+            job: Callable[[], object],
+            block: bool = True,
+            timeout: float | None = None
+    ) -> Future:
+        """
+        Queues job for peer and returns future of its result.
+        If peer queue is full, waits for free space when block is True,
+        raises queue.Full if there is still no space
+        """
+        with self._changed:
+            if self._is_closed:
+                raise RuntimeError("Dispatcher is closed")
+
+            jobs = self._queues.setdefault(peer, deque())
+            if len(jobs) >= self.max_queue_depth:
+                if not block:
+                    raise queue.Full(f"Queue to {peer} is full")
+                if not self._changed.wait_for(
+                        lambda: (len(jobs) < self.max_queue_depth
+                                 or self._is_closed),
+                        timeout
+                ):
+                    raise queue.Full(f"Queue to {peer} is full")
+                if self._is_closed:
+                    raise RuntimeError("Dispatcher is closed")
+
+            future = Future()
+            jobs.append((future, job))
+            if peer not in self._active:
+                self._active.add(peer)
+                self._executor.submit(self._drain, peer)
+        return future
+
+    def pending(self, peer: Hashable | None = None) -> int:
+        """Returns count of queued jobs for peer or for all peers"""
+        with self._changed:
+            if peer is not None:
+                return len(self._queues.get(peer, ()))
+            return sum(len(jobs) for jobs in self._queues.values())
+
+    def join(self, timeout: float | None = None) -> bool:
+        """
+        Waits until every queued job has finished,
+        returns False on timeout
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: not self._active, timeout)
+
+    def close(self, timeout: float = 0.0):
+        """
+        Stops accepting jobs, gives queued ones timeout seconds
+        to be sent and cancels the rest
+        """
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            self._is_closed = True
+            self._changed.notify_all()
+        self.join(max(0.0, deadline - time.monotonic()))
+
+        with self._changed:
+            for jobs in self._queues.values():
+                for future, _ in jobs:
+                    future.cancel()
+                jobs.clear()
+            self._changed.notify_all()
+        self._executor.shutdown(wait=False)
+
+    def _drain(self, peer: Hashable):
+        """Runs jobs of peer one by one until its queue is empty"""
+        while True:
+            with self._changed:
+                jobs = self._queues.get(peer)
+                if not jobs:
+                    self._queues.pop(peer, None)
+                    self._active.discard(peer)
+                    self._changed.notify_all()
+                    return
+                future, job = jobs.popleft()
+                self._changed.notify_all()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job())
+            except BaseException as e:
+                future.set_exception(e)
@@ -0,0 +1,147 @@
+import os
+import select
+import socket
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
+RECV_BUFFER_SIZE = 256 * 1024
+PIPE_SIZE = 1024 * 1024
+# os.splice exists on Linux only
+SPLICE_AVAILABLE = hasattr(os, "splice")
+
+_seek_lock = Lock()
+
+
+def write_at(fd: int, data: bytes | memoryview, offset: int):
+    """Writes all data to file descriptor at given offset"""
+    written = 0
+    while written < len(data):
+        if hasattr(os, "pwrite"):
+            written += os.pwrite(fd, data[written:], offset + written)
+        else:
+            # Windows has no pwrite, so seek and write must not interleave
+            with _seek_lock:
+                os.lseek(fd, offset + written, os.SEEK_SET)
+                written += os.write(fd, data[written:])
+
+
+def read_at(fd: int, size: int, offset: int) -> bytes:
+    """Reads size bytes from file descriptor at given offset"""
+    if hasattr(os, "pread"):
+        return os.pread(fd, size, offset)
+    with _seek_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+class DirectReceiver:
+    """
+    Moves file payload from socket to file without keeping it in Python.
+    On Linux data goes socket -> pipe -> file with os.splice inside kernel,
+    elsewhere it is received with recv_into into one preallocated buffer
+    """
+
+    def __init__(self, use_splice: bool = SPLICE_AVAILABLE):
+        self.use_splice = use_splice
+        self._pipe: tuple[int, int] | None = None
+        self._buffer: memoryview | None = None
+
+    def receive(
+            self,
+            conn: socket.socket,
+            fd: int,
+            count: int,
+            timeout: float | None = None,
+            offset: int | None = None
+    ):
+        """
+        Writes exactly count bytes from conn to file descriptor fd,
+        at given offset or at the current position if offset is None
+        """
+        if self.use_splice:
+            self._splice(conn, fd, count, timeout, offset)
+        else:
+            self._recv_into(conn, fd, count, offset)
+
+    def close(self):
+        """Frees pipe used for splicing"""
+        if self._pipe:
+            for pipe_fd in self._pipe:
+                os.close(pipe_fd)
+            self._pipe = None
+
+    def _splice(
+            self,
+            conn: socket.socket,
+            fd: int,
+            count: int,
+            timeout: float | None,
+            offset: int | None
+    ):
+        """Moves data with os.splice through a pipe"""
+        read_end, write_end = self._get_pipe()
+        while count > 0:
+            try:
+                moved = os.splice(
+                    conn.fileno(), write_end, min(count, PIPE_SIZE),
+                    flags=os.SPLICE_F_MOVE
+                )
+            except BlockingIOError:
+                # sockets with timeout are non-blocking under the hood
+                readable, _, _ = select.select([conn], [], [], timeout)
+                if not readable:
+                    raise TimeoutError("Peer stopped sending file data")
+                continue
+
+            if moved == 0:
+                raise ConnectionError("Connection closed in the middle "
+                                      "of file data")
+            count -= moved
+            while moved > 0:
+                spliced = os.splice(read_end, fd, moved, offset_dst=offset,
+                                    flags=os.SPLICE_F_MOVE)
+                moved -= spliced
+                if offset is not None:
+                    offset += spliced
+
+    def _recv_into(
+            self,
+            conn: socket.socket,
+            fd: int,
+            count: int,
+            offset: int | None
+    ):
+        """Receives data into preallocated buffer and writes it to file"""
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(RECV_BUFFER_SIZE))
+        while count > 0:
+            received = conn.recv_into(
+                self._buffer, min(count, len(self._buffer))
+            )
+            if received == 0:
+                raise ConnectionError("Connection closed in the middle "
+                                      "of file data")
+            count -= received
+            if offset is None:
+                written = 0
+                while written < received:
+                    written += os.write(fd, self._buffer[written:received])
+            else:
+                write_at(fd, self._buffer[:received], offset)
+                offset += received
+
+    def _get_pipe(self) -> tuple[int, int]:
+        """Returns pipe for splicing, creates it on first use"""
+        if not self._pipe:
+            self._pipe = os.pipe()
+            try:
+                fcntl.fcntl(self._pipe[1], fcntl.F_SETPIPE_SZ, PIPE_SIZE)
+            except (AttributeError, OSError):
+                # default pipe size works too, just with more syscalls
+                pass
+        return self._pipe
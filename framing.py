@@ -0,0 +1,237 @@
+import struct
+from typing import Iterator
+
+MSG_TYPE_TEXT = 0x01
+MSG_TYPE_FILE_META = 0x02
+MSG_TYPE_FILE_DATA = 0x03
+MSG_TYPE_FILE_END = 0x04
+MSG_TYPE_MANIFEST = 0x05
+MSG_TYPE_FILE_RANGE = 0x06
+MSG_TYPE_HAVE = 0x07
+MSG_TYPE_BATCH = 0x08
+MSG_TYPE_ROOM = 0x09
+MSG_TYPE_ACK = 0x0A
+MSG_TYPE_HEARTBEAT = 0x0B
+MSG_TYPE_TEXT_CHUNK = 0x0C
+
+# type byte and 4-byte big-endian payload length
+FRAME_HEADER = struct.Struct("!BI")
+HEADER_SIZE = FRAME_HEADER.size
+# frame types which consist of the type byte only
+BARE_FRAME_TYPES = frozenset({MSG_TYPE_FILE_END})
+# batch payload is a sequence of length-prefixed text payloads
+BATCH_ITEM_LENGTH = struct.Struct("!I")
+
+DEFAULT_BUFFER_SIZE = 65536
+EMPTY_PAYLOAD = memoryview(b"")
+
+# high bit of type marks compressed payload
+TYPE_MASK = 0x7F
+# frames longer than this for their type are refused before their
+# payload is buffered, so a bad length prefix can't exhaust memory
+DEFAULT_MAX_FRAME_SIZE = 64 * 1024
+MAX_FRAME_SIZES = {
+    MSG_TYPE_TEXT: 1024 * 1024,
+    MSG_TYPE_FILE_META: 64 * 1024,
+    MSG_TYPE_FILE_DATA: 16 * 1024 * 1024,
+    MSG_TYPE_MANIFEST: 16 * 1024 * 1024,
+    MSG_TYPE_FILE_RANGE: 16 * 1024 * 1024,
+    MSG_TYPE_HAVE: 1024 * 1024,
+    MSG_TYPE_BATCH: 2 * 1024 * 1024,
+    MSG_TYPE_ROOM: 2 * 1024 * 1024,
+    MSG_TYPE_ACK: 64 * 1024,
+    MSG_TYPE_HEARTBEAT: 64 * 1024,
+    MSG_TYPE_TEXT_CHUNK: 128 * 1024
+}
+
+# longer text is streamed in chunks of this size to peers which
+# accept it, instead of being sent in a single frame
+TEXT_CHUNK_SIZE = 64 * 1024
+# flags byte followed by the next part of text payload
+TEXT_CHUNK_HEADER = struct.Struct("!B")
+TEXT_CHUNK_LAST = 0x01
+# streamed text is dropped once it grows over this size
+MAX_TEXT_SIZE = 16 * 1024 * 1024
+
+
+class FrameTooLarge(ValueError):
+    """Frame header announces more payload than its type may have"""
+
+
+def encode_frame(msg_type: int, payload: bytes = b"") -> bytes:
+    """Returns frame with given type and payload ready to be sent"""
+    if msg_type in BARE_FRAME_TYPES:
+        return bytes([msg_type])
+    return FRAME_HEADER.pack(msg_type, len(payload)) + payload
+
+
+def encode_batch(payloads: list[bytes]) -> bytes:
+    """Packs several text payloads into payload of one batch frame"""
+    return b"".join(
+        BATCH_ITEM_LENGTH.pack(len(payload)) + payload
+        for payload in payloads
+    )
+
+
+def encode_text_chunks(payload: bytes) -> list[bytes]:
+    """Splits text payload into payloads of text chunk frames"""
+    chunks = []
+    for offset in range(0, len(payload), TEXT_CHUNK_SIZE):
+        is_last = offset + TEXT_CHUNK_SIZE >= len(payload)
+        chunks.append(
+            TEXT_CHUNK_HEADER.pack(TEXT_CHUNK_LAST if is_last else 0)
+            + payload[offset:offset + TEXT_CHUNK_SIZE]
+        )
+    return chunks
+
+
+def decode_batch(payload: bytes | memoryview) -> Iterator[memoryview]:
+    """Yields text payloads of batch, raises ValueError if it is cut"""
+    view = memoryview(payload)
+    offset = 0
+    while offset < len(view):
+        if offset + BATCH_ITEM_LENGTH.size > len(view):
+            raise ValueError("Truncated batch item length")
+        (length,) = BATCH_ITEM_LENGTH.unpack_from(view, offset)
+        offset += BATCH_ITEM_LENGTH.size
+        if offset + length > len(view):
+            raise ValueError("Truncated batch item")
+        yield view[offset:offset + length]
+        offset += length
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of frames received from a stream.
+    Data is kept in one growable bytearray and frames are returned
+    as memoryviews of it, so payloads are never copied.
+    Frames over max_sizes of their type raise FrameTooLarge
+    """
+
+    def __init__(
+            self,
+            buffer_size: int = DEFAULT_BUFFER_SIZE,
+            max_sizes: dict[int, int] | None = None
+    ):
+        self.max_sizes = MAX_FRAME_SIZES if max_sizes is None else max_sizes
+        self._buffer = bytearray(max(buffer_size, HEADER_SIZE))
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def pending(self) -> bytes:
+        """Returns a copy of data which isn't a complete frame yet"""
+        return bytes(self._view[self._start:self._end])
+
+    def feed(self, data: bytes | memoryview):
+        """Appends received data to the buffer"""
+        size = len(data)
+        self._reserve(size)
+        self._view[self._end:self._end + size] = data
+        self._end += size
+
+    def writable(self, size: int = DEFAULT_BUFFER_SIZE) -> memoryview:
+        """
+        Returns free space for at least size bytes,
+        so data can be received straight into the buffer with recv_into.
+        Call commit() with the number of bytes written afterwards
+        """
+        self._reserve(size)
+        return self._view[self._end:]
+
+    def commit(self, size: int):
+        """Marks size bytes written to writable() view as received"""
+        if size < 0 or self._end + size > len(self._buffer):
+            raise ValueError(f"Can't commit {size} bytes, only "
+                             f"{len(self._buffer) - self._end} are free")
+        self._end += size
+
+    def frames(self) -> Iterator[tuple[int, memoryview]]:
+        """
+        Yields (msg_type, payload) for every complete frame in buffer.
+        Payload is valid only until the next call of feed() or writable()
+        """
+        while self._start < self._end:
+            msg_type = self._buffer[self._start]
+            # bare frames have no length, so the next frame follows
+            # right after the type byte
+            if msg_type in BARE_FRAME_TYPES:
+                self._start += 1
+                yield msg_type, EMPTY_PAYLOAD
+                continue
+
+            if self._end - self._start < HEADER_SIZE:
+                break
+            _, length = FRAME_HEADER.unpack_from(self._buffer, self._start)
+            self._check_size(msg_type, length)
+            frame_end = self._start + HEADER_SIZE + length
+            if frame_end > self._end:
+                break
+
+            payload = self._view[self._start + HEADER_SIZE:frame_end]
+            self._start = frame_end
+            yield msg_type, payload
+
+        if self._start == self._end:
+            self._start = self._end = 0
+
+    def partial_frame(self) -> tuple[int, int, memoryview] | None:
+        """
+        Returns type, number of missing payload bytes and the payload
+        received so far of the incomplete frame at the start of buffer,
+        if its header has already arrived
+        """
+        if self._end - self._start < HEADER_SIZE:
+            return None
+        msg_type, length = FRAME_HEADER.unpack_from(self._buffer, self._start)
+        if msg_type in BARE_FRAME_TYPES:
+            return None
+        missing = self._start + HEADER_SIZE + length - self._end
+        if missing <= 0:
+            return None
+        return (msg_type, missing,
+                self._view[self._start + HEADER_SIZE:self._end])
+
+    def take_partial_payload(self) -> memoryview:
+        """
+        Removes the incomplete frame from buffer and returns the part
+        of its payload received so far. The caller has to read the rest
+        of payload from the stream itself
+        """
+        payload = self._view[self._start + HEADER_SIZE:self._end]
+        self._start = self._end = 0
+        return payload
+
+    def _check_size(self, msg_type: int, length: int):
+        max_size = self.max_sizes.get(msg_type & TYPE_MASK,
+                                      DEFAULT_MAX_FRAME_SIZE)
+        if length > max_size:
+            raise FrameTooLarge(f"Frame of type {msg_type:#x} has "
+                                f"{length} bytes, at most {max_size} "
+                                f"are allowed")
+
+    def _reserve(self, size: int):
+        """
+        Makes room for size more bytes after the pending data.
+        Pending data is moved to the beginning of buffer or,
+        if it still doesn't fit, to a new bigger buffer
+        """
+        if self._end + size <= len(self._buffer):
+            return
+
+        pending = self._end - self._start
+        if pending + size <= len(self._buffer):
+            self._view[:pending] = self._view[self._start:self._end]
+        else:
+            new_size = len(self._buffer)
+            while new_size < pending + size:
+                new_size *= 2
+            new_buffer = bytearray(new_size)
+            new_buffer[:pending] = self._view[self._start:self._end]
+            self._buffer = new_buffer
+            self._view = memoryview(new_buffer)
+        self._start = 0
+        self._end = pending
@@ -0,0 +1,235 @@
+import json
+import math
+import os
+import random
+import struct
+from collections import OrderedDict
+from threading import Lock
+
+from contacts import Contact
+
+ROOMS_FILE = "rooms.json"
+MESSAGE_ID_SIZE = 16
+# every node passes a room message on to this many members
+DEFAULT_FANOUT = 3
+MAX_ROOM_MEMBERS = 64
+SEEN_MESSAGES_LIMIT = 8192
+
+# message id, hops left and members count, followed by room name,
+# members and envelope of the author
+ROOM_HEADER = struct.Struct("!16sBB")
+SHORT_LENGTH = struct.Struct("!B")
+PORT = struct.Struct("!H")
+
+
+def gossip_ttl(members: int, fanout: int = DEFAULT_FANOUT) -> int:
+    """
+    Returns hops enough for a message to reach every member
+    with high probability, a couple of spare rounds included
+    """
+    if members <= 1 or fanout <= 1:
+        return max(1, members)
+    return math.ceil(math.log(members, fanout)) + 2
+
+
+class Room:
+    """A group chat without server, its messages spread by gossip"""
+
+    def __init__(self, name: str, members: list[Contact] | None = None):
+        if not name or len(name.encode("utf-8")) > 255:
+            raise ValueError(f"Room name must have 1-255 bytes, "
+                             f"but was:{name!r}")
+        self.name = name
+        self.members = list[Contact]()
+        for member in members or []:
+            self.add_member(member)
+
+    def __repr__(self):
+        return f"Room:{self.name} ({len(self.members)} members)"
+
+    def add_member(self, member: Contact) -> bool:
+        """Adds member if room has place for it, returns True if added"""
+        if member in self.members or len(self.members) >= MAX_ROOM_MEMBERS:
+            return False
+        self.members.append(member)
+        return True
+
+    def pick_targets(
+            self,
+            exclude: set[Contact],
+            fanout: int = DEFAULT_FANOUT
+    ) -> list[Contact]:
+        """Returns random members to pass message to"""
+        candidates = [member for member in self.members
+                      if member not in exclude]
+        return random.sample(candidates, min(fanout, len(candidates)))
+
+    def to_dict(self):
+        """Casts this object to dict for JSON serialization"""
+        return {
+            "name": self.name,
+            "members": [member.to_dict() for member in self.members]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Creates a room from JSON data"""
+        return cls(data["name"], [
+            Contact.from_dict(member) for member in data["members"]
+        ])
+
+
+class RoomMessage:
+    """A room frame: text of author with room info needed to spread it"""
+
+    def __init__(
+            self,
+            message_id: bytes,
+            ttl: int,
+            room: Room,
+            envelope: bytes | memoryview
+    ):
+        self.message_id = message_id
+        self.ttl = ttl
+        self.room = room
+        self.envelope = envelope
+
+    def encode(self) -> bytes:
+        """Casts this message to bytes, members travel with it"""
+        parts = [
+            ROOM_HEADER.pack(self.message_id, self.ttl,
+                             len(self.room.members)),
+            self._short(self.room.name)
+        ]
+        for member in self.room.members:
+            parts.append(self._short(member.host))
+            parts.append(PORT.pack(member.port))
+            parts.append(self._short(member.username))
+        parts.append(bytes(self.envelope))
+        return b"".join(parts)
+
+    @classmethod
+    def decode(cls, data: bytes | memoryview):
+        """Creates a message from bytes, raises ValueError if malformed"""
+        data = memoryview(data)
+        try:
+            message_id, ttl, count = ROOM_HEADER.unpack_from(data)
+            offset = ROOM_HEADER.size
+            name, offset = cls._read_short(data, offset)
+            room = Room(name)
+            for _ in range(count):
+                host, offset = cls._read_short(data, offset)
+                (port,) = PORT.unpack_from(data, offset)
+                username, offset = cls._read_short(data, offset + PORT.size)
+                room.add_member(Contact(host, port, username))
+        except (struct.error, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed room message: {e}") from e
+        return cls(bytes(message_id), ttl, room, data[offset:])
+
+    def forwarded(self, room: Room) -> "RoomMessage":
+        """Returns copy to pass on, with one hop less"""
+        return RoomMessage(self.message_id, self.ttl - 1, room,
+                           self.envelope)
+
+    @staticmethod
+    def _short(value: str) -> bytes:
+        encoded = value.encode("utf-8")
+        if len(encoded) > 255:
+            raise ValueError(f"Field is longer than 255 bytes: {value!r}")
+        return SHORT_LENGTH.pack(len(encoded)) + encoded
+
+    @staticmethod
+    def _read_short(data: memoryview, offset: int) -> tuple[str, int]:
+        (length,) = SHORT_LENGTH.unpack_from(data, offset)
+        start = offset + SHORT_LENGTH.size
+        if start + length > len(data):
+            raise struct.error("field is cut off")
+        return str(data[start:start + length], "utf-8"), start + length
+
+
+class SeenMessages:
+    """
+    Ids of recently seen room messages. The oldest ids are forgotten,
+    by then the message has long stopped spreading. Copies of a message
+    may arrive on several threads at once, so only one of them is new
+    """
+
+    def __init__(self, limit: int = SEEN_MESSAGES_LIMIT):
+        self.limit = limit
+        self._ids = OrderedDict[bytes, None]()
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+    def __contains__(self, message_id: bytes):
+        with self._lock:
+            return message_id in self._ids
+
+    def add(self, message_id: bytes) -> bool:
+        """Remembers id, returns False if it was already seen"""
+        with self._lock:
+            if message_id in self._ids:
+                self._ids.move_to_end(message_id)
+                return False
+            self._ids[message_id] = None
+            if len(self._ids) > self.limit:
+                self._ids.popitem(last=False)
+            return True
+
+
+class Rooms:
+    """A class for rooms this node is member of"""
+
+    def __init__(self):
+        self.rooms = dict[str, Room]()
+        # rooms others have added this node to, they aren't saved
+        # until the user joins them
+        self.invited = dict[str, Room]()
+        self.load_rooms()
+
+    def load_rooms(self):
+        """Loads rooms from file"""
+        if not os.path.exists(ROOMS_FILE):
+            return
+        try:
+            with open(ROOMS_FILE, "r") as f:
+                content = f.read()
+                if content.strip():
+                    self.rooms = {
+                        room.name: room
+                        for room in map(Room.from_dict, json.loads(content))
+                    }
+        except (json.JSONDecodeError, KeyError, ValueError):
+            print(f"Can't load from '{ROOMS_FILE}'")
+            self.rooms = {}
+
+    def save_rooms(self):
+        """Saves rooms to file"""
+        with open(ROOMS_FILE, "w") as f:
+            json.dump([room.to_dict() for room in self.rooms.values()],
+                      f, indent=4)
+
+    def get_room(self, name: str) -> Room | None:
+        """Returns room by name"""
+        return self.rooms.get(name)
+
+    def join(self, name: str, members: list[Contact]) -> Room:
+        """
+        Creates room or adds members to existing one,
+        room this node was invited to is accepted
+        """
+        room = self.rooms.setdefault(name,
+                                     self.invited.pop(name, None)
+                                     or Room(name))
+        for member in members:
+            room.add_member(member)
+        return room
+
+    def invite(self, name: str, members: list[Contact]) -> Room:
+        """Records room others have added this node to"""
+        room = self.invited.setdefault(name, Room(name))
+        for member in members:
+            room.add_member(member)
+        return room
@@ -19,6 +19,12 @@ parser.add_argument(
     type=int,
     help="Port to run the application on"
 )
+parser.add_argument(
+    "-a", "--async",
+    action="store_true",
+    dest="async_io",
+    help="Serve peers on an asyncio event loop"
+)
 args = parser.parse_args()
 
 if __name__ == "__main__":
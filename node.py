@@ -1,26 +1,109 @@
 import os
-import re
 import socket
-from collections import deque
+import stat
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from threading import Event, Lock, Thread, local
+from typing import BinaryIO, Callable, Iterable
 
+from batching import MessageBatch
+from broadcast import BroadcastReport, BroadcastResult
 from chat_classes import Message
+from compression import COMPRESSED_FLAG, SAMPLE_SIZE, \
+    decompress_payload, encode_compressed_frame, is_compressible
+from connection_pool import ConnectionPool
+from content_index import ContentIndex
 from contacts import Contacts, Contact
+from datagram import DatagramChannel, MAX_DATAGRAM_FRAME, \
+    MAX_DATAGRAM_SIZE
+from discovery import DiscoveryService
+from disk_writer import DiskWriter, WriterStats
+from dispatcher import OutboundDispatcher
+from file_receiver import DirectReceiver, SPLICE_AVAILABLE, read_at, \
+    write_at
+from gossip import Room, RoomMessage, Rooms, SeenMessages, \
+    DEFAULT_FANOUT, MESSAGE_ID_SIZE, gossip_ttl
+from framing import FrameDecoder, MSG_TYPE_TEXT, MSG_TYPE_FILE_META, \
+    MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END, MSG_TYPE_MANIFEST, \
+    MSG_TYPE_FILE_RANGE, MSG_TYPE_HAVE, MSG_TYPE_BATCH, MSG_TYPE_ROOM, \
+    MSG_TYPE_ACK, MSG_TYPE_HEARTBEAT, MSG_TYPE_TEXT_CHUNK, FRAME_HEADER, \
+    MAX_FRAME_SIZES, MAX_TEXT_SIZE, TEXT_CHUNK_HEADER, TEXT_CHUNK_LAST, \
+    TEXT_CHUNK_SIZE, TYPE_MASK, DEFAULT_MAX_FRAME_SIZE, decode_batch, \
+    encode_batch, encode_frame, encode_text_chunks
+from outbox import Outbox, OutboxEntry, MAX_ATTEMPTS
+from presence import PresenceTable, HEARTBEAT_INTERVAL, ONLINE
+from rate_limit import RateLimiter, BYTE_RATE, FRAME_RATE, \
+    MAX_CONNECTIONS_PER_IP, POLICY_DELAY, POLICY_DISCONNECT, POLICY_DROP
+from reorder import ReorderBuffer
+from tls import TlsContext, CertificateMismatch, CERT_FILE, KEY_FILE
+from receive_workers import ReceiveWorkers, EVENT_ACK, EVENT_TEXT, \
+    supports_reuse_port
+from transfers import IncomingFile, IncomingTransfer, Manifest, \
+    TransferTable, RANGE_HEADER, HAVE_HEADER, MAX_ACTIVE_TRANSFERS, \
+    cached_manifest, decode_bitmap, encode_bitmap, split_ranges
+from wire import Envelope, MESSAGE_REGEX, HEADER_REGEX, LEGACY_VERSION, \
+    WIRE_VERSION, FLAG_ACKS, FLAG_BATCH, FLAG_COMPRESSION, FLAG_DATAGRAM, \
+    FLAG_STREAMED_TEXT
 
-MESSAGE_REGEX = re.compile(
-    r"SENDER:(?P<username>[^ ]+?) "
-    r"(?P<host>[^:]+?):(?P<port>\d+?)"
-    r" \| MESSAGE:(?P<message>.+)",
-    re.DOTALL)
-HEADER_REGEX = re.compile(
-    r"SENDER:(?P<username>[^ ]+?) "
-    r"(?P<host>[^:]+?):(?P<port>\d+?)"
-    r" \| FILENAME:(?P<filename>.+)")
+# inbound connections are long-lived, so a silent peer is dropped
+# only after it was idle for a while
+CONNECTION_IDLE_TIMEOUT = 300.0
+# receiving thread checks this often if node was closed
+DATAGRAM_POLL_INTERVAL = 0.5
+WORKER_POLL_INTERVAL = 0.5
+# how often messages waiting for missing ones are checked
+REORDER_CHECK_INTERVAL = 0.1
+# outbox is saved and checked for due messages at least this often
+OUTBOX_CHECK_INTERVAL = 1.0
+# only text frames, their acks and heartbeats are accepted in datagrams
+DATAGRAM_FRAME_TYPES = frozenset({MSG_TYPE_TEXT, MSG_TYPE_BATCH,
+                                  MSG_TYPE_ROOM, MSG_TYPE_ACK,
+                                  MSG_TYPE_HEARTBEAT})
+# receiver buffers a whole frame, so sendfile() frames are large
+# enough to make per-frame overhead negligible, but not more
+SENDFILE_FRAME_SIZE = 1024 * 1024
+RECV_SIZE = 64 * 1024
+# rest of a file data frame at least this big bypasses the frame buffer
+DIRECT_RECEIVE_THRESHOLD = 64 * 1024
+DEFAULT_TRANSFER_STREAMS = 4
+# files at least this big are sent by chunks listed in a manifest,
+# so an interrupted transfer can be resumed
+CHUNKED_TRANSFER_THRESHOLD = 4 * 1024 * 1024
+# smaller files are sent over a single connection
+PARALLEL_TRANSFER_THRESHOLD = 16 * 1024 * 1024
+# sender asks which chunks are still missing this many times at most
+MAX_TRANSFER_ROUNDS = 3
+REPLY_TIMEOUT = 30.0
+# ids of finished transfers remembered to answer late manifests
+COMPLETED_TRANSFERS_LIMIT = 256
+# how often transfers which stopped receiving data are looked for
+TRANSFER_SWEEP_INTERVAL = 30.0
 
-MSG_TYPE_TEXT = 0x01
-MSG_TYPE_FILE_META = 0x02
-MSG_TYPE_FILE_DATA = 0x03
-MSG_TYPE_FILE_END = 0x04
+
+class ReceiveState:
+    """State of a single inbound connection"""
+
+    def __init__(
+            self,
+            reply: Callable[[bytes], object] | None = None,
+            writer: DiskWriter | None = None,
+            peer_host: str | None = None
+    ):
+        self.reply = reply
+        # traffic of connection is rate limited by IP of peer, if known
+        self.peer_host = peer_host
+        # without writer file data is written on receiving thread
+        self.writer = writer
+        self.current_file: IncomingFile | None = None
+        # data of a file refused because of receive limit is skipped
+        self.skip_file = False
+        # text being streamed in chunks, which is dropped if too long
+        self.text_stream: bytearray | None = None
+        self.skip_text = False
+        self.transfers = set[IncomingTransfer]()
 
 
 class Node:
@@ -32,7 +115,24 @@ class Node:
             port: int = 8000,
             username: str = "JohnDoe",
             public_ip: str = "192.168.0.0",
-            is_console: bool = False
+            is_console: bool = False,
+            transfer_streams: int = DEFAULT_TRANSFER_STREAMS,
+            max_receives: int = MAX_ACTIVE_TRANSFERS,
+            compression: bool = True,
+            datagrams: bool = True,
+            receive_processes: int = 1,
+            outbox_path: str | None = None,
+            heartbeat_interval: float = HEARTBEAT_INTERVAL,
+            discovery: bool = False,
+            frame_rate: float = FRAME_RATE,
+            byte_rate: float = BYTE_RATE,
+            connections_per_ip: int = MAX_CONNECTIONS_PER_IP,
+            over_limit: str = POLICY_DELAY,
+            frame_limits: dict[int, int] | None = None,
+            max_text_size: int = MAX_TEXT_SIZE,
+            tls: bool = False,
+            cert_path: str = CERT_FILE,
+            key_path: str = KEY_FILE
     ):
         if not isinstance(host, str):
             raise ValueError(f"Host must be string, but was:{host} "
@@ -46,206 +146,1944 @@ class Node:
         if not isinstance(public_ip, str):
             raise ValueError(f"Public IP must be string, but was:{public_ip} "
                              f"{type(public_ip)}")
+        if not isinstance(transfer_streams, int) or transfer_streams < 1:
+            raise ValueError(f"Transfer streams must be positive integer, "
+                             f"but was:{transfer_streams}")
+        if not isinstance(max_receives, int) or max_receives < 1:
+            raise ValueError(f"Max receives must be positive integer, "
+                             f"but was:{max_receives}")
+        if not isinstance(compression, bool):
+            raise ValueError(f"Compression must be boolean, "
+                             f"but was:{compression} {type(compression)}")
+        if not isinstance(datagrams, bool):
+            raise ValueError(f"Datagrams must be boolean, "
+                             f"but was:{datagrams} {type(datagrams)}")
+        if not isinstance(receive_processes, int) or receive_processes < 1:
+            raise ValueError(f"Receive processes must be positive integer, "
+                             f"but was:{receive_processes}")
+        if receive_processes > 1 and not supports_reuse_port():
+            raise ValueError("Several receive processes need SO_REUSEPORT, "
+                             "which this system doesn't support")
+        if receive_processes > 1 and port == 0:
+            raise ValueError("Several receive processes need a fixed port")
+        if (not isinstance(heartbeat_interval, (int, float))
+                or heartbeat_interval <= 0):
+            raise ValueError(f"Heartbeat interval must be positive, "
+                             f"but was:{heartbeat_interval}")
+        if not isinstance(discovery, bool):
+            raise ValueError(f"Discovery must be boolean, "
+                             f"but was:{discovery} {type(discovery)}")
+        for msg_type, size in (frame_limits or {}).items():
+            if not isinstance(size, int) or size < 1:
+                raise ValueError(f"Max size of frame type {msg_type} must "
+                                 f"be positive integer, but was:{size}")
+        if not isinstance(max_text_size, int) or max_text_size < 1:
+            raise ValueError(f"Max text size must be positive integer, "
+                             f"but was:{max_text_size}")
+        if not isinstance(tls, bool):
+            raise ValueError(f"TLS must be boolean, "
+                             f"but was:{tls} {type(tls)}")
 
         self.host = host
         self.port = port
         self.username = username
         self.public_ip = public_ip
+        self.transfer_streams = transfer_streams
+        self.compression = compression
+        # small text frames are sent over UDP to peers which accept it,
+        # except with TLS, as datagrams aren't encrypted
+        self.datagrams = datagrams and not tls
+        # processes which accept connections and decode frames
+        self.receive_processes = receive_processes
+        # announce node on LAN and add peers found there to contacts
+        self.discovery = discovery
+        self._discovery: DiscoveryService | None = None
+        # node of a receiving process leaves sends to main process
+        self._is_worker = False
+        # limits of inbound traffic per source IP, so a flooding peer
+        # can't make memory and CPU use of node grow without bound
+        self.limiter = RateLimiter(frame_rate, byte_rate,
+                                   connections_per_ip, over_limit)
+        # { frame type: max payload size }, bigger frames are refused
+        # before they are buffered and their connection is closed
+        self.frame_limits = {**MAX_FRAME_SIZES, **(frame_limits or {})}
+        # longer text streamed in chunks is dropped
+        self.max_text_size = max_text_size
+        # all TCP traffic is encrypted if set, raises OSError
+        # if there is no certificate and it can't be created
+        self._tls = TlsContext(cert_path, key_path) if tls else None
+        self._cert_path = cert_path
+        self._key_path = key_path
         self.contacts = Contacts()
+        self.rooms = Rooms()
+        self.room_fanout = DEFAULT_FANOUT
         self.new_messages = deque[Message]()
+        # messages outbox has given up on, for UI to report
+        self.undelivered = deque[OutboxEntry]()
         self.self = (host, port)
+        # { (host, port): wire version of frames received from peer }
+        self.peer_versions = dict[tuple[str, int], int]()
+        # { (host, port): envelope flags peer has announced }
+        self.peer_flags = dict[tuple[str, int], int]()
 
         self._is_running = True
+        self._closed = Event()
         self._is_console = is_console
         self._server_socket = socket.socket(
             socket.AF_INET,
             socket.SOCK_STREAM
         )
-        self._current_file: dict | None = None
+        self._pool = ConnectionPool(
+            wrap=self._wrap_client if self._tls else None
+        )
+        self._datagram_socket = socket.socket(
+            socket.AF_INET,
+            socket.SOCK_DGRAM
+        )
+        self._datagram_channel = DatagramChannel(self._datagram_socket)
+        # acks come to listening socket, so UDP is used only after that
+        self._datagram_listening = Event()
+        self._dispatcher = OutboundDispatcher()
+        # { (host, port): messages waiting to be sent together }
+        self._batches = dict[tuple[str, int], MessageBatch]()
+        self._batches_lock = Lock()
+        self._connections = set[socket.socket]()
+        self._connections_lock = Lock()
+        # every inbound connection is served by its own thread,
+        # so its state is kept per thread
+        self._local = local()
+        # files being received, both in order and by chunks
+        self._transfers = TransferTable(max_receives)
+        # { transfer id: path of received file }
+        self._completed_transfers = OrderedDict[bytes, str]()
+        self._transfers_lock = Lock()
+        # { downloads path: files received there by content }
+        self._content_indexes = dict[str, ContentIndex]()
+        # queue depth and stalls of disk writers of all connections
+        self.disk_stats = WriterStats()
+        # text messages are numbered per peer within session of node
+        self._session = int.from_bytes(os.urandom(4))
+        self._sequence_numbers = dict[tuple[str, int], int]()
+        self._sequence_lock = Lock()
+        self._reorder = ReorderBuffer()
+        self._delivery_lock = Lock()
+        # text messages waiting for acks, kept in outbox_path if given.
+        # Messages left by previous run are sent again in this session
+        self.outbox = Outbox(outbox_path)
+        self.outbox.load(self._new_sequence)
+        self._outbox_changed = Event()
+        # { (host, port): numbers of received messages to acknowledge }
+        self._pending_acks = dict[tuple[str, int], list[tuple[int, int]]]()
+        self._acks_lock = Lock()
+        # which peers are online, contacts are sent heartbeats to know it
+        self.presence = PresenceTable(heartbeat_interval)
+        # contacts heartbeated over TCP take turns beyond pool places
+        self._heartbeat_turn = 0
+        # ids of room messages already shown and passed on
+        self._seen_messages = SeenMessages()
+        self._rooms_lock = Lock()
+
+    @property
+    def _state(self) -> ReceiveState:
+        state = getattr(self._local, "state", None)
+        if state is None:
+            state = self._local.state = ReceiveState()
+        return state
+
+    @_state.setter
+    def _state(self, value: ReceiveState | None):
+        self._local.state = value
+
+    @property
+    def _current_file(self) -> IncomingFile | None:
+        return self._state.current_file
+
+    @_current_file.setter
+    def _current_file(self, value: IncomingFile | None):
+        self._state.current_file = value
 
     def send_message(self, peer_host: str, peer_port: int, message: str):
-        """Sends a text message to peer"""
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            try:
-                s.connect((peer_host, peer_port))
-                message = (f"SENDER:{self.username} "
-                           f"{self.public_ip}:{self.port} | "
-                           f"MESSAGE:{message}")
-                message_bytes = message.encode("utf-8")
-                data = (bytes([MSG_TYPE_TEXT])
-                        + len(message_bytes).to_bytes(4, "big")
-                        + message_bytes)
-                s.sendall(data)
-            except ConnectionError as e:
+        """
+        Sends a text message to peer over pooled connection.
+        Message stays in outbox until peer acknowledges it,
+        so it is sent again later if this send fails.
+        Message to a peer known to be offline is only queued
+        and ConnectionError is raised at once
+        """
+        entry = self._track(peer_host, peer_port, message)
+        if self._queue_for_offline(entry):
+            raise ConnectionError(f"{peer_host}:{peer_port} is offline, "
+                                  f"message is queued")
+        try:
+            self._send_texts(peer_host, peer_port, [
+                self._envelope(peer_host, peer_port, message, "MESSAGE",
+                               entry.sequence)
+            ])
+        except OSError:
+            self._settle(entry, False)
+            raise
+        self._settle(entry, True)
+
+    def send_message_async(
+            self,
+            peer_host: str,
+            peer_port: int,
+            message: str,
+            block: bool = True
+    ) -> Future:
+        """
+        Queues a text message to peer and returns at once.
+        Messages queued to one peer within a short window are sent
+        in a single write and share returned future.
+        Raises queue.Full if too many sends to peer are waiting
+        and block is False, message is still sent later from outbox.
+        Message to a peer known to be offline is only queued and
+        returned future fails with ConnectionError
+        """
+        peer = (peer_host, peer_port)
+        entry = self._track(peer_host, peer_port, message)
+        if self._queue_for_offline(entry):
+            future = Future()
+            future.set_exception(ConnectionError(
+                f"{peer_host}:{peer_port} is offline, message is queued"
+            ))
+            return future
+        payload = self._envelope(peer_host, peer_port, message, "MESSAGE",
+                                 entry.sequence)
+        with self._batches_lock:
+            batch = self._batches.get(peer)
+            if batch and batch.add(payload):
+                batch.future.add_done_callback(
+                    partial(self._settle_future, entry)
+                )
+                return batch.future
+            batch = MessageBatch()
+            batch.add(payload)
+            self._batches[peer] = batch
+        batch.future.add_done_callback(partial(self._settle_future, entry))
+
+        try:
+            sent = self._dispatcher.submit(
+                peer,
+                lambda: self._send_batch(peer_host, peer_port, batch),
+                block
+            )
+        except Exception as e:
+            with self._batches_lock:
+                if self._batches.get(peer) is batch:
+                    del self._batches[peer]
+            batch.seal(0)
+            batch.future.set_exception(e)
+            raise
+        sent.add_done_callback(batch.resolve)
+        return batch.future
+
+    def _send_batch(self, peer_host: str, peer_port: int, batch: MessageBatch):
+        """Sends messages collected in batch once its window ends"""
+        payloads = batch.seal()
+        with self._batches_lock:
+            if self._batches.get((peer_host, peer_port)) is batch:
+                del self._batches[(peer_host, peer_port)]
+        self._send_texts(peer_host, peer_port, payloads)
+
+    def _send_texts(
+            self,
+            peer_host: str,
+            peer_port: int,
+            payloads: list[bytes],
+            quiet: bool = False
+    ):
+        """
+        Sends text payloads in one write, packed into a batch frame
+        if peer supports it. Long ones are streamed in chunks to peers
+        which accept it, and to peers whose flags aren't known yet if
+        they don't fit in a text frame. Failure is printed unless
+        quiet is True
+        """
+        max_size = TEXT_CHUNK_SIZE
+        is_streaming = self._accepts(peer_host, peer_port,
+                                     FLAG_STREAMED_TEXT)
+        if not is_streaming:
+            max_size = MAX_FRAME_SIZES[MSG_TYPE_TEXT]
+        streamed = [payload for payload in payloads
+                    if len(payload) > max_size]
+        payloads = [payload for payload in payloads
+                    if len(payload) <= max_size]
+        if (streamed and not is_streaming
+                and (peer_host, peer_port) in self.peer_flags):
+            # peer is known to read only whole text frames, which
+            # would be over its limit
+            error = OSError(f"Message of {len(streamed[0])} bytes is too "
+                            f"long for {peer_host}:{peer_port}")
+            if not quiet:
+                print(f"Can't send message to {peer_host}:{peer_port}: "
+                      f"{error}")
+            raise error
+
+        if len(payloads) > 1 and self._accepts(peer_host, peer_port,
+                                               FLAG_BATCH):
+            frames = [self._encode_frame(peer_host, peer_port,
+                                         MSG_TYPE_BATCH,
+                                         encode_batch(payloads))]
+        else:
+            frames = [self._encode_frame(peer_host, peer_port,
+                                         MSG_TYPE_TEXT, payload)
+                      for payload in payloads]
+        for payload in streamed:
+            frames.extend(
+                self._encode_frame(peer_host, peer_port,
+                                   MSG_TYPE_TEXT_CHUNK, chunk)
+                for chunk in encode_text_chunks(payload)
+            )
+        data = b"".join(frames)
+        try:
+            self._send_frame(peer_host, peer_port, data)
+        except OSError as e:
+            self.presence.failed((peer_host, peer_port))
+            if not quiet:
                 print(f"Can't send message to {peer_host}:{peer_port}: {e}")
-                raise
+            raise
+        self._seen((peer_host, peer_port))
 
-    def send_file(self, peer_host: str, peer_port: int, path: str):
-        """Sends file to peer"""
-        print("Sending file...")
+    def _track(
+            self,
+            peer_host: str,
+            peer_port: int,
+            message: str
+    ) -> OutboxEntry:
+        """Numbers message and puts it to outbox before it is sent"""
+        entry = OutboxEntry(peer_host, peer_port, message,
+                            self._new_sequence(peer_host, peer_port))
+        dropped = self.outbox.add(entry)
+        if dropped:
+            print(f"Outbox is full, message to {dropped.peer_host}:"
+                  f"{dropped.peer_port} was dropped")
+            self.undelivered.append(dropped)
+        return entry
+
+    def _queue_for_offline(self, entry: OutboxEntry) -> bool:
+        """
+        Leaves message to offline peer in outbox without waiting for
+        a connect timeout, returns False if peer may be online
+        """
+        if not self.presence.is_offline((entry.peer_host,
+                                         entry.peer_port)):
+            return False
+        self.outbox.postpone(entry)
+        return True
+
+    def _settle(self, entry: OutboxEntry, is_sent: bool):
+        """
+        Keeps sent message in outbox until its ack comes if peer sends
+        acks, failed one is sent again after backoff
+        """
+        if is_sent and not self._accepts(entry.peer_host, entry.peer_port,
+                                         FLAG_ACKS):
+            # peer doesn't acknowledge, so message it took is delivered
+            self.outbox.remove(entry)
+        elif not self.outbox.retry_later(entry, failed=not is_sent):
+            print(f"Message to {entry.peer_host}:{entry.peer_port} "
+                  f"wasn't delivered after {MAX_ATTEMPTS} attempts")
+            self.undelivered.append(entry)
+
+    def _settle_future(self, entry: OutboxEntry, future: Future):
+        self._settle(entry, not future.cancelled()
+                     and future.exception() is None)
+
+    def _retry_outbox(self):
+        """
+        Sends again messages which peers haven't acknowledged
+        and saves outbox until node closes
+        """
+        while not self._closed.is_set():
+            self._outbox_changed.clear()
+            # messages to one peer are sent in one write, as batches are
+            peers = dict[tuple[str, int], list[OutboxEntry]]()
+            offline = set[tuple[str, int]]()
+            for entry in self.outbox.due():
+                peer = (entry.peer_host, entry.peer_port)
+                # offline peer is asked if it is back, messages wait
+                # for it without using up attempts
+                if self._queue_for_offline(entry):
+                    offline.add(peer)
+                else:
+                    peers.setdefault(peer, []).append(entry)
+            for entries in peers.values():
+                self._resend(entries)
+            for peer in offline:
+                self._probe(peer)
+            self._save_outbox()
 
+            timeout = OUTBOX_CHECK_INTERVAL
+            next_attempt = self.outbox.next_attempt()
+            if next_attempt is not None:
+                timeout = min(timeout,
+                              max(0.0, next_attempt - time.monotonic()))
+            self._outbox_changed.wait(timeout)
+
+    def _resend(self, entries: list[OutboxEntry]):
+        """Queues messages to one peer without waiting for dispatcher"""
+        peer_host, peer_port = entries[0].peer_host, entries[0].peer_port
+        payloads = [
+            self._envelope(peer_host, peer_port, entry.body, "MESSAGE",
+                           entry.sequence)
+            for entry in entries
+        ]
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((peer_host, peer_port))
+            sent = self._dispatcher.submit(
+                (peer_host, peer_port),
+                partial(self._send_texts, peer_host, peer_port, payloads,
+                        quiet=True),
+                block=False
+            )
+        except Exception:
+            for entry in entries:
+                self._settle(entry, False)
+            return
+        for entry in entries:
+            sent.add_done_callback(partial(self._settle_future, entry))
 
-                filename = os.path.basename(path)
-                meta_data = (
-                    f"SENDER:{self.username} {self.public_ip}:{self.port} | "
-                    f"FILENAME:{filename}"
-                ).encode("utf-8")
+    def _seen(self, peer: tuple[str, int]):
+        """Records that peer is reachable, sends what failed to reach it"""
+        if self.presence.seen(peer):
+            self._wake_outbox(peer)
 
-                header = (bytes([MSG_TYPE_FILE_META])
-                          + len(meta_data).to_bytes(4, "big")
-                          + meta_data)
-                s.sendall(header)
+    def _save_outbox(self):
+        try:
+            self.outbox.save()
+        except OSError as e:
+            print(f"Can't save outbox: {e}")
 
-                with open(path, "rb") as file:
-                    while True:
-                        chunk = file.read(4096)
-                        if not chunk:
-                            break
-                        chunk_header = (bytes([MSG_TYPE_FILE_DATA])
-                                        + len(chunk).to_bytes(4, "big"))
-                        s.sendall(chunk_header + chunk)
+    def _wake_outbox(self, peer: tuple[str, int]):
+        """Sends messages which failed to reach peer as it is back"""
+        if self.outbox.wake(peer):
+            self._outbox_changed.set()
 
-                end_marker = bytes([MSG_TYPE_FILE_END])
-                s.sendall(end_marker)
+    def _send_frame(self, peer_host: str, peer_port: int, data: bytes):
+        """
+        Sends small frames as a datagram if peer receives them,
+        otherwise and if datagram wasn't acknowledged over TCP
+        """
+        if (len(data) <= MAX_DATAGRAM_FRAME
+                and self._datagram_listening.is_set()
+                and self._accepts(peer_host, peer_port, FLAG_DATAGRAM)):
+            try:
+                if self._datagram_channel.send(data, (peer_host, peer_port)):
+                    return
+            except OSError:
+                pass
+            # UDP may be blocked on the way, so TCP is used
+            # until peer announces datagrams again
+            peer = (peer_host, peer_port)
+            self.peer_flags[peer] = (self.peer_flags.get(peer, 0)
+                                     & ~FLAG_DATAGRAM)
+        self._pool.send(peer_host, peer_port, data)
+
+    def send_file(self, peer_host: str, peer_port: int, path: str):
+        """
+        Sends file to peer over pooled connection.
+        Big files are sent by chunks, which may go over several
+        connections and are resumed if the transfer is interrupted
+        """
+        print("Sending file...")
 
+        try:
+            self._send_file(peer_host, peer_port, path)
         except Exception as e:
             print(f"Error while sending a file: {e}")
+            return
 
         print("Successfully sent file")
 
+    def send_file_async(
+            self,
+            peer_host: str,
+            peer_port: int,
+            path: str,
+            block: bool = True
+    ) -> Future:
+        """
+        Queues a file to peer and returns at once, future
+        fails if the file couldn't be sent. Raises queue.Full
+        if too many sends to peer are waiting and block is False
+        """
+        print("Sending file...")
+        future = self._dispatcher.submit(
+            (peer_host, peer_port),
+            lambda: self._send_file(peer_host, peer_port, path),
+            block
+        )
+        future.add_done_callback(self._report_file_sent)
+        return future
+
+    @staticmethod
+    def _report_file_sent(future: Future):
+        if future.cancelled():
+            print("File wasn't sent: chat was closed")
+        elif future.exception():
+            print(f"Error while sending a file: {future.exception()}")
+        else:
+            print("Successfully sent file")
+
+    def broadcast(self, peers: Iterable[Contact], message: str) -> Future:
+        """
+        Sends a text message to many peers at once over pooled
+        connections and returns future of BroadcastReport.
+        Frame is encoded once and reused for every peer
+        which speaks the same wire format
+        """
+        peers = list(dict.fromkeys(peers))
+        started = time.monotonic()
+        report = Future()
+        results = list[BroadcastResult | None]([None] * len(peers))
+        remaining = [len(peers)]
+        lock = Lock()
+        frames = dict[tuple[bool, bool], bytes]()
+
+        def collect(index: int, result: BroadcastResult):
+            results[index] = result
+            with lock:
+                remaining[0] -= 1
+                is_done = remaining[0] == 0
+            if is_done:
+                report.set_result(BroadcastReport(
+                    results, time.monotonic() - started
+                ))
+
+        def on_sent(future: Future, index: int, peer: Contact):
+            if future.cancelled():
+                error = RuntimeError("Node was closed before sending")
+                collect(index, BroadcastResult(peer, 0.0, error))
+            else:
+                collect(index, future.result())
+
+        if not peers:
+            report.set_result(BroadcastReport([], 0.0))
+        for index, peer in enumerate(peers):
+            frame = self._broadcast_frame(peer, message, frames)
+            try:
+                sent = self._dispatcher.submit(
+                    peer.self, partial(self._send_timed, peer, frame)
+                )
+            except Exception as e:
+                collect(index, BroadcastResult(peer, 0.0, e))
+                continue
+            sent.add_done_callback(partial(on_sent, index=index, peer=peer))
+        return report
+
+    def _broadcast_frame(
+            self,
+            peer: Contact,
+            message: str,
+            frames: dict[tuple[bool, bool], bytes]
+    ) -> bytes:
+        """Returns frame for peer, encoding it once per wire format"""
+        is_legacy = (self.peer_versions.get(peer.self, WIRE_VERSION)
+                     == LEGACY_VERSION)
+        key = (is_legacy, self._accepts_compression(peer.host, peer.port))
+        if key not in frames:
+            frames[key] = self._encode_frame(
+                peer.host,
+                peer.port,
+                MSG_TYPE_TEXT,
+                self._envelope(peer.host, peer.port, message, "MESSAGE")
+            )
+        return frames[key]
+
+    def _send_timed(self, peer: Contact, frame: bytes) -> BroadcastResult:
+        """Sends frame to peer and measures how long it took"""
+        started = time.monotonic()
+        try:
+            self._send_frame(peer.host, peer.port, frame)
+        except OSError as e:
+            return BroadcastResult(peer, time.monotonic() - started, e)
+        return BroadcastResult(peer, time.monotonic() - started)
+
+    def wait_for_sends(self, timeout: float | None = None) -> bool:
+        """
+        Waits until queued messages and files are sent,
+        returns False on timeout
+        """
+        return self._dispatcher.join(timeout)
+
+    def join_room(self, name: str, members: Iterable[Contact]) -> Room:
+        """Creates room or adds members to it, this node is left out"""
+        me = Contact(self.public_ip, self.port, self.username)
+        with self._rooms_lock:
+            return self.rooms.join(
+                name, [member for member in members if member != me]
+            )
+
+    def send_room_message(self, name: str, message: str) -> list[Future]:
+        """
+        Sends a text message to room. Only a few random members get it
+        from this node, they pass it on to the others. Sending to room
+        this node was invited to joins it.
+        Returns futures of sends made by this node
+        """
+        message_id = os.urandom(MESSAGE_ID_SIZE)
+        self._seen_messages.add(message_id)
+        envelope = Envelope(self.username, self.public_ip, self.port,
+                            message, self._flags)
+        with self._rooms_lock:
+            room = self.rooms.get_room(name)
+            if room is None and name in self.rooms.invited:
+                room = self.rooms.join(name, [])
+            if room is None:
+                raise ValueError(f"There's no room with name:{name}")
+            room_message = RoomMessage(
+                message_id,
+                gossip_ttl(len(room.members) + 1, self.room_fanout),
+                Room(room.name, room.members),
+                envelope.encode()
+            )
+        return self._spread(room_message, set())
+
+    def _spread(
+            self,
+            message: RoomMessage,
+            exclude: set[Contact],
+            block: bool = True
+    ) -> list[Future]:
+        """Queues room message to random members not in exclude"""
+        payload = message.encode()
+        futures = []
+        for peer in message.room.pick_targets(exclude, self.room_fanout):
+            try:
+                futures.append(self._dispatcher.submit(
+                    peer.self,
+                    partial(self._send_room_frame, peer, payload),
+                    block
+                ))
+            except Exception as e:
+                print(f"Can't pass room message to "
+                      f"{peer.host}:{peer.port}: {e}")
+        return futures
+
+    def _send_room_frame(self, peer: Contact, payload: bytes):
+        """Sends room payload to peer over pooled connection"""
+        frame = self._encode_frame(peer.host, peer.port, MSG_TYPE_ROOM,
+                                   payload)
+        try:
+            self._send_frame(peer.host, peer.port, frame)
+        except OSError as e:
+            print(f"Can't send room message to {peer.host}:{peer.port}: {e}")
+            raise
+
+    def _send_file(self, peer_host: str, peer_port: int, path: str):
+        """Sends file in the way which suits it and the peer"""
+        if self._can_send_chunked(peer_host, peer_port, path):
+            self._send_file_chunked(peer_host, peer_port, path)
+        else:
+            self._send_file_stream(peer_host, peer_port, path)
+
+    def _send_file_stream(self, peer_host: str, peer_port: int, path: str):
+        """Sends the whole file in order over pooled connection"""
+        with self._pool.connection(peer_host, peer_port) as s:
+            filename = os.path.basename(path)
+            s.sendall(encode_frame(
+                MSG_TYPE_FILE_META,
+                self._envelope(peer_host, peer_port, filename, "FILENAME")
+            ))
+
+            with open(path, "rb") as file:
+                if not stat.S_ISREG(os.fstat(file.fileno()).st_mode):
+                    self._send_file_chunks(s, file)
+                elif (self._accepts_compression(peer_host, peer_port)
+                      and is_compressible(
+                          read_at(file.fileno(), SAMPLE_SIZE, 0)
+                      )):
+                    self._send_file_compressed(s, file)
+                else:
+                    self._send_file_data(s, file)
+
+            s.sendall(encode_frame(MSG_TYPE_FILE_END))
+
+    def _can_send_chunked(
+            self,
+            peer_host: str,
+            peer_port: int,
+            path: str
+    ) -> bool:
+        """Checks if file is worth sending by chunks with a manifest"""
+        version = self.peer_versions.get((peer_host, peer_port), WIRE_VERSION)
+        if version == LEGACY_VERSION:
+            return False
+        file_stat = os.stat(path)
+        return (stat.S_ISREG(file_stat.st_mode)
+                and file_stat.st_size >= CHUNKED_TRANSFER_THRESHOLD)
+
+    def _send_file_chunked(self, peer_host: str, peer_port: int, path: str):
+        """
+        Sends manifest of file, peer answers with chunks it already has
+        and only missing chunks are sent, split between transfer_streams
+        connections for big files. Then the peer is asked again,
+        so chunks which were lost or corrupted are sent once more
+        """
+        file_stat = os.stat(path)
+        manifest = cached_manifest(
+            os.path.abspath(path), file_stat.st_size, file_stat.st_mtime_ns
+        )
+        meta = encode_frame(
+            MSG_TYPE_MANIFEST,
+            manifest.encode()
+            + self._envelope(peer_host, peer_port,
+                             os.path.basename(path), "FILENAME")
+        )
+        streams = 1
+        if manifest.size >= PARALLEL_TRANSFER_THRESHOLD:
+            streams = self.transfer_streams
+
+        with self._open_connection(peer_host, peer_port) as control:
+            missing, peer_flags = self._exchange_manifest(
+                control, meta, manifest
+            )
+            self.peer_flags[(peer_host, peer_port)] = peer_flags
+            compress = False
+            if self._accepts_compression(peer_host, peer_port):
+                with open(path, "rb") as file:
+                    compress = is_compressible(
+                        read_at(file.fileno(), SAMPLE_SIZE, 0)
+                    )
+
+            for _ in range(MAX_TRANSFER_ROUNDS):
+                if not missing:
+                    return
+
+                groups = [
+                    missing[start:end]
+                    for start, end in split_ranges(len(missing), streams)
+                ]
+                with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                    futures = [executor.submit(
+                        self._send_chunks, control, path, manifest,
+                        groups[0], compress
+                    )]
+                    futures.extend(
+                        executor.submit(self._send_chunks_in_stream,
+                                        peer_host, peer_port, path, meta,
+                                        manifest, group, compress)
+                        for group in groups[1:]
+                    )
+                    for future in futures:
+                        future.result()
+
+                missing, _ = self._exchange_manifest(control, meta, manifest)
+
+        if missing:
+            raise OSError(f"Peer didn't accept {len(missing)} chunks "
+                          f"of {os.path.basename(path)}")
+
+    def _send_chunks_in_stream(
+            self,
+            peer_host: str,
+            peer_port: int,
+            path: str,
+            meta: bytes,
+            manifest: Manifest,
+            indexes: list[int],
+            compress: bool
+    ):
+        """
+        Sends chunks over additional connection. The manifest is
+        exchanged once more at the end, and peer writes chunks queued
+        for this connection before answering it, so they all are
+        verified by the time this method returns
+        """
+        with self._open_connection(peer_host, peer_port) as s:
+            self._exchange_manifest(s, meta, manifest)
+            self._send_chunks(s, path, manifest, indexes, compress)
+            self._exchange_manifest(s, meta, manifest)
+
+    def _open_connection(
+            self,
+            peer_host: str,
+            peer_port: int
+    ) -> socket.socket:
+        """Opens a connection which isn't shared through pool"""
+        s = socket.create_connection(
+            (peer_host, peer_port),
+            timeout=self._pool.connect_timeout
+        )
+        if self._tls:
+            s = self._wrap_client(s, (peer_host, peer_port))
+        s.settimeout(None)
+        return s
+
+    def _wrap_client(
+            self,
+            sock: socket.socket,
+            address: tuple[str, int]
+    ) -> socket.socket:
+        """
+        Performs TLS handshake with peer and checks its certificate
+        against the one pinned in contacts
+        """
+        tls_sock = self._tls.wrap_client(sock, address)
+        peer_fingerprint = self._tls.peer_fingerprint(tls_sock)
+        is_trusted = self.contacts.pin(*address, peer_fingerprint)
+        # peer found on LAN under username of contact is the contact
+        # only if it has its certificate
+        announced = self.discovered_peers().get(address)
+        if is_trusted and announced is not None:
+            is_trusted = self.contacts.relocate(announced, *address,
+                                                peer_fingerprint)
+        if not is_trusted:
+            tls_sock.close()
+            self._tls.forget(address)
+            raise CertificateMismatch(
+                f"Certificate of {address[0]}:{address[1]} doesn't match "
+                f"the pinned one, got {peer_fingerprint}"
+            )
+        return tls_sock
+
+    @property
+    def fingerprint(self) -> str | None:
+        """Returns fingerprint of certificate of node if TLS is on"""
+        return self._tls.fingerprint if self._tls else None
+
+    @staticmethod
+    def _exchange_manifest(
+            s: socket.socket,
+            meta: bytes,
+            manifest: Manifest
+    ) -> tuple[list[int], int]:
+        """
+        Sends manifest and returns indexes of chunks peer is missing
+        with envelope flags of peer
+        """
+        s.settimeout(REPLY_TIMEOUT)
+        try:
+            s.sendall(meta)
+            decoder = FrameDecoder()
+            reply = None
+            while reply is None:
+                received = s.recv_into(decoder.writable(), RECV_SIZE)
+                if not received:
+                    raise ConnectionError("Peer closed connection "
+                                          "without answering manifest")
+                decoder.commit(received)
+                reply = next(decoder.frames(), None)
+        finally:
+            s.settimeout(None)
+
+        msg_type, payload = reply
+        if msg_type != MSG_TYPE_HAVE or len(payload) < HAVE_HEADER.size:
+            raise ConnectionError("Unexpected answer to manifest")
+        transfer_id, peer_flags = HAVE_HEADER.unpack_from(payload)
+        if transfer_id != manifest.transfer_id:
+            raise ConnectionError("Unexpected answer to manifest")
+        if len(payload) == HAVE_HEADER.size:
+            raise ConnectionRefusedError("Peer is receiving too many "
+                                         "files, try again later")
+
+        have = decode_bitmap(payload[HAVE_HEADER.size:], manifest.chunk_count)
+        missing = [index for index in range(manifest.chunk_count)
+                   if index not in have]
+        return missing, peer_flags
+
+    @staticmethod
+    def _send_chunks(
+            s: socket.socket,
+            path: str,
+            manifest: Manifest,
+            indexes: list[int],
+            compress: bool = False
+    ):
+        """Sends chunks of file with sendfile() or compressed"""
+        with open(path, "rb") as file:
+            for index in indexes:
+                start, end = manifest.chunk_range(index)
+                count = end - start
+                if compress:
+                    s.sendall(encode_compressed_frame(
+                        MSG_TYPE_FILE_RANGE,
+                        RANGE_HEADER.pack(manifest.transfer_id, start)
+                        + read_at(file.fileno(), count, start)
+                    ))
+                    continue
+
+                s.sendall(
+                    FRAME_HEADER.pack(MSG_TYPE_FILE_RANGE,
+                                      RANGE_HEADER.size + count)
+                    + RANGE_HEADER.pack(manifest.transfer_id, start)
+                )
+                sent = s.sendfile(file, start, count)
+                if sent != count:
+                    raise OSError(f"File was truncated while sending "
+                                  f"chunk {index}")
+
+    @staticmethod
+    def _send_file_data(s: socket.socket, file: BinaryIO):
+        """
+        Sends regular file with sendfile(), so its content goes
+        from page cache to socket without being copied to Python
+        """
+        size = os.fstat(file.fileno()).st_size
+        offset = 0
+        while offset < size:
+            count = min(SENDFILE_FRAME_SIZE, size - offset)
+            s.sendall(FRAME_HEADER.pack(MSG_TYPE_FILE_DATA, count))
+            sent = s.sendfile(file, offset, count)
+            if sent != count:
+                raise OSError(f"File was truncated while sending: "
+                              f"sent {offset + sent} of {size} bytes")
+            offset += count
+
+    @staticmethod
+    def _send_file_compressed(s: socket.socket, file: BinaryIO):
+        """Sends regular file by compressed frames"""
+        while chunk := file.read(SENDFILE_FRAME_SIZE):
+            s.sendall(encode_compressed_frame(MSG_TYPE_FILE_DATA, chunk))
+
+    @staticmethod
+    def _send_file_chunks(s: socket.socket, file: BinaryIO):
+        """Sends file which size is unknown, such as pipe, chunk by chunk"""
+        while True:
+            chunk = file.read(4096)
+            if not chunk:
+                break
+            s.sendall(encode_frame(MSG_TYPE_FILE_DATA, chunk))
+
     def receive_messages(self, downloads_path: str):
         """Listens to messages from peers"""
+        if self.receive_processes > 1:
+            self._receive_in_processes(downloads_path)
+            return
+
         self._server_socket.bind((self.host, self.port))
         self._server_socket.listen()
+        self._start_sweeper()
+        if self.datagrams:
+            self._start_datagram_receiver(downloads_path)
 
         while self._is_running:
             try:
                 conn, addr = self._server_socket.accept()
-                with conn:
-                    buffer = b""
-                    while True:
-                        data = conn.recv(4096)
-                        if not data:
-                            break
-
-                        buffer += data
-                        buffer = self.process_buffer(buffer, downloads_path)
+                if not self.limiter.connect(addr[0]):
+                    conn.close()
+                    continue
+                Thread(
+                    target=self.serve_connection,
+                    args=(conn, downloads_path, addr[0]),
+                    daemon=True
+                ).start()
 
             except OSError:
                 break
             except Exception as e:
                 print(f"Error while receiving messages: {e}")
 
-        if self._server_socket:
+        # closed node has already closed its socket
+        if self._server_socket and not self._closed.is_set():
             self._server_socket.close()
 
-    def process_buffer(self, buffer: bytes, downloads_path: str):
-        """Reads data from current buffer"""
-        while buffer:
-            if len(buffer) < 5:
-                if buffer[0] == MSG_TYPE_FILE_END:
-                    self.finalize_file()
-                    buffer = b""
-                return buffer
+    def _receive_in_processes(self, downloads_path: str):
+        """
+        Listens on several processes sharing the port
+        and collects messages they have received. Messages of a peer
+        may come through several processes, so they are put in order
+        and deduplicated here
+        """
+        workers = ReceiveWorkers(Node, self._worker_settings(),
+                                 self.receive_processes)
+        workers.start(downloads_path)
+        self._start_sweeper()
+        try:
+            while not self._closed.is_set():
+                received = workers.get(WORKER_POLL_INTERVAL)
+                if not received:
+                    continue
+                kind, *values = received
+                if kind == EVENT_ACK:
+                    self.outbox.ack(*values)
+                elif kind == EVENT_TEXT:
+                    envelope, = values
+                    self._remember_version(envelope)
+                    self._order_message(envelope)
+                else:
+                    self._add_worker_message(*values)
+        finally:
+            workers.close()
+
+    def _worker_settings(self) -> dict:
+        """Returns arguments for nodes of receiving processes"""
+        return {
+            "host": self.host,
+            "port": self.port,
+            "username": self.username,
+            "public_ip": self.public_ip,
+            "is_console": self._is_console,
+            "transfer_streams": self.transfer_streams,
+            "max_receives": self._transfers.max_active,
+            "compression": self.compression,
+            # datagrams are acked from port of this node,
+            # which other processes don't read
+            "datagrams": False,
+            # connections of a peer are spread over processes,
+            # so each one admits its share of traffic
+            "frame_rate": self.limiter.frame_rate / self.receive_processes,
+            "byte_rate": self.limiter.byte_rate / self.receive_processes,
+            "connections_per_ip": self.limiter.max_connections,
+            "over_limit": self.limiter.policy,
+            "frame_limits": self.frame_limits,
+            "max_text_size": self.max_text_size,
+            "tls": self._tls is not None,
+            "cert_path": self._cert_path,
+            "key_path": self._key_path
+        }
+
+    def _add_worker_message(
+            self,
+            message: Message,
+            version: int | None,
+            flags: int | None
+    ):
+        """
+        Adds message from receiving process to queue, room message
+        which came through another process too is dropped
+        """
+        if (message.message_id is not None
+                and not self._seen_messages.add(message.message_id)):
+            return
+        peer = message.sender.self
+        if version is not None:
+            self.peer_versions[peer] = version
+            self.peer_flags[peer] = flags
+        self._seen(peer)
+        self.contacts.update_peer(
+            message.sender.host,
+            message.sender.port,
+            message.sender.username
+        )
+        if message.room is not None:
+            # receiving process has taken members it trusts into its
+            # own rooms, here unknown room is only an invitation
+            with self._rooms_lock:
+                if self.rooms.get_room(message.room) is None:
+                    self.rooms.invite(message.room, [message.sender])
+        self.new_messages.append(message)
+
+    def serve_connection(
+            self,
+            conn: socket.socket,
+            downloads_path: str,
+            peer_host: str | None = None
+    ):
+        """
+        Reads frames from a single peer connection until it is closed.
+        Connection of peer_host must have been admitted by limiter
+        """
+        with self._connections_lock:
+            self._connections.add(conn)
+        state = ReceiveState(conn.sendall, DiskWriter(self.disk_stats),
+                             peer_host)
+        self._state = state
+        # data is decrypted in Python, so it can't be spliced with TLS
+        receiver = DirectReceiver(SPLICE_AVAILABLE and not self._tls)
+        try:
+            if self._tls:
+                conn = self._accept_tls(conn)
+                state.reply = conn.sendall
+            with conn:
+                conn.settimeout(CONNECTION_IDLE_TIMEOUT)
+                decoder = FrameDecoder(max_sizes=self.frame_limits)
+                while True:
+                    received = conn.recv_into(decoder.writable(), RECV_SIZE)
+                    if not received:
+                        break
+
+                    decoder.commit(received)
+                    for msg_type, payload in decoder.frames():
+                        wait = self._admit(state, msg_type, len(payload))
+                        if wait is None:
+                            if self.limiter.policy == POLICY_DISCONNECT:
+                                return
+                            continue
+                        if wait:
+                            self._closed.wait(wait)
+                        self.handle_frame(msg_type, payload, downloads_path)
+                    self.receive_file_payload(conn, decoder, receiver)
+
+        except OSError:
+            pass
+        except Exception as e:
+            print(f"Error while receiving messages: {e}")
+        finally:
+            receiver.close()
+            with self._connections_lock:
+                self._connections.discard(conn)
+            if peer_host:
+                self.limiter.disconnect(peer_host)
+            self.close_receive_state(state)
+
+    def _accept_tls(self, conn: socket.socket) -> socket.socket:
+        """Performs TLS handshake of accepted connection"""
+        tls_conn = self._tls.wrap_server(conn)
+        with self._connections_lock:
+            self._connections.discard(conn)
+            self._connections.add(tls_conn)
+        return tls_conn
+
+    def _admit(
+            self,
+            state: ReceiveState,
+            msg_type: int,
+            size: int
+    ) -> float | None:
+        """
+        Returns seconds to wait before handling a frame received over
+        connection, or None if it must be refused
+        """
+        if not state.peer_host:
+            return 0.0
+        policy = None
+        # a dropped part of file would corrupt it, so it waits instead
+        if (self.limiter.policy == POLICY_DROP
+                and msg_type in (MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_RANGE)):
+            policy = POLICY_DELAY
+        return self.limiter.admit(state.peer_host,
+                                  size + FRAME_HEADER.size, policy)
+
+    def close_receive_state(self, state: ReceiveState):
+        """
+        Cleans up after closed connection. A file which didn't
+        receive its end marker is removed, files received by chunks
+        are closed if no other connection uses them and can be resumed
+        """
+        if state.writer:
+            # verified chunks are kept, so queued ones are written too
+            state.writer.close()
+
+        if state.current_file:
+            with self._transfers_lock:
+                self._transfers.remove(state.current_file)
+            state.current_file.close()
+            state.current_file = None
+
+        for transfer in state.transfers:
+            with self._transfers_lock:
+                transfer.connections -= 1
+                if (transfer.connections > 0
+                        or not self._transfers.remove(transfer)):
+                    continue
+            transfer.close()
+        state.transfers.clear()
+
+    def expire_transfers(self):
+        """
+        Drops transfers which didn't receive data for a while,
+        so a stalled peer doesn't keep a file open and a receive slot
+        """
+        with self._transfers_lock:
+            expired = self._transfers.expire()
+        for transfer in expired:
+            transfer.close()
+            if self._is_console:
+                print(f"Receiving {transfer.filename} timed out")
+
+    def _start_sweeper(self):
+        """
+        Starts threads of listening node which expire idle transfers
+        and waiting out of order messages, retry outbox, send
+        heartbeats and discover peers until node closes
+        """
+        Thread(target=self._sweep_transfers, daemon=True).start()
+        Thread(target=self._release_reordered, daemon=True).start()
+        if self._is_worker:
+            return
+        Thread(target=self._retry_outbox, daemon=True).start()
+        Thread(target=self._send_heartbeats, daemon=True).start()
+        if self.discovery:
+            self._start_discovery()
+
+    def _start_discovery(self):
+        """Starts announcing node on LAN, if LAN allows multicast"""
+        # node may listen on a port picked by system
+        port = self.port or self._server_socket.getsockname()[1]
+        service = DiscoveryService(self._session,
+                                   lambda: (port, self.username),
+                                   self._on_discovered)
+        if service.start():
+            self._discovery = service
+
+    def _on_discovered(
+            self,
+            host: str,
+            port: int,
+            username: str,
+            is_new: bool
+    ):
+        """
+        Marks announced peer online. Announcements aren't
+        authenticated, so peers found on LAN are kept only while they
+        announce and aren't added to contacts
+        """
+        self._seen((host, port))
+        if (is_new and self._is_console
+                and not self.contacts.get_contact_by_address(host, port)):
+            print(f"\nFound {username} at {host}:{port}\n>> ",
+                  end="", flush=True)
+
+    def discovered_peers(self) -> dict[tuple[str, int], str]:
+        """Returns usernames of peers announcing on LAN by address"""
+        if not self._discovery:
+            return {}
+        return self._discovery.table.peers()
+
+    def find_peer(self, name: str) -> Contact | None:
+        """
+        Returns peer with given username or host. Peer announcing the
+        username on LAN is preferred to an address saved in contacts,
+        with TLS its certificate is checked against the pinned one
+        of contact on connect
+        """
+        contact = (self.contacts.get_contact_by_username(name)
+                   or self.contacts.get_contact_by_host(name))
+        announced = [address for address, username
+                     in self.discovered_peers().items() if username == name]
+        if not announced or contact and contact.self in announced:
+            return contact
+        return Contact(*announced[0], name)
+
+    def _sweep_transfers(self):
+        while not self._closed.wait(TRANSFER_SWEEP_INTERVAL):
+            self.expire_transfers()
+
+    def _start_datagram_receiver(self, downloads_path: str):
+        """Binds UDP socket to the port of TCP server and listens on it"""
+        port = self._server_socket.getsockname()[1]
+        try:
+            self._datagram_socket.bind((self.host, port))
+        except OSError as e:
+            print(f"Can't receive datagrams on port {port}: {e}")
+            return
+        self._datagram_socket.settimeout(DATAGRAM_POLL_INTERVAL)
+        self._datagram_listening.set()
+        Thread(
+            target=self._receive_datagrams,
+            args=(downloads_path,),
+            daemon=True
+        ).start()
+
+    def _receive_datagrams(self, downloads_path: str):
+        """Passes frames of received datagrams to their handlers"""
+        buffer = bytearray(MAX_DATAGRAM_SIZE)
+        while not self._closed.is_set():
+            try:
+                size, address = self._datagram_socket.recvfrom_into(buffer)
+            except TimeoutError:
+                continue
+            except OSError:
+                break
+            # one thread reads datagrams of all peers, so it can't wait
+            # for one of them and datagrams over limit are dropped
+            if self.limiter.admit(address[0], size, POLICY_DROP) is None:
+                continue
+
+            try:
+                frame = self._datagram_channel.handle(
+                    memoryview(buffer)[:size], address
+                )
+                if not frame:
+                    continue
+                decoder = FrameDecoder(len(frame), self.frame_limits)
+                decoder.feed(frame)
+                for msg_type, payload in decoder.frames():
+                    if msg_type & ~COMPRESSED_FLAG in DATAGRAM_FRAME_TYPES:
+                        self.handle_frame(msg_type, payload, downloads_path)
+            except OSError:
+                break
+            except Exception as e:
+                print(f"Error while receiving datagram: {e}")
+        self._datagram_listening.clear()
 
-            msg_type = buffer[0]
-            length = int.from_bytes(buffer[1:5], "big")
+    def receive_file_payload(
+            self,
+            conn: socket.socket,
+            decoder: FrameDecoder,
+            receiver: DirectReceiver
+    ):
+        """
+        If a big file data frame has started to arrive, writes the rest
+        of it straight from socket to the file instead of buffering it
+        """
+        frame = decoder.partial_frame()
+        if not frame or frame[1] < DIRECT_RECEIVE_THRESHOLD:
+            return
 
-            if len(buffer) < 5 + length:
-                return buffer
+        msg_type, missing, payload = frame
+        size = FRAME_HEADER.size + len(payload) + missing
+        # data goes to file directly, after everything queued before
+        self._flush_writes()
+        current_file = self._current_file
+        if (msg_type == MSG_TYPE_FILE_DATA and current_file
+                and not current_file.closed):
+            self._wait_for_limit(size)
+            current_file.write(decoder.take_partial_payload())
+            current_file.handle.flush()
+            receiver.receive(conn, current_file.handle.fileno(), missing,
+                             CONNECTION_IDLE_TIMEOUT)
 
-            data = buffer[5:5 + length]
-            buffer = buffer[5 + length:]
+        elif (msg_type == MSG_TYPE_FILE_RANGE
+              and len(payload) >= RANGE_HEADER.size):
+            transfer_id, offset = RANGE_HEADER.unpack_from(payload)
+            with self._transfers_lock:
+                transfer = self._transfers.get(transfer_id)
+                # expired transfer is closed, its frame is read
+                # into buffer and dropped
+                if not transfer or transfer.closed:
+                    return
+                transfer.touch()
 
-            if msg_type == MSG_TYPE_TEXT:
-                self.handle_message(data)
-            elif msg_type == MSG_TYPE_FILE_META:
-                self.handle_file_meta(data, downloads_path)
-            elif msg_type == MSG_TYPE_FILE_DATA:
-                self._current_file["handle"].write(data)
-            elif msg_type == MSG_TYPE_FILE_END:
-                self.finalize_file()
+            self._wait_for_limit(size)
+            with transfer.file() as fd:
+                if fd is None:
+                    return
+                data = decoder.take_partial_payload()[RANGE_HEADER.size:]
+                index = transfer.check_chunk(offset, len(data) + missing)
+                write_at(fd, data, offset)
+                receiver.receive(conn, fd, missing, CONNECTION_IDLE_TIMEOUT,
+                                 offset + len(data))
+            if transfer.complete_chunk(index):
+                self.finalize_transfer(transfer)
 
-        return buffer
+    def _wait_for_limit(self, size: int):
+        """Waits until peer of connection may send size bytes more"""
+        state = self._state
+        if state and state.peer_host:
+            self._closed.wait(self.limiter.admit(state.peer_host, size,
+                                                 POLICY_DELAY))
 
-    def handle_file_meta(self, data: bytes, downloads_path: str):
+    def process_buffer(self, buffer: bytes, downloads_path: str) -> bytes:
+        """
+        Handles all complete frames from buffer
+        and returns data left after them
+        """
+        decoder = FrameDecoder(len(buffer), self.frame_limits)
+        decoder.feed(buffer)
+        for msg_type, payload in decoder.frames():
+            self.handle_frame(msg_type, payload, downloads_path)
+        return decoder.pending()
+
+    def handle_frame(
+            self,
+            msg_type: int,
+            payload: bytes | memoryview,
+            downloads_path: str
+    ):
+        """Passes a single received frame to its handler"""
+        if msg_type & COMPRESSED_FLAG:
+            msg_type &= ~COMPRESSED_FLAG
+            # original payload is held to the limit of its frame type
+            payload = decompress_payload(payload,
+                                         self._frame_limit(msg_type))
+
+        if msg_type == MSG_TYPE_TEXT:
+            self.handle_message(payload)
+        elif msg_type == MSG_TYPE_BATCH:
+            for message in decode_batch(payload):
+                self.handle_message(message)
+        elif msg_type == MSG_TYPE_ROOM:
+            self.handle_room_message(payload)
+        elif msg_type == MSG_TYPE_TEXT_CHUNK:
+            self.handle_text_chunk(payload)
+        elif msg_type == MSG_TYPE_ACK:
+            self.handle_ack(payload)
+        elif msg_type == MSG_TYPE_HEARTBEAT:
+            self._remember_version(Envelope.decode(payload))
+        elif msg_type == MSG_TYPE_FILE_META:
+            self.handle_file_meta(payload, downloads_path)
+        elif msg_type == MSG_TYPE_FILE_DATA:
+            # file may have been refused or expired, then data is dropped
+            if self._current_file and not self._current_file.closed:
+                self._write_file_data(self._current_file, payload)
+        elif msg_type == MSG_TYPE_FILE_END:
+            self.finalize_file()
+        elif msg_type == MSG_TYPE_MANIFEST:
+            self.handle_manifest(payload, downloads_path)
+        elif msg_type == MSG_TYPE_FILE_RANGE:
+            self.handle_file_range(payload)
+
+    def handle_file_meta(self, data: bytes | memoryview, downloads_path: str):
         """
         Creates new file using received meta info
         and adds a new message to queue
         """
-        meta = data.decode("utf-8")
-        match = HEADER_REGEX.match(meta)
-        if match:
-            groups = match.groupdict()
+        try:
+            meta = Envelope.decode(data, HEADER_REGEX)
+        except ValueError:
+            return
+        self._remember_version(meta)
 
+        self.expire_transfers()
+        sender = Contact(meta.host, meta.port, meta.username)
+        with self._transfers_lock:
+            if self._transfers.is_full:
+                self._current_file = None
+                self._state.skip_file = True
+            else:
+                self._current_file = IncomingFile(
+                    meta.body, sender, downloads_path
+                )
+                self._transfers.add(self._current_file)
+
+        if not self._current_file:
             if self._is_console:
-                print(f"Received {groups["filename"]} from {groups["host"]}")
+                print(f"Refused {meta.body} from {meta.host}: already "
+                      f"receiving {self._transfers.max_active} files")
+            return
 
-            self._current_file = {
-                "filename": groups["filename"],
-                "handle": open(
-                    os.path.join(downloads_path, groups["filename"]),
-                    "wb"
-                )
-            }
-
-            self.new_messages.append(Message(
-                Contact(
-                    groups["host"],
-                    int(groups["port"]),
-                    groups["username"]
-                ),
-                datetime.now(),
-                groups["filename"],
-                "file"
-            ))
+        if self._is_console:
+            print(f"Received {meta.body} from {meta.host}")
+
+        self.new_messages.append(Message(
+            sender,
+            datetime.now(),
+            meta.body,
+            "file"
+        ))
 
     def finalize_file(self):
         """Closes file"""
-        if self._current_file:
-            self._current_file["handle"].close()
+        current_file = self._current_file
+        if current_file:
+            self._flush_writes()
+            self._current_file = None
+            with self._transfers_lock:
+                is_active = self._transfers.remove(current_file)
+            # expired file is already closed and removed
+            if not is_active:
+                return
+
+            current_file.finish()
             if self._is_console:
-                print(f"File {self._current_file["filename"]} "
+                print(f"File {current_file.filename} "
                       f"was successfully saved")
-
-            self._current_file = None
+        elif self._state.skip_file:
+            self._state.skip_file = False
         else:
             raise ValueError("Received end of file marker, "
                              "but no file was saving")
 
-    def handle_message(self, data_bytes: bytes):
+    def handle_manifest(self, data: bytes | memoryview, downloads_path: str):
+        """
+        Starts or resumes a transfer by chunks and answers
+        with bitmap of chunks which are already received
+        """
+        try:
+            manifest, offset = Manifest.decode(data)
+            meta = Envelope.decode(data[offset:], HEADER_REGEX)
+        except ValueError:
+            return
+        self._remember_version(meta)
+
+        self.expire_transfers()
+        state = self._state
+        transfer_id = manifest.transfer_id
+        path = os.path.join(downloads_path, os.path.basename(meta.body))
+        with self._transfers_lock:
+            is_needed = (not self._transfers.get(transfer_id)
+                         and self._completed_transfers.get(transfer_id)
+                         != path)
+        if is_needed:
+            self.reuse_content(manifest, meta, downloads_path)
+
+        is_new = False
+        with self._transfers_lock:
+            transfer = self._transfers.get(transfer_id)
+            is_needed = (not transfer
+                         and self._completed_transfers.get(transfer_id)
+                         != path)
+            is_refused = is_needed and self._transfers.is_full
+            if is_needed and not is_refused:
+                transfer = IncomingTransfer(
+                    manifest,
+                    meta.body,
+                    Contact(meta.host, meta.port, meta.username),
+                    downloads_path
+                )
+                self._transfers.add(transfer)
+                is_new = True
+            if transfer and transfer not in state.transfers:
+                transfer.connections += 1
+                state.transfers.add(transfer)
+
+        if is_refused:
+            if self._is_console:
+                print(f"Refused {meta.body} from {meta.host}: already "
+                      f"receiving {self._transfers.max_active} files")
+            if state.reply:
+                state.reply(encode_frame(
+                    MSG_TYPE_HAVE, HAVE_HEADER.pack(transfer_id, self._flags)
+                ))
+            return
+
+        if is_new and self._is_console:
+            print(f"Receiving {transfer.filename} from {meta.host}")
+        # chunks queued to disk writer aren't verified yet, they would
+        # be reported missing and sent again
+        self._flush_writes()
+        if transfer and transfer.is_complete:
+            # every chunk had arrived before previous connection dropped
+            self.finalize_transfer(transfer)
+
+        if self._completed_transfers.get(transfer_id) == path:
+            have = encode_bitmap(set(range(manifest.chunk_count)),
+                                 manifest.chunk_count)
+        else:
+            have = transfer.have_bitmap()
+        if state.reply:
+            state.reply(encode_frame(
+                MSG_TYPE_HAVE,
+                HAVE_HEADER.pack(transfer_id, self._flags) + have
+            ))
+
+    def reuse_content(
+            self,
+            manifest: Manifest,
+            meta: Envelope,
+            downloads_path: str
+    ) -> bool:
+        """
+        Makes file of manifest from the same content already received
+        to downloads, so none of it is sent. Returns False if there
+        is no such content
+        """
+        index = self._content_index(downloads_path)
+        path = index.materialize(manifest.transfer_id, manifest.size,
+                                 meta.body)
+        if not path:
+            return False
+        with self._transfers_lock:
+            self._complete(manifest.transfer_id, path)
+
+        filename = os.path.basename(path)
+        if self._is_console:
+            print(f"File {filename} was already received, "
+                  f"saved it from downloads")
+        self.new_messages.append(Message(
+            Contact(meta.host, meta.port, meta.username),
+            datetime.now(),
+            filename,
+            "file"
+        ))
+        return True
+
+    def _content_index(self, downloads_path: str) -> ContentIndex:
+        with self._transfers_lock:
+            index = self._content_indexes.get(downloads_path)
+            if not index:
+                index = ContentIndex(downloads_path)
+                self._content_indexes[downloads_path] = index
+            return index
+
+    def _complete(self, transfer_id: bytes, path: str):
+        """
+        Remembers transfer whose file is in downloads,
+        caller holds transfers lock
+        """
+        self._completed_transfers[transfer_id] = path
+        while len(self._completed_transfers) > COMPLETED_TRANSFERS_LIMIT:
+            self._completed_transfers.popitem(last=False)
+
+    def handle_file_range(self, data: bytes | memoryview):
+        """Writes received chunk to its file"""
+        transfer_id, offset = RANGE_HEADER.unpack_from(data)
+        with self._transfers_lock:
+            transfer = self._transfers.get(transfer_id)
+        if not transfer or transfer.closed:
+            return
+        chunk = data[RANGE_HEADER.size:]
+        transfer.check_chunk(offset, len(chunk))
+        writer = self._state.writer
+        if writer:
+            transfer.touch()
+            writer.submit(
+                partial(self._write_chunk, transfer, offset, bytes(chunk)),
+                len(chunk)
+            )
+        else:
+            self._write_chunk(transfer, offset, chunk)
+
+    def _write_chunk(
+            self,
+            transfer: IncomingTransfer,
+            offset: int,
+            data: bytes | memoryview
+    ):
+        """Writes chunk and moves file to downloads once it's complete"""
+        if transfer.write(offset, data):
+            self.finalize_transfer(transfer)
+
+    def _write_file_data(self, file: IncomingFile, data: bytes | memoryview):
+        """Appends data to file received in order"""
+        writer = self._state.writer
+        if writer:
+            file.touch()
+            # payload is a view of receive buffer, which is reused
+            writer.submit(partial(file.write, bytes(data)), len(data))
+        else:
+            file.write(data)
+
+    def _flush_writes(self):
+        """Waits until file data queued by this connection is written"""
+        writer = self._state.writer
+        if writer:
+            writer.flush()
+
+    def finalize_transfer(self, transfer: IncomingTransfer):
+        """
+        Moves file which has received all its chunks to downloads
+        and adds a new message to queue
+        """
+        # file is moved before the transfer is seen as complete,
+        # so neither peers nor the content index see the part file
+        with self._transfers_lock:
+            if not self._transfers.remove(transfer):
+                return
+            transfer.finish()
+            self._complete(transfer.transfer_id, transfer.path)
+        downloads_path = os.path.dirname(transfer.path)
+        try:
+            self._content_index(downloads_path).add(transfer.transfer_id,
+                                                    transfer.path)
+        except OSError as e:
+            print(f"Can't index {transfer.filename}: {e}")
+
+        if self._is_console:
+            print(f"File {transfer.filename} was successfully saved")
+
+        self.new_messages.append(Message(
+            transfer.sender,
+            datetime.now(),
+            transfer.filename,
+            "file"
+        ))
+
+    def handle_message(self, data_bytes: bytes | memoryview):
         """
         Adds new text message to queue
         and prints it if console mode is on
         """
-        data = data_bytes.decode("utf-8")
-        groups = MESSAGE_REGEX.match(data).groupdict()
+        envelope = Envelope.decode(data_bytes, MESSAGE_REGEX)
+        self._remember_version(envelope)
+        if envelope.sequence is None:
+            self._deliver_message(envelope)
+            return
+        # duplicates are acknowledged too, as the previous ack may be lost
+        if envelope.flags & FLAG_ACKS:
+            self._acknowledge(envelope)
+
+        self._order_message(envelope)
+
+    def _order_message(self, envelope: Envelope):
+        """Delivers numbered message after those sent before it"""
+        # messages of one peer are delivered one thread at a time,
+        # so they are queued in the order buffer gave them
+        with self._delivery_lock:
+            session, number = envelope.sequence
+            peer = (envelope.host, envelope.port)
+            for ready in self._reorder.push(peer, session, number,
+                                            envelope):
+                self._deliver_message(ready)
+
+    def handle_text_chunk(self, data: bytes | memoryview):
+        """
+        Collects text streamed over connection and handles it as
+        a message once its last chunk arrives. Text growing over
+        max_text_size is dropped
+        """
+        if len(data) < TEXT_CHUNK_HEADER.size:
+            raise ValueError("Text chunk is too short")
+        (flags,) = TEXT_CHUNK_HEADER.unpack_from(data)
+        state = self._state
+        if state.text_stream is None:
+            state.text_stream = bytearray()
+        chunk = data[TEXT_CHUNK_HEADER.size:]
+        if state.skip_text:
+            pass
+        elif len(state.text_stream) + len(chunk) > self.max_text_size:
+            state.skip_text = True
+            state.text_stream = bytearray()
+            print(f"Dropped streamed text longer than "
+                  f"{self.max_text_size} bytes")
+        else:
+            state.text_stream += chunk
+
+        if flags & TEXT_CHUNK_LAST:
+            text, is_skipped = state.text_stream, state.skip_text
+            state.text_stream, state.skip_text = None, False
+            if not is_skipped:
+                self.handle_message(memoryview(text))
+
+    def handle_ack(self, data: bytes | memoryview):
+        """Removes message acknowledged by peer from outbox"""
+        envelope = Envelope.decode(data)
+        self._remember_version(envelope)
+        if envelope.sequence is not None:
+            self.outbox.ack((envelope.host, envelope.port),
+                            envelope.sequence)
+
+    def _acknowledge(self, envelope: Envelope):
+        """
+        Queues ack of received message. Acks which pile up while
+        one is waiting to be sent go to peer in the same write
+        """
+        peer = (envelope.host, envelope.port)
+        with self._acks_lock:
+            pending = self._pending_acks.setdefault(peer, [])
+            pending.append(envelope.sequence)
+            if len(pending) > 1:
+                return
+        try:
+            self._dispatcher.submit(peer, partial(self._send_acks, peer),
+                                    block=False)
+        except Exception:
+            # peer sends unacknowledged messages again and gets acks then
+            with self._acks_lock:
+                self._pending_acks.pop(peer, None)
+
+    def _send_acks(self, peer: tuple[str, int]):
+        with self._acks_lock:
+            sequences = self._pending_acks.pop(peer, [])
+        data = b"".join(
+            self._encode_frame(*peer, MSG_TYPE_ACK, Envelope(
+                self.username, self.public_ip, self.port, "", self._flags,
+                sequence=sequence
+            ).encode())
+            for sequence in sequences
+        )
+        try:
+            self._send_frame(*peer, data)
+        except OSError:
+            pass
+
+    def _send_heartbeats(self):
+        """
+        Sends heartbeats to contacts until node closes,
+        so both sides know who is online. Offline contacts are skipped,
+        each probe of them would take a dispatcher worker for a connect
+        timeout. They are probed again once their failure is forgotten
+        """
+        while True:
+            for peer in self._heartbeat_targets():
+                self._probe(peer)
+            if self._closed.wait(self.presence.interval):
+                return
+
+    def _heartbeat_targets(self) -> list[tuple[str, int]]:
+        """
+        Returns contacts to send heartbeats to in this round. Datagrams
+        take no pooled connection, so peers receiving them get one
+        each round. Over TCP at most as many peers as the pool keeps
+        connections to are sent one, online and pinned contacts first,
+        the others take turns in the places left
+        """
+        datagram_peers, active, others = [], [], []
+        for contact in list(self.contacts.contacts):
+            peer = contact.self
+            if (peer == (self.public_ip, self.port)
+                    or self.presence.is_offline(peer)):
+                continue
+            if (self._datagram_listening.is_set()
+                    and self._accepts(*peer, FLAG_DATAGRAM)):
+                datagram_peers.append(peer)
+            elif (contact.fingerprint is not None
+                  or self.presence.status(peer) == ONLINE):
+                active.append(peer)
+            else:
+                others.append(peer)
+
+        places = self._pool.max_connections
+        targets = datagram_peers + active[:places]
+        places -= len(active[:places])
+        if others and places > 0:
+            start = self._heartbeat_turn % len(others)
+            turn = (others[start:] + others[:start])[:places]
+            self._heartbeat_turn = start + len(turn)
+            targets += turn
+        return targets
 
+    def _probe(self, peer: tuple[str, int]):
+        """Queues heartbeat to peer unless it uses old text headers"""
+        if self.peer_versions.get(peer) == LEGACY_VERSION:
+            return
+        try:
+            self._dispatcher.submit(
+                peer, partial(self._send_heartbeat, *peer), block=False
+            )
+        except Exception:
+            # peer has sends waiting, they tell if it is online
+            pass
+
+    def _send_heartbeat(self, peer_host: str, peer_port: int):
+        """Sends sender info over pooled connection or as a datagram"""
+        peer = (peer_host, peer_port)
+        payload = Envelope(self.username, self.public_ip, self.port, "",
+                           self._flags).encode()
+        try:
+            self._send_frame(peer_host, peer_port, self._encode_frame(
+                peer_host, peer_port, MSG_TYPE_HEARTBEAT, payload
+            ))
+        except OSError:
+            self.presence.failed(peer)
+            return
+        self._seen(peer)
+
+    def _release_reordered(self):
+        """Delivers messages which waited too long for missing ones"""
+        while not self._closed.wait(REORDER_CHECK_INTERVAL):
+            with self._delivery_lock:
+                for envelope in self._reorder.expire():
+                    self._deliver_message(envelope)
+
+    def _deliver_message(self, envelope: Envelope):
+        """Adds message to queue and prints it if console mode is on"""
         if self._is_console:
-            print(f"\n{groups["username"]} "
-                  f"({groups["host"]}:{groups["port"]}): "
-                  f"{groups["message"]}\n>> ",
+            print(f"\n{envelope.username} "
+                  f"({envelope.host}:{envelope.port}): "
+                  f"{envelope.body}\n>> ",
                   end="", flush=True)
 
         self.contacts.update_peer(
-            groups["host"],
-            int(groups["port"]),
-            groups["username"]
+            envelope.host,
+            envelope.port,
+            envelope.username
         )
         self.new_messages.append(Message(
-            Contact(
-                groups["host"],
-                int(groups["port"]),
-                groups["username"]
-            ),
+            Contact(envelope.host, envelope.port, envelope.username),
             datetime.now(),
-            groups["message"],
-            "text"
+            envelope.body,
+            "text",
+            sequence=envelope.sequence
         ))
 
+    def handle_room_message(self, data: bytes | memoryview):
+        """
+        Shows room message seen for the first time
+        and passes it on to a few members which may not have it yet
+        """
+        message = RoomMessage.decode(data)
+        if not self._seen_messages.add(message.message_id):
+            return
+        envelope = Envelope.decode(message.envelope)
+        author = Contact(envelope.host, envelope.port, envelope.username)
+        me = Contact(self.public_ip, self.port, self.username)
+
+        name = message.room.name
+        with self._rooms_lock:
+            room = self.rooms.get_room(name)
+            # members travel with messages, so new members become known
+            # to everyone, but only members and pinned peers may add
+            # them. Room of first message is kept as invitation
+            is_trusted = (self.contacts.is_pinned(author.host, author.port)
+                          or room is not None and author in room.members)
+            members = [
+                member for member in message.room.members + [author]
+                if member != me and (is_trusted or member == author)
+            ]
+            forwarding_room = message.room
+            if room is None:
+                self.rooms.invite(name, members)
+            elif is_trusted:
+                self.rooms.join(name, members)
+                forwarding_room = Room(name, [me] + room.members)
+        if self._is_console:
+            hint = "" if room else f" (/join {name} to accept)"
+            print(f"\n[{name}] {envelope.username}: "
+                  f"{envelope.body}{hint}\n>> ",
+                  end="", flush=True)
+        self.new_messages.append(Message(
+            author,
+            datetime.now(),
+            envelope.body,
+            "text",
+            room=name,
+            message_id=message.message_id
+        ))
+
+        if message.ttl > 0:
+            # gossip is passed on to members the message carries
+            # even if they aren't taken into room
+            forwarded = message.forwarded(forwarding_room)
+            # receiving thread must not wait for busy peers, gossip
+            # reaches them through other members anyway
+            self._spread(forwarded, {me, author}, block=False)
+
+    def _remember_version(self, envelope: Envelope):
+        """Saves wire version and flags which peer uses for its frames"""
+        peer = (envelope.host, envelope.port)
+        self.peer_versions[peer] = envelope.version
+        self.peer_flags[peer] = envelope.flags
+        self._seen(peer)
+
+    @property
+    def _flags(self) -> int:
+        """Envelope flags announcing what this node accepts"""
+        flags = FLAG_BATCH | FLAG_ACKS | FLAG_STREAMED_TEXT
+        if self.compression:
+            flags |= FLAG_COMPRESSION
+        if self._datagram_listening.is_set():
+            flags |= FLAG_DATAGRAM
+        return flags
+
+    def _frame_limit(self, msg_type: int) -> int:
+        """Returns max payload size of frames of given type"""
+        return self.frame_limits.get(msg_type & TYPE_MASK,
+                                     DEFAULT_MAX_FRAME_SIZE)
+
+    def _accepts(self, peer_host: str, peer_port: int, flag: int) -> bool:
+        """Checks if peer has announced it accepts given feature"""
+        return bool(self.peer_flags.get((peer_host, peer_port), 0) & flag)
+
+    def _accepts_compression(self, peer_host: str, peer_port: int) -> bool:
+        """Checks if both sides have agreed to compress frames"""
+        return self.compression and self._accepts(peer_host, peer_port,
+                                                  FLAG_COMPRESSION)
+
+    def _encode_frame(
+            self,
+            peer_host: str,
+            peer_port: int,
+            msg_type: int,
+            payload: bytes
+    ) -> bytes:
+        """Returns frame, compressed if peer accepts it"""
+        if self._accepts_compression(peer_host, peer_port):
+            return encode_compressed_frame(msg_type, payload)
+        return encode_frame(msg_type, payload)
+
+    def _envelope(
+            self,
+            peer_host: str,
+            peer_port: int,
+            body: str,
+            legacy_field: str,
+            sequence: tuple[int, int] | None = None
+    ) -> bytes:
+        """
+        Returns payload with sender info, body and number of message
+        if it is given. Peers which sent us old text headers get them
+        in return
+        """
+        envelope = Envelope(self.username, self.public_ip, self.port, body,
+                            self._flags)
+        version = self.peer_versions.get((peer_host, peer_port), WIRE_VERSION)
+        if version == LEGACY_VERSION:
+            return envelope.encode_legacy(legacy_field)
+        envelope.sequence = sequence
+        return envelope.encode()
+
+    def _new_sequence(self, peer_host: str,
+                      peer_port: int) -> tuple[int, int]:
+        """Returns session and number of the next message to peer"""
+        peer = (peer_host, peer_port)
+        with self._sequence_lock:
+            number = self._sequence_numbers.get(peer, 0) + 1
+            self._sequence_numbers[peer] = number
+            return self._session, number
+
     def get_message(self) -> Message:
         """Returns the first received message from queue"""
         return self.new_messages.popleft()
@@ -253,5 +2091,23 @@ class Node:
     def close(self):
         """Closes current node"""
         self._is_running = False
+        self._closed.set()
+        self._outbox_changed.set()
+        if self._discovery:
+            self._discovery.stop()
         if self._server_socket:
             self._server_socket.close()
+        self._datagram_socket.close()
+        self._dispatcher.close()
+        # messages which were waiting in dispatcher are kept too
+        self._save_outbox()
+        self._pool.close()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                # shutdown() of SSLSocket drops its TLS state, so the
+                # thread reading it would get raw records left in socket
+                socket.socket.shutdown(conn, socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -0,0 +1,235 @@
+import itertools
+import json
+import os
+import random
+import time
+from threading import Lock
+
+OUTBOX_FILE = "outbox.json"
+# retry delays double from base up to max, a random part of each
+# is cut off so peers coming back aren't hit by everyone at once
+BASE_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+MAX_ATTEMPTS = 8
+MAX_OUTBOX_SIZE = 1000
+
+
+def retry_delay(attempts: int) -> float:
+    """Returns delay before next attempt, with jitter"""
+    delay = min(MAX_RETRY_DELAY, BASE_RETRY_DELAY * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+class OutboxEntry:
+    """Text message which peer hasn't acknowledged yet"""
+
+    def __init__(
+            self,
+            peer_host: str,
+            peer_port: int,
+            body: str,
+            sequence: tuple[int, int],
+            attempts: int = 0
+    ):
+        self.peer_host = peer_host
+        self.peer_port = peer_port
+        self.body = body
+        self.sequence = sequence
+        self.attempts = attempts
+        self.next_attempt = time.monotonic()
+        # entry being sent isn't picked for a retry
+        self.in_flight = False
+        # last attempt failed, so peer wasn't reachable then
+        self.failed = False
+
+    def __repr__(self):
+        return (f"OutboxEntry:{self.peer_host}:{self.peer_port} "
+                f"#{self.sequence[1]} ({self.attempts} attempts)")
+
+    def to_dict(self):
+        """Casts this object to dict for JSON serialization"""
+        return {
+            "host": self.peer_host,
+            "port": self.peer_port,
+            "body": self.body,
+            "attempts": self.attempts
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict, sequence: tuple[int, int]):
+        """Creates an entry from JSON data with number of new session"""
+        return cls(data["host"], data["port"], data["body"], sequence,
+                   data["attempts"])
+
+
+class Outbox:
+    """
+    Messages waiting for delivery acks, with time of their next retry.
+    If path is given, entries are kept in that file between runs
+    """
+
+    def __init__(self, path: str | None = None):
+        self.path = path
+        self._entries = dict[int, OutboxEntry]()
+        self._ids = itertools.count()
+        self._is_dirty = False
+        self._lock = Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def load(self, numbering) -> list[OutboxEntry]:
+        """
+        Loads entries saved by previous run. They are sent again in
+        this session, so numbering(host, port) gives them new numbers
+        """
+        if not self.path or not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, "r") as f:
+                content = f.read()
+            items = json.loads(content) if content.strip() else []
+            entries = [
+                OutboxEntry.from_dict(item, numbering(item["host"],
+                                                      item["port"]))
+                for item in items
+            ]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            print(f"Can't load from '{self.path}'")
+            return []
+        with self._lock:
+            for entry in entries:
+                self._entries[next(self._ids)] = entry
+        return entries
+
+    def save(self):
+        """Writes entries to file if they have changed since last save"""
+        with self._lock:
+            if not self.path or not self._is_dirty:
+                return
+            items = [entry.to_dict() for entry in self._entries.values()]
+            self._is_dirty = False
+        # file is replaced at once, so a crash doesn't leave half of it
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(items, f, indent=4)
+        os.replace(temp_path, self.path)
+
+    def add(self, entry: OutboxEntry) -> OutboxEntry | None:
+        """Adds entry, returns the oldest one if it was dropped for it"""
+        entry.in_flight = True
+        with self._lock:
+            self._entries[next(self._ids)] = entry
+            self._is_dirty = True
+            if len(self._entries) > MAX_OUTBOX_SIZE:
+                oldest = next(iter(self._entries))
+                return self._entries.pop(oldest)
+        return None
+
+    def remove(self, entry: OutboxEntry) -> bool:
+        """Removes entry, returns False if it was already removed"""
+        with self._lock:
+            for entry_id, other in self._entries.items():
+                if other is entry:
+                    del self._entries[entry_id]
+                    self._is_dirty = True
+                    return True
+        return False
+
+    def ack(self, peer: tuple[str, int], sequence: tuple[int, int]) -> bool:
+        """
+        Removes entry acknowledged by peer. Peer may know itself by
+        other host than it was sent to, then a single entry with
+        the number and port of peer is taken
+        """
+        with self._lock:
+            candidates = [
+                (entry_id, entry) for entry_id, entry in self._entries.items()
+                if entry.sequence == sequence
+                and entry.peer_port == peer[1]
+            ]
+            exact = [(entry_id, entry) for entry_id, entry in candidates
+                     if entry.peer_host == peer[0]]
+            if exact or len(candidates) == 1:
+                entry_id, _ = (exact or candidates)[0]
+                del self._entries[entry_id]
+                self._is_dirty = True
+                return True
+        return False
+
+    def due(self, now: float | None = None) -> list[OutboxEntry]:
+        """Returns entries which are to be sent now and marks them sent"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entries = [
+                entry for entry in self._entries.values()
+                if not entry.in_flight and entry.next_attempt <= now
+            ]
+            for entry in entries:
+                entry.in_flight = True
+            return entries
+
+    def retry_later(
+            self,
+            entry: OutboxEntry,
+            failed: bool = True,
+            now: float | None = None
+    ) -> bool:
+        """
+        Schedules next attempt after backoff, entry which was sent
+        is sent again if its ack doesn't come by then.
+        Returns False and removes entry if it is out of attempts
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry.attempts += 1
+            entry.in_flight = False
+            entry.failed = failed
+            self._is_dirty = True
+            if entry.attempts < MAX_ATTEMPTS:
+                entry.next_attempt = now + retry_delay(entry.attempts)
+                return True
+        self.remove(entry)
+        return False
+
+    def postpone(self, entry: OutboxEntry, now: float | None = None):
+        """
+        Keeps entry to a peer known to be offline without using up
+        its attempts, it is sent when peer is back
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry.in_flight = False
+            entry.failed = True
+            entry.next_attempt = now + MAX_RETRY_DELAY
+
+    def wake(self, peer: tuple[str, int],
+             now: float | None = None) -> bool:
+        """
+        Makes entries which failed to reach peer due now,
+        returns True if there were any
+        """
+        now = time.monotonic() if now is None else now
+        is_woken = False
+        with self._lock:
+            for entry in self._entries.values():
+                if ((entry.peer_host, entry.peer_port) == peer
+                        and entry.failed and not entry.in_flight):
+                    entry.next_attempt = now
+                    is_woken = True
+        return is_woken
+
+    def queued(self, peer: tuple[str, int]) -> int:
+        """Returns number of messages which failed to reach peer"""
+        with self._lock:
+            return sum(1 for entry in self._entries.values()
+                       if (entry.peer_host, entry.peer_port) == peer
+                       and entry.failed)
+
+    def next_attempt(self) -> float | None:
+        """Returns time when the next entry is due"""
+        with self._lock:
+            return min((entry.next_attempt
+                        for entry in self._entries.values()
+                        if not entry.in_flight), default=None)
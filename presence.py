@@ -0,0 +1,91 @@
+import time
+from datetime import datetime
+from threading import Lock
+
+# contacts are sent a heartbeat this often, in seconds
+HEARTBEAT_INTERVAL = 15.0
+# peer which wasn't heard from for this many intervals isn't online
+# anymore, failure to reach it is forgotten after the same time
+MISSED_HEARTBEATS = 3
+
+ONLINE = "online"
+OFFLINE = "offline"
+UNKNOWN = "unknown"
+
+
+class PeerPresence:
+    """When peer was last heard from and last failed to be reached"""
+
+    def __init__(self):
+        self.last_seen: float | None = None
+        self.last_seen_at: datetime | None = None
+        self.failed: float | None = None
+
+
+class PresenceTable:
+    """
+    Online status of peers, fed by heartbeats and every frame received
+    from them or sent to them. Peer is offline when the last attempt
+    to reach it failed recently and after it was last heard from
+    """
+
+    def __init__(self, interval: float = HEARTBEAT_INTERVAL):
+        if not isinstance(interval, (int, float)) or interval <= 0:
+            raise ValueError(f"Heartbeat interval must be positive, "
+                             f"but was:{interval}")
+        self.interval = interval
+        self.timeout = interval * MISSED_HEARTBEATS
+        self._peers = dict[tuple[str, int], PeerPresence]()
+        self._lock = Lock()
+
+    def seen(self, peer: tuple[str, int], now: float | None = None) -> bool:
+        """Records that peer is reachable, returns True if it was offline"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            presence = self._peers.setdefault(peer, PeerPresence())
+            was_offline = self._status(presence, now) == OFFLINE
+            presence.last_seen = now
+            presence.last_seen_at = datetime.now()
+            return was_offline
+
+    def failed(self, peer: tuple[str, int], now: float | None = None):
+        """Records that peer couldn't be reached"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._peers.setdefault(peer, PeerPresence()).failed = now
+
+    def status(self, peer: tuple[str, int], now: float | None = None) -> str:
+        """Returns ONLINE, OFFLINE or UNKNOWN"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            presence = self._peers.get(peer)
+            return self._status(presence, now) if presence else UNKNOWN
+
+    def is_offline(self, peer: tuple[str, int]) -> bool:
+        return self.status(peer) == OFFLINE
+
+    def last_seen(self, peer: tuple[str, int]) -> datetime | None:
+        """Returns time when peer was last heard from"""
+        with self._lock:
+            presence = self._peers.get(peer)
+            return presence.last_seen_at if presence else None
+
+    def describe(self, peer: tuple[str, int]) -> str:
+        """Returns status with last seen time for peers not online"""
+        status = self.status(peer)
+        last_seen = self.last_seen(peer)
+        if status == ONLINE or last_seen is None:
+            return status
+        return f"{status}, last seen {last_seen.strftime('%H:%M:%S')}"
+
+    def _status(self, presence: PeerPresence, now: float) -> str:
+        if presence.failed is not None and (
+                presence.last_seen is None
+                or presence.failed >= presence.last_seen):
+            if now - presence.failed <= self.timeout:
+                return OFFLINE
+            return UNKNOWN
+        if (presence.last_seen is not None
+                and now - presence.last_seen <= self.timeout):
+            return ONLINE
+        return UNKNOWN
@@ -0,0 +1,201 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# frames and bytes every peer may send per second on average
+FRAME_RATE = 200.0
+BYTE_RATE = 32 * 1024 * 1024
+# peer may send this many seconds worth of traffic at once
+BURST_SECONDS = 2.0
+# connections one IP may have open at once, parallel file streams
+# and pooled connections of a peer fit in it
+MAX_CONNECTIONS_PER_IP = 16
+# peers tracked at most, idle ones are forgotten first
+MAX_TRACKED_PEERS = 4096
+
+# what happens to traffic over limit: frames are dropped, reading
+# waits until the peer is within limit again, or connection is closed
+POLICY_DROP = "drop"
+POLICY_DELAY = "delay"
+POLICY_DISCONNECT = "disconnect"
+POLICIES = (POLICY_DROP, POLICY_DELAY, POLICY_DISCONNECT)
+
+
+class TokenBucket:
+    """Allows rate per second on average and burst at once"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Returns seconds until amount can be taken, 0 if it can now"""
+        # amount bigger than burst is allowed once bucket is full
+        missing = min(amount, self.burst) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        # delayed traffic leaves bucket in debt, which is paid off
+        # before the next frame is admitted
+        self.tokens -= amount
+
+
+class ThrottleCounters:
+    """How much traffic of one peer was over limit"""
+
+    def __init__(self):
+        self.dropped_frames = 0
+        self.dropped_bytes = 0
+        self.delayed_frames = 0
+        self.delay_time = 0.0
+        self.disconnects = 0
+        self.refused_connections = 0
+
+    def __bool__(self):
+        return bool(self.dropped_frames or self.delayed_frames
+                    or self.disconnects or self.refused_connections)
+
+    def summary(self) -> str:
+        """Returns report in one line"""
+        return (f"{self.dropped_frames} frames "
+                f"({self.dropped_bytes / 1024:.0f} KiB) dropped, "
+                f"{self.delayed_frames} delayed for "
+                f"{self.delay_time:.1f} s, "
+                f"{self.disconnects} disconnects, "
+                f"{self.refused_connections} connections refused")
+
+
+class PeerLimits:
+    """Buckets, open connections and counters of a single IP"""
+
+    def __init__(self, frame_rate: float, byte_rate: float):
+        self.frames = TokenBucket(frame_rate, frame_rate * BURST_SECONDS)
+        self.bytes = TokenBucket(byte_rate, byte_rate * BURST_SECONDS)
+        self.connections = 0
+        self.counters = ThrottleCounters()
+
+
+class RateLimiter:
+    """
+    Admission control of inbound traffic. Every source IP has token
+    buckets for frames and bytes and a cap on open connections.
+    Traffic over limit is handled by policy
+    """
+
+    def __init__(
+            self,
+            frame_rate: float = FRAME_RATE,
+            byte_rate: float = BYTE_RATE,
+            max_connections: int = MAX_CONNECTIONS_PER_IP,
+            policy: str = POLICY_DELAY,
+            max_peers: int = MAX_TRACKED_PEERS
+    ):
+        if not isinstance(frame_rate, (int, float)) or frame_rate <= 0:
+            raise ValueError(f"Frame rate must be positive, "
+                             f"but was:{frame_rate}")
+        if not isinstance(byte_rate, (int, float)) or byte_rate <= 0:
+            raise ValueError(f"Byte rate must be positive, "
+                             f"but was:{byte_rate}")
+        if not isinstance(max_connections, int) or max_connections < 1:
+            raise ValueError(f"Connections per IP must be positive "
+                             f"integer, but was:{max_connections}")
+        if policy not in POLICIES:
+            raise ValueError(f"Over limit policy must be one of "
+                             f"{', '.join(POLICIES)}, but was:{policy}")
+        self.frame_rate = frame_rate
+        self.byte_rate = byte_rate
+        self.max_connections = max_connections
+        self.policy = policy
+        self.max_peers = max_peers
+        self._peers = OrderedDict[str, PeerLimits]()
+        self._lock = Lock()
+
+    def connect(self, host: str) -> bool:
+        """Counts new connection of host, returns False if over cap"""
+        with self._lock:
+            limits = self._limits(host)
+            if limits.connections >= self.max_connections:
+                limits.counters.refused_connections += 1
+                return False
+            limits.connections += 1
+            return True
+
+    def disconnect(self, host: str):
+        """Counts closed connection which connect() has admitted"""
+        with self._lock:
+            limits = self._peers.get(host)
+            if limits and limits.connections > 0:
+                limits.connections -= 1
+
+    def admit(
+            self,
+            host: str,
+            size: int,
+            policy: str | None = None,
+            now: float | None = None
+    ) -> float | None:
+        """
+        Takes a frame of size bytes from host. Returns seconds to wait
+        before handling it, 0 if it can be handled now, or None if it
+        must be refused. policy overrides the one of limiter
+        """
+        policy = policy or self.policy
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            limits = self._limits(host)
+            limits.frames.refill(now)
+            limits.bytes.refill(now)
+            wait = max(limits.frames.wait_time(1),
+                       limits.bytes.wait_time(size))
+            if wait and policy != POLICY_DELAY:
+                if policy == POLICY_DISCONNECT:
+                    limits.counters.disconnects += 1
+                else:
+                    limits.counters.dropped_frames += 1
+                    limits.counters.dropped_bytes += size
+                return None
+
+            limits.frames.take(1)
+            limits.bytes.take(size)
+            if wait:
+                limits.counters.delayed_frames += 1
+                limits.counters.delay_time += wait
+            return wait
+
+    def throttled(self) -> dict[str, ThrottleCounters]:
+        """Returns counters of hosts which went over limit"""
+        with self._lock:
+            return {host: limits.counters
+                    for host, limits in self._peers.items()
+                    if limits.counters}
+
+    def summary(self) -> str:
+        """Returns report with a line per throttled host"""
+        throttled = self.throttled()
+        if not throttled:
+            return "No peer went over rate limits"
+        return "\n".join(f"{host}: {counters.summary()}"
+                         for host, counters in throttled.items())
+
+    def _limits(self, host: str) -> PeerLimits:
+        limits = self._peers.get(host)
+        if limits:
+            self._peers.move_to_end(host)
+            return limits
+
+        limits = self._peers[host] = PeerLimits(self.frame_rate,
+                                                self.byte_rate)
+        if len(self._peers) > self.max_peers:
+            # hosts with open connections are kept, their count is needed
+            for old_host, old in self._peers.items():
+                if old.connections == 0 and old is not limits:
+                    del self._peers[old_host]
+                    break
+        return limits
@@ -0,0 +1,161 @@
+import multiprocessing
+import queue
+import socket
+from threading import Thread
+
+from outbox import Outbox
+from reorder import ReorderBuffer
+
+# receiving processes are started fresh, as forking a process
+# with running threads may copy held locks
+START_METHOD = "spawn"
+WORKER_STOP_TIMEOUT = 2.0
+# kinds of events passed from receiving processes
+EVENT_MESSAGE = "message"
+EVENT_ACK = "ack"
+EVENT_TEXT = "text"
+
+
+def supports_reuse_port() -> bool:
+    """Checks if several sockets may listen on the same port"""
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+class MessageSink:
+    """
+    Stands for new messages queue of node in receiving process,
+    passes messages to main process with what is known about sender
+    """
+
+    def __init__(self, node, events: multiprocessing.Queue):
+        self._node = node
+        self._events = events
+
+    def __len__(self):
+        return 0
+
+    def append(self, message):
+        peer = message.sender.self
+        self._events.put((
+            EVENT_MESSAGE,
+            message,
+            self._node.peer_versions.get(peer),
+            self._node.peer_flags.get(peer)
+        ))
+
+
+class AckSink(Outbox):
+    """
+    Stands for outbox of node in receiving process. Acks come to
+    the shared port, so they are passed to outbox of main process
+    """
+
+    def __init__(self, events: multiprocessing.Queue):
+        super().__init__()
+        self._events = events
+
+    def ack(self, peer: tuple[str, int], sequence: tuple[int, int]) -> bool:
+        self._events.put((EVENT_ACK, peer, sequence))
+        return True
+
+
+class OrderSink(ReorderBuffer):
+    """
+    Stands for order buffer of node in receiving process. Connections
+    of a peer may be taken by different processes, so its numbered
+    messages are put in order and deduplicated by main process
+    """
+
+    def __init__(self, events: multiprocessing.Queue):
+        super().__init__()
+        self._events = events
+
+    def push(
+            self,
+            peer: tuple[str, int],
+            session: int,
+            number: int,
+            item,
+            now: float | None = None
+    ) -> list:
+        self._events.put((EVENT_TEXT, item))
+        return []
+
+
+def run_worker(
+        node_class: type,
+        settings: dict,
+        downloads_path: str,
+        events: multiprocessing.Queue,
+        stop
+):
+    """Receives frames in a separate process until stop is set"""
+    node = node_class(**settings)
+    node._server_socket.setsockopt(socket.SOL_SOCKET,
+                                   socket.SO_REUSEPORT, 1)
+    node.new_messages = MessageSink(node, events)
+    node.outbox = AckSink(events)
+    node._reorder = OrderSink(events)
+    node._is_worker = True
+    Thread(
+        target=node.receive_messages,
+        args=(downloads_path,),
+        daemon=True
+    ).start()
+    stop.wait()
+    node.close()
+
+
+class ReceiveWorkers:
+    """
+    Processes which accept connections on the same port
+    and decode frames in parallel. Kernel spreads connections
+    between them, so all frames of one connection are decoded
+    by one process and its messages keep their order
+    """
+
+    def __init__(self, node_class: type, settings: dict, processes: int):
+        if processes < 1:
+            raise ValueError(f"Processes must be positive integer, "
+                             f"but was:{processes}")
+        self._context = multiprocessing.get_context(START_METHOD)
+        self._node_class = node_class
+        self._settings = settings
+        self._events = self._context.Queue()
+        self._stop = self._context.Event()
+        self.processes = processes
+        self._processes = list[multiprocessing.Process]()
+
+    def start(self, downloads_path: str):
+        """Starts all processes"""
+        for _ in range(self.processes):
+            process = self._context.Process(
+                target=run_worker,
+                args=(self._node_class, self._settings, downloads_path,
+                      self._events, self._stop),
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+
+    def get(self, timeout: float):
+        """
+        Returns next event: message with wire version and flags of its
+        sender, envelope of numbered text or ack with peer and sequence,
+        all after kind of event. Returns None if there was no event
+        for timeout
+        """
+        try:
+            return self._events.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        """Stops processes, kills those which didn't stop in time"""
+        self._stop.set()
+        for process in self._processes:
+            process.join(WORKER_STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._events.close()
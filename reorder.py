@@ -0,0 +1,112 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# message which came ahead of a missing one waits this long for it
+REORDER_TIMEOUT = 0.5
+# messages waiting for a missing one, per peer
+MAX_PENDING = 64
+# numbers given up on, which are still delivered if they come late
+MAX_SKIPPED = 256
+
+
+class PeerSequence:
+    """Where the stream of messages from one peer is"""
+
+    def __init__(self, session: int):
+        self.session = session
+        self.next_number = 1
+        # { number: item which came ahead of a missing one }
+        self.pending = dict[int, object]()
+        self.gap_started: float | None = None
+        self.skipped = OrderedDict[int, None]()
+
+    def release(self) -> list:
+        """Returns pending items which follow delivered ones"""
+        ready = []
+        while self.next_number in self.pending:
+            ready.append(self.pending.pop(self.next_number))
+            self.next_number += 1
+        return ready
+
+    def skip_gap(self) -> list:
+        """Gives up on missing numbers before the first pending item"""
+        first = min(self.pending)
+        for number in range(max(self.next_number, first - MAX_SKIPPED),
+                            first):
+            self.skipped[number] = None
+        while len(self.skipped) > MAX_SKIPPED:
+            self.skipped.popitem(last=False)
+        self.next_number = first
+        return self.release()
+
+
+class ReorderBuffer:
+    """
+    Puts messages of each peer back into order they were sent in
+    and drops duplicates. A message which came ahead of a missing one
+    waits for it for a short time, then the missing one is skipped and
+    delivered whenever it comes
+    """
+
+    def __init__(
+            self,
+            timeout: float = REORDER_TIMEOUT,
+            max_pending: int = MAX_PENDING
+    ):
+        if timeout <= 0:
+            raise ValueError(f"Timeout must be positive, but was:{timeout}")
+        if max_pending < 1:
+            raise ValueError(f"Max pending must be positive, "
+                             f"but was:{max_pending}")
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self._peers = dict[tuple[str, int], PeerSequence]()
+        self._lock = Lock()
+
+    def push(
+            self,
+            peer: tuple[str, int],
+            session: int,
+            number: int,
+            item,
+            now: float | None = None
+    ) -> list:
+        """Adds item sent with given number, returns items ready in order"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            sequence = self._peers.get(peer)
+            # peer has restarted and counts from the start
+            if sequence is None or sequence.session != session:
+                sequence = self._peers[peer] = PeerSequence(session)
+
+            if number < sequence.next_number:
+                if number in sequence.skipped:
+                    del sequence.skipped[number]
+                    return [item]
+                return []
+            if number in sequence.pending:
+                return []
+
+            sequence.pending[number] = item
+            ready = sequence.release()
+            if len(sequence.pending) > self.max_pending:
+                ready += sequence.skip_gap()
+            if not sequence.pending:
+                sequence.gap_started = None
+            elif ready or sequence.gap_started is None:
+                sequence.gap_started = now
+            return ready
+
+    def expire(self, now: float | None = None) -> list:
+        """Returns items which waited too long for missing ones"""
+        now = time.monotonic() if now is None else now
+        ready = []
+        with self._lock:
+            for sequence in self._peers.values():
+                if (sequence.gap_started is None
+                        or now - sequence.gap_started < self.timeout):
+                    continue
+                ready += sequence.skip_gap()
+                sequence.gap_started = now if sequence.pending else None
+        return ready
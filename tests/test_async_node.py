@@ -0,0 +1,218 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from async_node import AsyncNode
+from node import Node, MSG_TYPE_TEXT, MSG_TYPE_FILE_META, \
+    MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END
+
+
+def text_frame(username: str, port: int, text: str) -> bytes:
+    message_bytes = (f"SENDER:{username} 127.0.0.1:{port} | "
+                     f"MESSAGE:{text}").encode("utf-8")
+    return (bytes([MSG_TYPE_TEXT])
+            + len(message_bytes).to_bytes(4, "big")
+            + message_bytes)
+
+
+class TestAsyncNode(unittest.TestCase):
+    def setUp(self):
+        self.downloads = tempfile.mkdtemp()
+        self.node = AsyncNode(
+            host="localhost",
+            port=0,
+            username="test_user",
+            public_ip="127.0.0.1",
+            # every test peer connects from the same IP
+            connections_per_ip=64
+        )
+        self.server_thread = threading.Thread(
+            target=self.node.receive_messages,
+            args=(self.downloads,),
+            daemon=True
+        )
+        self.server_thread.start()
+        time.sleep(0.1)
+        self.server_port = self.node._server_socket.getsockname()[1]
+
+    def tearDown(self):
+        self.node.close()
+        self.server_thread.join(timeout=1.0)
+        shutil.rmtree(self.downloads)
+
+    def wait_for_messages(self, count: int, timeout: float = 2.0):
+        deadline = time.monotonic() + timeout
+        while (len(self.node.new_messages) < count
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+
+    def test_receive_text_message(self):
+        with socket.create_connection(("localhost", self.server_port)) as s:
+            s.sendall(text_frame("sender_user", 8001, "Hello, world!"))
+
+        self.wait_for_messages(1)
+        message = self.node.get_message()
+        self.assertEqual("Hello, world!", message.content)
+        self.assertEqual("sender_user", message.sender.username)
+        self.assertEqual(("127.0.0.1", 8001), message.sender.self)
+
+    def test_slow_peer_does_not_block_others(self):
+        frame = text_frame("slow_user", 8001, "slow")
+        slow = socket.create_connection(("localhost", self.server_port))
+        try:
+            slow.sendall(frame[:3])
+
+            with socket.create_connection(
+                    ("localhost", self.server_port)) as fast:
+                fast.sendall(text_frame("fast_user", 8002, "fast"))
+
+            self.wait_for_messages(1)
+            self.assertEqual("fast", self.node.get_message().content)
+
+            slow.sendall(frame[3:])
+        finally:
+            slow.close()
+
+        self.wait_for_messages(1)
+        self.assertEqual("slow", self.node.get_message().content)
+
+    def test_many_concurrent_connections(self):
+        peers = [
+            socket.create_connection(("localhost", self.server_port))
+            for _ in range(50)
+        ]
+        for i, peer in enumerate(peers):
+            peer.sendall(text_frame(f"user{i}", 9000 + i, f"message {i}"))
+        for peer in peers:
+            peer.close()
+
+        self.wait_for_messages(50)
+        contents = {message.content for message in self.node.new_messages}
+        self.assertEqual({f"message {i}" for i in range(50)}, contents)
+
+    def test_interleaved_file_transfers(self):
+        def file_frames(filename: str, content: bytes):
+            meta = (f"SENDER:user 127.0.0.1:8001 | "
+                    f"FILENAME:{filename}").encode("utf-8")
+            return (bytes([MSG_TYPE_FILE_META])
+                    + len(meta).to_bytes(4, "big") + meta,
+                    bytes([MSG_TYPE_FILE_DATA])
+                    + len(content).to_bytes(4, "big") + content
+                    + bytes([MSG_TYPE_FILE_END]))
+
+        first_meta, first_rest = file_frames("first.txt", b"first")
+        second_meta, second_rest = file_frames("second.txt", b"second")
+        with (socket.create_connection(("localhost", self.server_port))
+              as first,
+              socket.create_connection(("localhost", self.server_port))
+              as second):
+            first.sendall(first_meta)
+            second.sendall(second_meta)
+            self.wait_for_messages(2)
+            first.sendall(first_rest)
+            second.sendall(second_rest)
+
+        time.sleep(0.2)
+        for filename, content in (("first.txt", b"first"),
+                                  ("second.txt", b"second")):
+            with open(os.path.join(self.downloads, filename), "rb") as f:
+                self.assertEqual(content, f.read())
+
+    def test_file_written_off_event_loop(self):
+        threads = {}
+        handle_frame = self.node.handle_frame
+
+        def record_thread(msg_type, payload, downloads_path):
+            threads[msg_type] = threading.current_thread()
+            handle_frame(msg_type, payload, downloads_path)
+
+        meta = (f"SENDER:user 127.0.0.1:8001 | "
+                f"FILENAME:file.txt").encode("utf-8")
+        with (patch.object(self.node, "handle_frame",
+                           side_effect=record_thread),
+              socket.create_connection(("localhost", self.server_port))
+              as s):
+            s.sendall(bytes([MSG_TYPE_FILE_META])
+                      + len(meta).to_bytes(4, "big") + meta
+                      + bytes([MSG_TYPE_FILE_DATA])
+                      + (4).to_bytes(4, "big") + b"data"
+                      + bytes([MSG_TYPE_FILE_END])
+                      + text_frame("user", 8001, "after file"))
+            self.wait_for_messages(2)
+
+        self.assertIs(self.server_thread, threads[MSG_TYPE_TEXT])
+        for msg_type in (MSG_TYPE_FILE_META, MSG_TYPE_FILE_DATA,
+                         MSG_TYPE_FILE_END):
+            self.assertIsNot(self.server_thread, threads[msg_type])
+        with open(os.path.join(self.downloads, "file.txt"), "rb") as f:
+            self.assertEqual(b"data", f.read())
+
+    @patch("async_node.CONNECTION_IDLE_TIMEOUT", 0.2)
+    def test_silent_peer_disconnected(self):
+        with socket.create_connection(("localhost", self.server_port)) as s:
+            s.settimeout(2.0)
+            self.assertEqual(b"", s.recv(1))
+
+    @patch("node.CHUNKED_TRANSFER_THRESHOLD", 1024)
+    def test_chunked_file_transfer(self):
+        content = os.urandom(2 * 1024 * 1024 + 3)
+        source_dir = tempfile.mkdtemp()
+        path = os.path.join(source_dir, "source.bin")
+        with open(path, "wb") as f:
+            f.write(content)
+        sender = Node(port=0, username="sender", public_ip="127.0.0.1")
+        try:
+            sender.send_file("localhost", self.server_port, path)
+        finally:
+            sender.close()
+            shutil.rmtree(source_dir)
+
+        self.wait_for_messages(1)
+        self.assertEqual("source.bin", self.node.get_message().content)
+        with open(os.path.join(self.downloads, "source.bin"), "rb") as f:
+            self.assertEqual(content, f.read())
+
+    @unittest.skipUnless(shutil.which("openssl"), "openssl isn't installed")
+    def test_tls_message(self):
+        certs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, certs)
+        settings = {"tls": True,
+                    "cert_path": os.path.join(certs, "cert.pem"),
+                    "key_path": os.path.join(certs, "key.pem")}
+        node = AsyncNode(host="localhost", port=0, username="receiver",
+                         public_ip="127.0.0.1", **settings)
+        thread = threading.Thread(target=node.receive_messages,
+                                  args=(self.downloads,), daemon=True)
+        thread.start()
+        time.sleep(0.1)
+        port = node._server_socket.getsockname()[1]
+        sender = Node(port=0, public_ip="127.0.0.1", **settings)
+        try:
+            sender.send_message("localhost", port, "secret")
+            deadline = time.monotonic() + 2.0
+            while not node.new_messages and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual("secret", node.get_message().content)
+        finally:
+            sender.close()
+            node.close()
+            thread.join(timeout=1.0)
+
+    def test_several_processes_refused(self):
+        with self.assertRaises(ValueError):
+            AsyncNode(port=8005, receive_processes=2)
+
+    def test_close_stops_server(self):
+        self.node.close()
+        self.server_thread.join(timeout=1.0)
+        self.assertFalse(self.server_thread.is_alive())
+        self.assertFalse(self.node._is_running)
+
+
+if __name__ == "__main__":
+    unittest.main()
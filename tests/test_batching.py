@@ -0,0 +1,51 @@
+import threading
+import time
+import unittest
+from concurrent.futures import Future
+
+from batching import MessageBatch
+
+
+class TestMessageBatch(unittest.TestCase):
+    def setUp(self):
+        self.batch = MessageBatch(max_messages=3, max_size=100)
+
+    def test_seal_after_window(self):
+        self.assertTrue(self.batch.add(b"first"))
+        self.assertTrue(self.batch.add(b"second"))
+        self.assertEqual([b"first", b"second"], self.batch.seal(0.01))
+        self.assertFalse(self.batch.add(b"late"))
+
+    def test_full_batch_sealed_at_once(self):
+        for payload in (b"1", b"2", b"3"):
+            self.assertTrue(self.batch.add(payload))
+        self.assertFalse(self.batch.add(b"4"))
+
+        started = time.monotonic()
+        self.assertEqual([b"1", b"2", b"3"], self.batch.seal(10.0))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_size_limit(self):
+        self.assertTrue(self.batch.add(b"a" * 60))
+        self.assertFalse(self.batch.add(b"b" * 60))
+        # a single big payload is still sent
+        batch = MessageBatch(max_size=10)
+        self.assertTrue(batch.add(b"c" * 20))
+
+    def test_add_while_waiting(self):
+        self.batch.add(b"first")
+        timer = threading.Timer(0.01, self.batch.add, args=(b"second",))
+        timer.start()
+        self.assertEqual([b"first", b"second"], self.batch.seal(0.5))
+        timer.join()
+
+    def test_resolve(self):
+        sent = Future()
+        sent.set_exception(OSError("peer is down"))
+        self.batch.resolve(sent)
+        with self.assertRaises(OSError):
+            self.batch.future.result()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from broadcast import BroadcastReport, BroadcastResult
+from contacts import Contact
+
+
+class TestBroadcastReport(unittest.TestCase):
+    def setUp(self):
+        self.alice = Contact("127.0.0.1", 8001, "alice")
+        self.bob = Contact("127.0.0.1", 8002, "bob")
+        self.report = BroadcastReport([
+            BroadcastResult(self.alice, 0.0021),
+            BroadcastResult(self.bob, 0.5, ConnectionRefusedError("refused"))
+        ], 0.5123)
+
+    def test_sent_and_failed(self):
+        self.assertEqual([self.alice],
+                         [result.peer for result in self.report.sent])
+        self.assertEqual([self.bob],
+                         [result.peer for result in self.report.failed])
+
+    def test_summary(self):
+        self.assertEqual(
+            "  alice (127.0.0.1:8001): sent in 2.1 ms\n"
+            "  bob (127.0.0.1:8002): failed after 500.0 ms: refused\n"
+            "Broadcast to 2 peers took 512.3 ms: 1 sent, 1 failed",
+            self.report.summary()
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -11,7 +11,8 @@ class TestChat(unittest.TestCase):
         self.test_args = Namespace(
             local=True,
             console=True,
-            port=8000
+            port=8000,
+            async_io=False
         )
 
         self.patcher_userconfig = patch("chat.UserConfig")
@@ -19,6 +20,17 @@ class TestChat(unittest.TestCase):
         self.mock_userconfig.return_value.downloads_dir = "/test_downloads"
         self.mock_userconfig.return_value.username = "test_user"
         self.mock_userconfig.return_value.server_port = 8000
+        self.mock_userconfig.return_value.transfer_streams = 4
+        self.mock_userconfig.return_value.compression = True
+        self.mock_userconfig.return_value.datagrams = True
+        self.mock_userconfig.return_value.receive_processes = 1
+        self.mock_userconfig.return_value.heartbeat_interval = 15.0
+        self.mock_userconfig.return_value.discovery = False
+        self.mock_userconfig.return_value.frame_rate = 200.0
+        self.mock_userconfig.return_value.byte_rate = 1024.0
+        self.mock_userconfig.return_value.connections_per_ip = 16
+        self.mock_userconfig.return_value.over_limit = "delay"
+        self.mock_userconfig.return_value.tls = False
 
         self.patcher_node = patch("chat.Node")
         self.mock_node = self.patcher_node.start()
@@ -35,7 +47,7 @@ class TestChat(unittest.TestCase):
     @patch("builtins.print")
     def test_print_help_output(self, mock_print):
         Chat.print_help()
-        self.assertEqual(mock_print.call_count, 9)
+        self.assertEqual(mock_print.call_count, 14)
         calls = mock_print.call_args_list
 
         expected_output = [
@@ -44,7 +56,13 @@ class TestChat(unittest.TestCase):
             "Adds new peer to known",
             "  /send <username> <message>   Sends a message to peer",
             "  /sendfile <username> <path_to_file>   Sends a file to peer",
-            "  /list   Prints list of known peers",
+            "  /broadcast <message>   Sends a message to all known peers",
+            "  /join <room> [<username> ...]   "
+            "Joins a room or adds peers to it",
+            "  /room <room> <message>   Sends a message to room",
+            "  /list   Prints list of known peers and who is online",
+            "  /throttled   Prints peers which went over rate limits",
+            "  /disk   Prints how far disk writes fell behind",
             "  /clear   Clear all known peers",
             "  /chname <username>   Edits current username",
             "  /chport <port>   Edits current port. This will restart server",
@@ -59,6 +77,10 @@ class TestChat(unittest.TestCase):
         with (patch.object(self.chat, "add_contact") as mock_add_contact,
               patch.object(self.chat, "send_file") as mock_send_file,
               patch.object(self.chat, "send_message") as mock_send_message,
+              patch.object(self.chat, "broadcast") as mock_broadcast,
+              patch.object(self.chat, "join_room") as mock_join_room,
+              patch.object(self.chat, "send_room_message")
+              as mock_send_room_message,
               patch.object(self.chat, "change_name") as mock_change_name,
               patch.object(self.chat, "change_port") as mock_change_port,
               patch.object(self.chat, "print_help") as mock_print_help,
@@ -73,6 +95,9 @@ class TestChat(unittest.TestCase):
             "add_contact": mock_add_contact,
             "send_file": mock_send_file,
             "send_message": mock_send_message,
+            "broadcast": mock_broadcast,
+            "join_room": mock_join_room,
+            "send_room_message": mock_send_room_message,
             "change_name": mock_change_name,
             "change_port": mock_change_port,
             "print_help": mock_print_help,
@@ -106,9 +131,50 @@ class TestChat(unittest.TestCase):
         mocks = self.simulate_commands(["/sendfile user1 data.txt", "/exit"])
         mocks["send_file"].assert_called_once_with("/sendfile user1 data.txt")
 
+    def test_broadcast_command(self):
+        mocks = self.simulate_commands(["/broadcast Hi all", "/exit"])
+        mocks["broadcast"].assert_called_once_with("/broadcast Hi all")
+        mocks["send_message"].assert_not_called()
+
+    def test_room_commands(self):
+        mocks = self.simulate_commands(["/join friends user1 user2",
+                                        "/room friends Hi", "/exit"])
+        mocks["join_room"].assert_called_once_with(
+            "/join friends user1 user2"
+        )
+        mocks["send_room_message"].assert_called_once_with(
+            "/room friends Hi"
+        )
+
     def test_list_command(self):
         mocks = self.simulate_commands(["/list", "/exit"])
-        mocks["print_contacts"].assert_called_once()
+        mocks["print_contacts"].assert_called_once_with(
+            self.chat.node.presence
+        )
+
+    def test_list_shows_peers_found_on_lan(self):
+        self.chat.node.discovered_peers.return_value = {
+            ("10.0.0.1", 8001): "alice", ("10.0.0.2", 8001): "bob"
+        }
+        self.chat.node.contacts.get_contact_by_address.side_effect = (
+            lambda host, port: MagicMock() if host == "10.0.0.1" else None
+        )
+        with patch("builtins.print") as mock_print:
+            self.chat.list_peers()
+        mock_print.assert_any_call("Found on LAN:")
+        mock_print.assert_called_with("  bob (10.0.0.2:8001)")
+
+    def test_throttled_command(self):
+        mocks = self.simulate_commands(["/throttled", "/exit"])
+        mocks["print"].assert_any_call(
+            self.chat.node.limiter.summary.return_value
+        )
+
+    def test_disk_command(self):
+        mocks = self.simulate_commands(["/disk", "/exit"])
+        mocks["print"].assert_any_call(
+            self.chat.node.disk_stats.summary.return_value
+        )
 
     def test_clear_command(self):
         mocks = self.simulate_commands(["/clear", "/exit"])
@@ -151,17 +217,14 @@ class TestChat(unittest.TestCase):
 
     def test_send_message_valid(self):
         mock_peer = MagicMock()
-        self.chat.node.contacts.get_contact_by_username.return_value = (
-            mock_peer
-        )
+        self.chat.node.find_peer.return_value = mock_peer
         self.chat.send_message("/send friend Hello!")
-        self.chat.node.send_message.assert_called_with(
+        self.chat.node.send_message_async.assert_called_with(
             mock_peer.host, mock_peer.port, "Hello!"
         )
 
     def test_send_message_invalid(self):
-        self.chat.node.contacts.get_contact_by_username.return_value = None
-        self.chat.node.contacts.get_contact_by_host.return_value = None
+        self.chat.node.find_peer.return_value = None
         with patch("builtins.print") as mock_print:
             self.chat.send_message("/send user1 Hello")
             mock_print.assert_called_with(
@@ -170,14 +233,63 @@ class TestChat(unittest.TestCase):
 
     def test_send_file_valid(self):
         mock_peer = MagicMock()
-        self.chat.node.contacts.get_contact_by_username.return_value = (
-            mock_peer
-        )
+        self.chat.node.find_peer.return_value = mock_peer
         self.chat.send_file("/sendfile friend test.txt")
-        self.chat.node.send_file.assert_called_with(
+        self.chat.node.send_file_async.assert_called_with(
             mock_peer.host, mock_peer.port, "test.txt"
         )
 
+    def test_broadcast_valid(self):
+        contacts = [MagicMock(), MagicMock()]
+        self.chat.node.contacts.contacts = contacts
+        self.chat.broadcast("/broadcast Hello, everyone!")
+        self.chat.node.broadcast.assert_called_once_with(
+            contacts, "Hello, everyone!"
+        )
+
+    def test_broadcast_invalid(self):
+        with patch("builtins.print") as mock_print:
+            self.chat.broadcast("/broadcast")
+            mock_print.assert_called_with("Usage: /broadcast <message>")
+
+    def test_join_room_valid(self):
+        alice, bob = MagicMock(), MagicMock()
+        self.chat.node.find_peer.side_effect = [alice, bob]
+        with patch("builtins.print"):
+            self.chat.join_room("/join friends alice 127.0.0.2")
+        self.chat.node.join_room.assert_called_once_with(
+            "friends", [alice, bob]
+        )
+
+    def test_join_invited_room(self):
+        with patch("builtins.print"):
+            self.chat.join_room("/join friends")
+        self.chat.node.join_room.assert_called_once_with("friends", [])
+
+    def test_join_room_unknown_user(self):
+        self.chat.node.find_peer.return_value = None
+        with patch("builtins.print") as mock_print:
+            self.chat.join_room("/join friends nobody")
+            mock_print.assert_called_with(
+                "There's no user nobody in your contacts"
+            )
+        self.chat.node.join_room.assert_not_called()
+
+    def test_send_room_message(self):
+        self.chat.send_room_message("/room friends Hello, room!")
+        self.chat.node.send_room_message.assert_called_once_with(
+            "friends", "Hello, room!"
+        )
+
+    def test_send_room_message_unknown_room(self):
+        self.chat.node.rooms.get_room.return_value = None
+        with patch("builtins.print") as mock_print:
+            self.chat.send_room_message("/room work Hi")
+            mock_print.assert_called_with(
+                "There's no such room, use /join first"
+            )
+        self.chat.node.send_room_message.assert_not_called()
+
     def test_change_name_valid(self):
         self.chat.change_name("/chname new_username")
         self.chat.config.save_config.assert_called_with(
@@ -206,6 +318,27 @@ class TestChat(unittest.TestCase):
                 self.chat.run()
                 mock_cycle.assert_called()
 
+    def test_async_node_selection(self):
+        with patch("chat.AsyncNode") as mock_async_node:
+            test_args = Namespace(
+                local=True,
+                console=True,
+                port=8000,
+                async_io=True
+            )
+            chat = Chat(test_args)
+            self.assertIs(chat.node, mock_async_node.return_value)
+
+    def test_async_node_receives_on_one_process(self):
+        self.mock_userconfig.return_value.receive_processes = 4
+        with patch("chat.AsyncNode") as mock_async_node, \
+                patch("builtins.print"):
+            Chat(Namespace(local=True, console=True, port=8000,
+                           async_io=True))
+        self.assertEqual(
+            1, mock_async_node.call_args.kwargs["receive_processes"]
+        )
+
     @patch("socket.gethostbyname")
     def test_public_ip_detection(self, mock_gethost):
         mock_gethost.return_value = "192.168.1.100"
@@ -213,7 +346,8 @@ class TestChat(unittest.TestCase):
             test_args = Namespace(
                 local=False,
                 console=True,
-                port=8000
+                port=8000,
+                async_io=False
             )
             chat = Chat(test_args)
             mock_print.assert_any_call(
@@ -110,6 +110,27 @@ class TestChatHistory(unittest.TestCase):
         self.assertEqual(len(chat.messages), 1)
         self.assertEqual(chat.messages[0].content, "Hello, world!")
 
+    def test_late_message_put_in_send_order(self):
+        chat = ChatHistory(self.contact)
+        you = Contact("127.0.0.1", 1234, "You")
+
+        def message(content, sender=self.contact, sequence=None):
+            return Message(sender, self.sent_time, content,
+                           sequence=sequence)
+
+        chat.add_message(message("old"))
+        chat.add_message(message("1", sequence=(5, 1)))
+        chat.add_message(message("reply", sender=you))
+        chat.add_message(message("3", sequence=(5, 3)))
+        chat.add_message(message("4", sequence=(5, 4)))
+        self.assertEqual(3, chat.add_message(message("2",
+                                                     sequence=(5, 2))))
+        # sender has restarted and counts again
+        self.assertEqual(6, chat.add_message(message("new",
+                                                     sequence=(6, 1))))
+        self.assertEqual(["old", "1", "reply", "2", "3", "4", "new"],
+                         [msg.content for msg in chat.messages])
+
     def test_save_and_load(self):
         chat = ChatHistory(self.contact, name="Test Chat")
         chat.add_message(self.message)
@@ -0,0 +1,67 @@
+import os
+import unittest
+import zlib
+
+from compression import COMPRESSED_FLAG, MAX_DECOMPRESSED_SIZE, \
+    decompress_payload, encode_compressed_frame, is_compressible
+from framing import FrameDecoder, MSG_TYPE_TEXT
+
+
+def decode(frame: bytes) -> tuple[int, bytes]:
+    decoder = FrameDecoder()
+    decoder.feed(frame)
+    msg_type, payload = next(decoder.frames())
+    return msg_type, bytes(payload)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.text = b"Hello, world! " * 100
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible(self.text))
+        self.assertFalse(is_compressible(os.urandom(64 * 1024)))
+        self.assertFalse(is_compressible(b"short"))
+
+    def test_compressed_frame(self):
+        msg_type, payload = decode(
+            encode_compressed_frame(MSG_TYPE_TEXT, self.text)
+        )
+        self.assertEqual(MSG_TYPE_TEXT | COMPRESSED_FLAG, msg_type)
+        self.assertLess(len(payload), len(self.text))
+        self.assertEqual(self.text, decompress_payload(payload))
+
+    def test_incompressible_frame_sent_plain(self):
+        data = os.urandom(4096)
+        self.assertEqual(
+            (MSG_TYPE_TEXT, data),
+            decode(encode_compressed_frame(MSG_TYPE_TEXT, data))
+        )
+
+    def test_small_frame_sent_plain(self):
+        self.assertEqual(
+            (MSG_TYPE_TEXT, b"Hi"),
+            decode(encode_compressed_frame(MSG_TYPE_TEXT, b"Hi"))
+        )
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            decompress_payload(b"not zlib")
+        with self.assertRaises(ValueError):
+            decompress_payload(zlib.compress(self.text)[:-4])
+
+    def test_too_big(self):
+        bomb = zlib.compress(bytes(MAX_DECOMPRESSED_SIZE + 1))
+        with self.assertRaises(ValueError):
+            decompress_payload(bomb)
+
+    def test_over_given_size(self):
+        compressed = zlib.compress(self.text)
+        self.assertEqual(self.text,
+                         decompress_payload(compressed, len(self.text)))
+        with self.assertRaises(ValueError):
+            decompress_payload(compressed, len(self.text) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import socket
+import threading
+import time
+import unittest
+
+from connection_pool import ConnectionPool
+
+
+class PeerServer:
+    """Accepts connections and collects everything peers send"""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(("localhost", 0))
+        self.socket.listen()
+        self.port = self.socket.getsockname()[1]
+        self.accepted = 0
+        self.received = b""
+        self.connections = list[socket.socket]()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.socket.accept()
+            except OSError:
+                return
+            with self._lock:
+                self.accepted += 1
+                self.connections.append(conn)
+            threading.Thread(
+                target=self._read, args=(conn,), daemon=True
+            ).start()
+
+    def _read(self, conn: socket.socket):
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            with self._lock:
+                self.received += data
+
+    def drop_connections(self):
+        with self._lock:
+            for conn in self.connections:
+                conn.shutdown(socket.SHUT_RDWR)
+                conn.close()
+            self.connections.clear()
+
+    def close(self):
+        self.drop_connections()
+        self.socket.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = PeerServer()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.close()
+
+    def wait_for(self, expected: bytes):
+        deadline = time.monotonic() + 2.0
+        while (self.server.received != expected
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(expected, self.server.received)
+
+    def test_invalid_max_connections(self):
+        with self.assertRaises(ValueError):
+            ConnectionPool(max_connections=0)
+
+    def test_connection_reused(self):
+        for i in range(5):
+            self.pool.send("localhost", self.server.port, b"%d" % i)
+
+        self.wait_for(b"01234")
+        self.assertEqual(1, self.server.accepted)
+        self.assertEqual(1, len(self.pool))
+
+    def test_reconnect_after_peer_closed(self):
+        self.pool.send("localhost", self.server.port, b"first")
+        self.wait_for(b"first")
+        self.server.drop_connections()
+        time.sleep(0.05)
+
+        self.pool.send("localhost", self.server.port, b"second")
+
+        self.wait_for(b"firstsecond")
+        self.assertEqual(2, self.server.accepted)
+
+    def test_idle_eviction(self):
+        self.pool.idle_timeout = 0.05
+        self.pool.send("localhost", self.server.port, b"data")
+        time.sleep(0.1)
+
+        self.pool.evict_idle()
+
+        self.assertEqual(0, len(self.pool))
+
+    def test_max_connections(self):
+        other = PeerServer()
+        try:
+            pool = ConnectionPool(max_connections=1)
+            pool.send("localhost", self.server.port, b"a")
+            pool.send("localhost", other.port, b"b")
+
+            self.assertEqual(1, len(pool))
+            with pool.connection("localhost", other.port):
+                pass
+            time.sleep(0.05)
+            self.assertEqual(1, other.accepted)
+            pool.close()
+        finally:
+            other.close()
+
+    def test_connection_dropped_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with self.pool.connection("localhost", self.server.port):
+                raise RuntimeError("failed while sending")
+
+        self.assertEqual(0, len(self.pool))
+
+    def test_connect_error(self):
+        self.server.close()
+        with self.assertRaises(OSError):
+            self.pool.send("localhost", self.server.port, b"data")
+        self.assertEqual(0, len(self.pool))
+
+
+if __name__ == "__main__":
+    unittest.main()
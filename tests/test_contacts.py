@@ -1,8 +1,10 @@
 import os
 import unittest
+from unittest.mock import patch
 
 import contacts
 from contacts import Contact, Contacts, DEFAULT_NAME
+from presence import PresenceTable
 
 
 class TestContact(unittest.TestCase):
@@ -20,7 +22,8 @@ class TestContact(unittest.TestCase):
             {
                 "host": "192.168.0.0",
                 "port": 8000,
-                "username": DEFAULT_NAME
+                "username": DEFAULT_NAME,
+                "fingerprint": None
             },
             contact_dict
         )
@@ -116,5 +119,59 @@ class TestContacts(unittest.TestCase):
         self.assertEqual(8000, contact.port)
 
 
+    def test_print_contacts_with_presence(self):
+        self.base.clear()
+        self.base.add_peer(Contact("192.168.0.1", 8000, "User1"))
+        self.base.add_peer(Contact("192.168.0.2", 8000, "User2"))
+        presence = PresenceTable()
+        presence.seen(("192.168.0.1", 8000))
+
+        with patch("builtins.print") as mock_print:
+            self.base.print_contacts(presence)
+        mock_print.assert_any_call("1. User1 (192.168.0.1:8000) - online")
+        mock_print.assert_any_call("2. User2 (192.168.0.2:8000) - unknown")
+
+    def test_get_contact_by_address(self):
+        self.base.clear()
+        self.base.add_peer(Contact("192.168.0.1", 8000, "User1"))
+        self.assertEqual("User1", self.base.get_contact_by_address(
+            "192.168.0.1", 8000
+        ).username)
+        self.assertIsNone(self.base.get_contact_by_address("192.168.0.1",
+                                                           8001))
+
+    def test_relocate_with_pinned_certificate(self):
+        self.base.clear()
+        self.base.add_peer(Contact("192.168.0.1", 8000, "User1", "ab12"))
+        # stranger announcing the username doesn't take contact over
+        self.assertFalse(self.base.relocate("User1", "192.168.0.9", 8000,
+                                            "cd34"))
+        self.assertEqual(("192.168.0.1", 8000), self.base.contacts[0].self)
+
+        self.assertTrue(self.base.relocate("User1", "192.168.0.7", 8000,
+                                           "ab12"))
+        self.assertEqual([("192.168.0.7", 8000)],
+                         [contact.self for contact in self.base.contacts])
+        self.assertEqual("ab12", self.base.contacts[0].fingerprint)
+
+    def test_contact_without_pin_not_relocated(self):
+        self.base.clear()
+        self.base.add_peer(Contact("192.168.0.1", 8000, "User1"))
+        self.assertTrue(self.base.relocate("User1", "192.168.0.7", 8000,
+                                           "ab12"))
+        self.assertEqual([("192.168.0.1", 8000)],
+                         [contact.self for contact in self.base.contacts])
+
+    def test_pin(self):
+        self.base.clear()
+        self.base.add_peer(Contact("192.168.0.1", 8000, "User1"))
+        # first certificate seen is pinned
+        self.assertTrue(self.base.pin("192.168.0.1", 8000, "ab12"))
+        self.assertTrue(self.base.pin("192.168.0.1", 8000, "ab12"))
+        self.assertFalse(self.base.pin("192.168.0.1", 8000, "cd34"))
+        self.assertEqual("ab12", self.base.contacts[0].fingerprint)
+        # peers which aren't contacts have nothing pinned
+        self.assertTrue(self.base.pin("192.168.0.2", 8000, "cd34"))
+
 if __name__ == "__main__":
     unittest.main()
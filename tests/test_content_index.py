@@ -0,0 +1,105 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from content_index import ContentIndex, link_or_copy, INDEX_FILE
+
+CONTENT_ID = bytes(range(16))
+
+
+class TestLinkOrCopy(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.source = os.path.join(self.temp_dir, "source.bin")
+        self.target = os.path.join(self.temp_dir, "target.bin")
+        with open(self.source, "wb") as f:
+            f.write(b"content")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_hardlink(self):
+        link_or_copy(self.source, self.target)
+        self.assertTrue(os.path.samefile(self.source, self.target))
+
+    def test_copy_if_link_fails(self):
+        with open(self.target, "wb") as f:
+            f.write(b"old")
+        with patch("os.link", side_effect=OSError("cross-device link")):
+            link_or_copy(self.source, self.target)
+        self.assertFalse(os.path.samefile(self.source, self.target))
+        with open(self.target, "rb") as f:
+            self.assertEqual(b"content", f.read())
+        self.assertEqual(["source.bin", "target.bin"],
+                         sorted(os.listdir(self.temp_dir)))
+
+    def test_same_file(self):
+        link_or_copy(self.source, self.source)
+        with open(self.source, "rb") as f:
+            self.assertEqual(b"content", f.read())
+
+
+class TestContentIndex(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "received.bin")
+        with open(self.path, "wb") as f:
+            f.write(b"content")
+        self.index = ContentIndex(self.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_find_after_restart(self):
+        self.index.add(CONTENT_ID, self.path)
+        index = ContentIndex(self.temp_dir)
+        self.assertEqual(self.path, index.find(CONTENT_ID, 7))
+        self.assertIsNone(index.find(CONTENT_ID, 8))
+        self.assertIsNone(index.find(bytes(16), 7))
+
+    def test_changed_file_forgotten(self):
+        self.index.add(CONTENT_ID, self.path)
+        with open(self.path, "wb") as f:
+            f.write(b"changed")
+        os.utime(self.path, ns=(0, 0))
+        self.assertIsNone(self.index.find(CONTENT_ID, 7))
+        self.assertEqual(0, len(self.index))
+
+    def test_removed_file_forgotten(self):
+        self.index.add(CONTENT_ID, self.path)
+        os.remove(self.path)
+        self.assertIsNone(self.index.find(CONTENT_ID, 7))
+        self.assertEqual(0, len(ContentIndex(self.temp_dir)))
+
+    def test_materialize(self):
+        self.assertIsNone(self.index.materialize(CONTENT_ID, 7, "copy.bin"))
+        self.index.add(CONTENT_ID, self.path)
+
+        path = self.index.materialize(CONTENT_ID, 7, "../copy.bin")
+        self.assertEqual(os.path.join(self.temp_dir, "copy.bin"), path)
+        with open(path, "rb") as f:
+            self.assertEqual(b"content", f.read())
+        # the original may go away, the new file still has the content
+        os.remove(self.path)
+        self.assertEqual(path, self.index.find(CONTENT_ID, 7))
+
+    @patch("content_index.MAX_INDEXED_FILES", 2)
+    def test_oldest_dropped(self):
+        for i in range(3):
+            self.index.add(bytes([i]) * 16, self.path)
+        self.assertEqual(2, len(self.index))
+        self.assertIsNone(self.index.find(bytes(16), 7))
+
+    def test_broken_file(self):
+        with open(os.path.join(self.temp_dir, INDEX_FILE), "w") as f:
+            f.write("{broken")
+        with patch("builtins.print") as mock_print:
+            index = ContentIndex(self.temp_dir)
+        mock_print.assert_called_once()
+        self.assertEqual(0, len(index))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import socket
+import threading
+import unittest
+from unittest.mock import patch
+
+import datagram
+from datagram import DatagramChannel, DATAGRAM_HEADER, KIND_ACK, \
+    KIND_DATA, MAX_DATAGRAM_FRAME, MAX_DATAGRAM_SIZE
+
+
+class TestDatagramChannel(unittest.TestCase):
+    def setUp(self):
+        self.sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender_socket.bind(("127.0.0.1", 0))
+        self.receiver_socket = socket.socket(socket.AF_INET,
+                                             socket.SOCK_DGRAM)
+        self.receiver_socket.bind(("127.0.0.1", 0))
+        self.receiver_socket.settimeout(1.0)
+        self.sender = DatagramChannel(self.sender_socket)
+        self.receiver = DatagramChannel(self.receiver_socket)
+        self.address = self.receiver_socket.getsockname()
+
+    def tearDown(self):
+        self.sender_socket.close()
+        self.receiver_socket.close()
+
+    def pump_acks(self):
+        """Passes acks which came to sender socket to sender channel"""
+        self.sender_socket.settimeout(1.0)
+        try:
+            data, address = self.sender_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            self.sender.handle(data, address)
+        except TimeoutError:
+            pass
+
+    def test_send_acknowledged(self):
+        received = []
+
+        def receive():
+            data, address = self.receiver_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            received.append(bytes(self.receiver.handle(data, address)))
+
+        thread = threading.Thread(target=receive)
+        thread.start()
+        acks = threading.Thread(target=self.pump_acks)
+        acks.start()
+
+        self.assertTrue(self.sender.send(b"frame", self.address))
+        thread.join()
+        acks.join()
+        self.assertEqual([b"frame"], received)
+
+    def test_duplicate_dropped_but_acknowledged(self):
+        data = DATAGRAM_HEADER.pack(KIND_DATA, 7, 1) + b"frame"
+        sender = self.sender_socket.getsockname()
+        self.assertEqual(b"frame", bytes(self.receiver.handle(data, sender)))
+        self.assertIsNone(self.receiver.handle(data, sender))
+
+        for _ in range(2):
+            ack, _ = self.sender_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            self.assertEqual(DATAGRAM_HEADER.pack(KIND_ACK, 7, 1), ack)
+
+    def test_not_acknowledged(self):
+        with patch.object(datagram, "RETRANSMIT_TIMEOUT", 0.01):
+            self.assertFalse(self.sender.send(b"frame", self.address))
+        # every attempt has reached the peer
+        for _ in range(datagram.MAX_ATTEMPTS):
+            data, _ = self.receiver_socket.recvfrom(MAX_DATAGRAM_SIZE)
+            self.assertTrue(data.endswith(b"frame"))
+
+    def test_frame_too_big(self):
+        with self.assertRaises(ValueError):
+            self.sender.send(b"x" * (MAX_DATAGRAM_FRAME + 1), self.address)
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            self.receiver.handle(b"\x01", self.address)
+        with self.assertRaises(ValueError):
+            self.receiver.handle(DATAGRAM_HEADER.pack(9, 0, 0), self.address)
+
+
+if __name__ == "__main__":
+    unittest.main()
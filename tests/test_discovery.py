@@ -0,0 +1,124 @@
+import socket
+import time
+import unittest
+from unittest.mock import patch, Mock
+
+from discovery import Announcement, DiscoveryService, PeerTable, \
+    announce_interval, ANNOUNCE_INTERVAL, ANNOUNCE_JITTER, \
+    MAX_GROUP_RATE, MISSED_ANNOUNCEMENTS
+
+PEER = ("192.168.0.5", 8001)
+
+
+class TestAnnouncement(unittest.TestCase):
+    def test_encode_decode(self):
+        data = Announcement(7, 8001, "алиса", 30).encode()
+        announcement = Announcement.decode(data)
+        self.assertEqual((7, 8001, "алиса", 30),
+                         (announcement.session, announcement.port,
+                          announcement.username, announcement.ttl))
+
+    def test_invalid(self):
+        valid = Announcement(7, 8001, "alice", 30).encode()
+        for data in (valid[:5], b"XXXX" + valid[4:], valid[:13],
+                     Announcement(7, 0, "alice", 30).encode(),
+                     Announcement(7, 8001, "a b", 30).encode()):
+            with self.assertRaises(ValueError):
+                Announcement.decode(data)
+
+
+class TestAnnounceInterval(unittest.TestCase):
+    def test_few_peers(self):
+        self.assertEqual(ANNOUNCE_INTERVAL, announce_interval(0))
+
+    def test_group_rate_bounded(self):
+        for peers in (100, 500, 2000):
+            rate = (peers + 1) / announce_interval(peers)
+            self.assertLessEqual(rate, MAX_GROUP_RATE)
+
+
+class TestPeerTable(unittest.TestCase):
+    def test_update(self):
+        table = PeerTable()
+        self.assertTrue(table.update(PEER, "alice", 30, 100.0))
+        self.assertFalse(table.update(PEER, "alice", 30, 110.0))
+        self.assertTrue(table.update(PEER, "bob", 30, 120.0))
+        self.assertEqual({PEER: "bob"}, table.peers())
+
+    def test_expire(self):
+        table = PeerTable()
+        table.update(PEER, "alice", 30, 100.0)
+        table.update(("192.168.0.6", 8001), "bob", 30, 110.0)
+        self.assertEqual([], table.expire(129.0))
+        self.assertEqual([PEER], table.expire(130.0))
+        self.assertEqual(1, len(table))
+
+
+class TestDiscoveryService(unittest.TestCase):
+    def setUp(self):
+        self.on_peer = Mock()
+        self.service = DiscoveryService(1, lambda: (8000, "me"),
+                                        self.on_peer)
+
+    def test_peer_reached_at_source_address(self):
+        data = Announcement(2, 8001, "alice", 30).encode()
+        self.service.handle(data, ("192.168.0.5", 8765))
+        self.service.handle(data, ("192.168.0.5", 8765))
+        self.assertEqual([
+            (PEER[0], PEER[1], "alice", True),
+            (PEER[0], PEER[1], "alice", False)
+        ], [call.args for call in self.on_peer.call_args_list])
+        self.assertEqual({PEER: "alice"}, self.service.table.peers())
+
+    def test_own_announcement_ignored(self):
+        self.service.handle(self.service.announcement().encode(),
+                            ("192.168.0.2", 8765))
+        self.on_peer.assert_not_called()
+
+    def test_announcement_outlives_missed_ones(self):
+        announcement = self.service.announcement()
+        self.assertEqual((8000, "me"),
+                         (announcement.port, announcement.username))
+        self.assertGreaterEqual(
+            announcement.ttl,
+            ANNOUNCE_INTERVAL * (1 + ANNOUNCE_JITTER) * MISSED_ANNOUNCEMENTS
+        )
+
+    def test_invalid_datagram(self):
+        with self.assertRaises(ValueError):
+            self.service.handle(b"hello", PEER)
+
+    def test_services_find_each_other(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.bind(("", 0))
+            port = s.getsockname()[1]
+        found = dict[int, list]()
+        services = [
+            DiscoveryService(
+                session, lambda session=session: (9000 + session, "user"),
+                lambda *peer, session=session: found.setdefault(
+                    session, []
+                ).append(peer),
+                port=port
+            )
+            for session in (1, 2)
+        ]
+        with patch("builtins.print"):
+            started = [service.start() for service in services]
+        try:
+            if not all(started):
+                self.skipTest("Multicast isn't available")
+            deadline = time.monotonic() + 3.0
+            while len(found) < 2 and time.monotonic() < deadline:
+                time.sleep(0.05)
+            if len(found) < 2:
+                self.skipTest("Multicast isn't delivered on this host")
+            self.assertEqual(9002, found[1][0][1])
+            self.assertEqual(9001, found[2][0][1])
+        finally:
+            for service in services:
+                service.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
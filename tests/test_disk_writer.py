@@ -0,0 +1,78 @@
+import threading
+import time
+import unittest
+
+from disk_writer import DiskWriter, WriterStats
+
+
+class TestDiskWriter(unittest.TestCase):
+    def setUp(self):
+        self.stats = WriterStats()
+        self.writer = DiskWriter(self.stats, max_queued_bytes=10)
+
+    def tearDown(self):
+        self.writer.close()
+
+    def test_jobs_run_in_order(self):
+        done = []
+        for i in range(20):
+            self.writer.submit(lambda i=i: done.append(i), 1)
+        self.writer.flush()
+        self.assertEqual(list(range(20)), done)
+        self.assertEqual(20, self.stats.written_bytes)
+        self.assertEqual(0, self.stats.queued_chunks)
+        self.assertEqual(0, self.stats.queued_bytes)
+
+    def test_full_queue_blocks_reader(self):
+        release = threading.Event()
+        self.writer.submit(release.wait, 6)
+        self.writer.submit(lambda: None, 4)
+
+        threading.Timer(0.05, release.set).start()
+        started = time.monotonic()
+        self.writer.submit(lambda: None, 4)
+        self.assertGreaterEqual(time.monotonic() - started, 0.04)
+        self.assertEqual(1, self.stats.stalls)
+        self.assertGreater(self.stats.stall_time, 0.0)
+        self.assertLessEqual(self.stats.max_queued_bytes, 10)
+
+    def test_big_job_let_in_when_empty(self):
+        self.writer.submit(lambda: None, 100)
+        self.writer.flush()
+        self.assertEqual(0, self.stats.stalls)
+
+    def test_error_raised_to_reader(self):
+        def fail():
+            raise OSError("disk is full")
+
+        self.writer.submit(fail, 1)
+        with self.assertRaises(OSError):
+            self.writer.flush()
+        with self.assertRaises(OSError):
+            self.writer.submit(lambda: None, 1)
+
+    def test_close_drains_queue(self):
+        done = []
+        self.writer.submit(lambda: time.sleep(0.02), 1)
+        self.writer.submit(lambda: done.append(True), 1)
+        self.writer.close()
+        self.assertEqual([True], done)
+        with self.assertRaises(RuntimeError):
+            self.writer.submit(lambda: None, 1)
+
+    def test_invalid_limit(self):
+        with self.assertRaises(ValueError):
+            DiskWriter(max_queued_bytes=0)
+
+    def test_summary(self):
+        self.stats.queued(2048)
+        self.stats.stalled(0.0015)
+        self.assertEqual(
+            "Disk writes: 1 chunks (2 KiB) queued, 2 KiB at most, "
+            "0.0 MiB written, reading stalled 1 times for 1.5 ms",
+            self.stats.summary()
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
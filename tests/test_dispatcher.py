@@ -0,0 +1,88 @@
+import queue
+import threading
+import time
+import unittest
+
+from dispatcher import OutboundDispatcher
+
+
+class TestOutboundDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = OutboundDispatcher(max_workers=4, max_queue_depth=3)
+
+    def tearDown(self):
+        self.dispatcher.close()
+
+    def test_peer_order_kept(self):
+        sent = []
+        futures = [
+            self.dispatcher.submit("peer", lambda i=i: sent.append(i))
+            for i in range(3)
+        ]
+        for future in futures:
+            future.result(timeout=1.0)
+        self.assertEqual([0, 1, 2], sent)
+
+    def test_slow_peer_does_not_block_others(self):
+        release = threading.Event()
+        slow = self.dispatcher.submit("slow", release.wait)
+        fast = self.dispatcher.submit("fast", lambda: "sent")
+
+        self.assertEqual("sent", fast.result(timeout=1.0))
+        self.assertFalse(slow.done())
+        release.set()
+        slow.result(timeout=1.0)
+
+    def test_backpressure(self):
+        release = threading.Event()
+        self.dispatcher.submit("peer", release.wait)
+        time.sleep(0.05)
+        for _ in range(3):
+            self.dispatcher.submit("peer", lambda: None)
+        self.assertEqual(3, self.dispatcher.pending("peer"))
+
+        with self.assertRaises(queue.Full):
+            self.dispatcher.submit("peer", lambda: None, block=False)
+        with self.assertRaises(queue.Full):
+            self.dispatcher.submit("peer", lambda: None, timeout=0.05)
+        # other peers have their own queues
+        self.dispatcher.submit("other", lambda: None, block=False)
+
+        release.set()
+        self.assertTrue(self.dispatcher.join(timeout=1.0))
+        self.assertEqual(0, self.dispatcher.pending())
+
+    def test_failure_reported(self):
+        def fail():
+            raise OSError("peer is down")
+
+        future = self.dispatcher.submit("peer", fail)
+        with self.assertRaises(OSError):
+            future.result(timeout=1.0)
+        # queue goes on after a failed job
+        self.assertEqual(
+            "sent", self.dispatcher.submit("peer", lambda: "sent").result(1.0)
+        )
+
+    def test_close_cancels_queued(self):
+        release = threading.Event()
+        running = self.dispatcher.submit("peer", release.wait)
+        time.sleep(0.05)
+        queued = self.dispatcher.submit("peer", lambda: None)
+
+        self.dispatcher.close()
+        release.set()
+        self.assertTrue(queued.cancelled())
+        running.result(timeout=1.0)
+        with self.assertRaises(RuntimeError):
+            self.dispatcher.submit("peer", lambda: None)
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            OutboundDispatcher(max_workers=0)
+        with self.assertRaises(ValueError):
+            OutboundDispatcher(max_queue_depth=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+
+from file_receiver import DirectReceiver, SPLICE_AVAILABLE
+
+
+class TestDirectReceiver(unittest.TestCase):
+    def setUp(self):
+        self.sender, self.conn = socket.socketpair()
+        self.file = tempfile.TemporaryFile()
+        self.data = os.urandom(3 * 1024 * 1024 + 17)
+
+    def tearDown(self):
+        self.sender.close()
+        self.conn.close()
+        self.file.close()
+
+    def send_in_background(self, data: bytes):
+        thread = threading.Thread(
+            target=self.sender.sendall, args=(data,), daemon=True
+        )
+        thread.start()
+        return thread
+
+    def check_receive(self, receiver: DirectReceiver):
+        thread = self.send_in_background(self.data + b"next frame")
+        try:
+            receiver.receive(self.conn, self.file.fileno(), len(self.data),
+                             timeout=2.0)
+        finally:
+            receiver.close()
+
+        self.assertEqual(b"next frame", self.conn.recv(100))
+        thread.join(timeout=1.0)
+        self.file.seek(0)
+        self.assertEqual(self.data, self.file.read())
+
+    def test_recv_into(self):
+        self.check_receive(DirectReceiver(use_splice=False))
+
+    @unittest.skipUnless(SPLICE_AVAILABLE, "os.splice is Linux only")
+    def test_splice(self):
+        self.check_receive(DirectReceiver(use_splice=True))
+
+    @unittest.skipUnless(SPLICE_AVAILABLE, "os.splice is Linux only")
+    def test_splice_socket_with_timeout(self):
+        self.conn.settimeout(2.0)
+        self.check_receive(DirectReceiver(use_splice=True))
+
+    def test_connection_closed(self):
+        for use_splice in {False, SPLICE_AVAILABLE}:
+            sender, conn = socket.socketpair()
+            sender.sendall(b"short")
+            sender.close()
+            receiver = DirectReceiver(use_splice=use_splice)
+            with self.assertRaises(ConnectionError):
+                receiver.receive(conn, self.file.fileno(), 100)
+            receiver.close()
+            conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
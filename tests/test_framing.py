@@ -0,0 +1,150 @@
+import os
+import unittest
+
+from framing import FrameDecoder, FrameTooLarge, decode_batch, \
+    encode_batch, encode_frame, encode_text_chunks, FRAME_HEADER, \
+    MAX_FRAME_SIZES, MSG_TYPE_TEXT, MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END, \
+    TEXT_CHUNK_HEADER, TEXT_CHUNK_LAST, TEXT_CHUNK_SIZE
+
+
+def decode(decoder: FrameDecoder) -> list[tuple[int, bytes]]:
+    return [(msg_type, bytes(payload))
+            for msg_type, payload in decoder.frames()]
+
+
+class TestEncodeFrame(unittest.TestCase):
+    def test_frame_with_payload(self):
+        self.assertEqual(
+            bytes([MSG_TYPE_TEXT]) + (5).to_bytes(4, "big") + b"hello",
+            encode_frame(MSG_TYPE_TEXT, b"hello")
+        )
+
+    def test_bare_frame(self):
+        self.assertEqual(bytes([MSG_TYPE_FILE_END]),
+                         encode_frame(MSG_TYPE_FILE_END))
+
+
+class TestBatch(unittest.TestCase):
+    def test_round_trip(self):
+        payloads = [b"first", b"", b"third"]
+        self.assertEqual(
+            payloads,
+            [bytes(item) for item in decode_batch(encode_batch(payloads))]
+        )
+
+    def test_truncated(self):
+        data = encode_batch([b"first", b"second"])
+        for size in (len(data) - 1, len(data) - 8):
+            with self.assertRaises(ValueError):
+                list(decode_batch(data[:size]))
+
+
+class TestTextChunks(unittest.TestCase):
+    def test_split(self):
+        payload = os.urandom(2 * TEXT_CHUNK_SIZE + 10)
+        chunks = encode_text_chunks(payload)
+        self.assertEqual([0, 0, TEXT_CHUNK_LAST],
+                         [chunk[0] for chunk in chunks])
+        self.assertEqual(payload, b"".join(
+            chunk[TEXT_CHUNK_HEADER.size:] for chunk in chunks
+        ))
+
+    def test_exact_multiple(self):
+        chunks = encode_text_chunks(bytes(TEXT_CHUNK_SIZE))
+        self.assertEqual([TEXT_CHUNK_LAST], [chunk[0] for chunk in chunks])
+
+
+class TestFrameDecoder(unittest.TestCase):
+    def setUp(self):
+        self.decoder = FrameDecoder(16)
+
+    def test_single_frame(self):
+        self.decoder.feed(encode_frame(MSG_TYPE_TEXT, b"hello"))
+        self.assertEqual([(MSG_TYPE_TEXT, b"hello")], decode(self.decoder))
+        self.assertEqual(0, len(self.decoder))
+
+    def test_payload_is_view(self):
+        self.decoder.feed(encode_frame(MSG_TYPE_TEXT, b"hello"))
+        _, payload = next(self.decoder.frames())
+        self.assertIsInstance(payload, memoryview)
+
+    def test_many_frames_in_one_chunk(self):
+        data = b"".join(encode_frame(MSG_TYPE_TEXT, b"%d" % i)
+                        for i in range(100))
+        self.decoder.feed(data)
+        self.assertEqual([(MSG_TYPE_TEXT, b"%d" % i) for i in range(100)],
+                         decode(self.decoder))
+
+    def test_byte_by_byte(self):
+        data = (encode_frame(MSG_TYPE_TEXT, b"first")
+                + encode_frame(MSG_TYPE_FILE_DATA, b"x" * 100)
+                + encode_frame(MSG_TYPE_FILE_END)
+                + encode_frame(MSG_TYPE_TEXT, b"last"))
+        frames = []
+        for i in range(len(data)):
+            self.decoder.feed(data[i:i + 1])
+            frames.extend(decode(self.decoder))
+
+        self.assertEqual(
+            [(MSG_TYPE_TEXT, b"first"),
+             (MSG_TYPE_FILE_DATA, b"x" * 100),
+             (MSG_TYPE_FILE_END, b""),
+             (MSG_TYPE_TEXT, b"last")],
+            frames
+        )
+
+    def test_partial_frame_is_pending(self):
+        data = encode_frame(MSG_TYPE_TEXT, b"hello")
+        self.decoder.feed(data[:7])
+        self.assertEqual([], decode(self.decoder))
+        self.assertEqual(data[:7], self.decoder.pending())
+
+    def test_file_end_followed_by_partial_header(self):
+        next_frame = encode_frame(MSG_TYPE_TEXT, b"next")
+        self.decoder.feed(encode_frame(MSG_TYPE_FILE_END) + next_frame[:3])
+        self.assertEqual([(MSG_TYPE_FILE_END, b"")], decode(self.decoder))
+
+        self.decoder.feed(next_frame[3:])
+        self.assertEqual([(MSG_TYPE_TEXT, b"next")], decode(self.decoder))
+
+    def test_buffer_grows_for_big_frame(self):
+        payload = bytes(range(256)) * 100
+        data = encode_frame(MSG_TYPE_FILE_DATA, payload)
+        for i in range(0, len(data), 1000):
+            self.decoder.feed(data[i:i + 1000])
+        self.assertEqual([(MSG_TYPE_FILE_DATA, payload)],
+                         decode(self.decoder))
+
+    def test_recv_into(self):
+        data = encode_frame(MSG_TYPE_TEXT, b"hello")
+        view = self.decoder.writable(len(data))
+        view[:len(data)] = data
+        self.decoder.commit(len(data))
+        self.assertEqual([(MSG_TYPE_TEXT, b"hello")], decode(self.decoder))
+
+    def test_too_large_frame_refused_before_buffering(self):
+        self.decoder.feed(FRAME_HEADER.pack(MSG_TYPE_TEXT, 0xFFFFFFFF))
+        with self.assertRaises(FrameTooLarge):
+            decode(self.decoder)
+
+    def test_limit_of_compressed_type(self):
+        limit = MAX_FRAME_SIZES[MSG_TYPE_TEXT]
+        self.decoder.feed(FRAME_HEADER.pack(0x80 | MSG_TYPE_TEXT, limit + 1))
+        with self.assertRaises(FrameTooLarge):
+            decode(self.decoder)
+
+    def test_custom_limits(self):
+        decoder = FrameDecoder(max_sizes={MSG_TYPE_TEXT: 4})
+        decoder.feed(encode_frame(MSG_TYPE_TEXT, b"four"))
+        self.assertEqual([(MSG_TYPE_TEXT, b"four")], decode(decoder))
+        decoder.feed(encode_frame(MSG_TYPE_TEXT, b"five!"))
+        with self.assertRaises(FrameTooLarge):
+            decode(decoder)
+
+    def test_commit_too_much(self):
+        with self.assertRaises(ValueError):
+            self.decoder.commit(1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import gossip
+from contacts import Contact
+from gossip import Room, RoomMessage, Rooms, SeenMessages, \
+    MAX_ROOM_MEMBERS, gossip_ttl
+from wire import Envelope
+
+
+class TestRoom(unittest.TestCase):
+    def setUp(self):
+        self.alice = Contact("127.0.0.1", 8001, "alice")
+        self.bob = Contact("127.0.0.1", 8002, "bob")
+        self.room = Room("friends", [self.alice, self.bob])
+
+    def test_member_added_once(self):
+        self.assertFalse(self.room.add_member(
+            Contact("127.0.0.1", 8001, "renamed")
+        ))
+        self.assertEqual([self.alice, self.bob], self.room.members)
+
+    def test_members_limit(self):
+        room = Room("crowd", [Contact("10.0.0.1", port)
+                              for port in range(MAX_ROOM_MEMBERS + 5)])
+        self.assertEqual(MAX_ROOM_MEMBERS, len(room.members))
+
+    def test_invalid_name(self):
+        with self.assertRaises(ValueError):
+            Room("")
+        with self.assertRaises(ValueError):
+            Room("x" * 256)
+
+    def test_pick_targets(self):
+        carol = Contact("127.0.0.1", 8003, "carol")
+        self.room.add_member(carol)
+        targets = self.room.pick_targets({self.alice}, fanout=5)
+        self.assertCountEqual([self.bob, carol], targets)
+        self.assertEqual(1, len(self.room.pick_targets(set(), fanout=1)))
+
+    def test_gossip_ttl(self):
+        self.assertEqual(1, gossip_ttl(1))
+        self.assertEqual(3, gossip_ttl(3))
+        self.assertEqual(5, gossip_ttl(20))
+
+
+class TestRoomMessage(unittest.TestCase):
+    def test_encode_decode(self):
+        envelope = Envelope("alice", "127.0.0.1", 8001, "Hi").encode()
+        room = Room("друзья", [Contact("127.0.0.1", 8002, "bob")])
+        message = RoomMessage(b"\x01" * 16, 4, room, envelope)
+
+        decoded = RoomMessage.decode(message.encode())
+        self.assertEqual(b"\x01" * 16, decoded.message_id)
+        self.assertEqual(4, decoded.ttl)
+        self.assertEqual("друзья", decoded.room.name)
+        self.assertEqual(room.members, decoded.room.members)
+        self.assertEqual("bob", decoded.room.members[0].username)
+        self.assertEqual(envelope, bytes(decoded.envelope))
+
+    def test_forwarded(self):
+        message = RoomMessage(b"\x01" * 16, 4, Room("friends"), b"body")
+        forwarded = message.forwarded(Room("other"))
+        self.assertEqual(3, forwarded.ttl)
+        self.assertEqual(message.message_id, forwarded.message_id)
+        self.assertEqual("other", forwarded.room.name)
+
+    def test_decode_truncated(self):
+        data = RoomMessage(b"\x01" * 16, 4, Room("friends", [
+            Contact("127.0.0.1", 8002, "bob")
+        ]), b"").encode()
+        for size in (10, 20, len(data) - 1):
+            with self.assertRaises(ValueError):
+                RoomMessage.decode(data[:size])
+
+
+class TestSeenMessages(unittest.TestCase):
+    def test_duplicate(self):
+        seen = SeenMessages()
+        self.assertTrue(seen.add(b"a"))
+        self.assertFalse(seen.add(b"a"))
+        self.assertIn(b"a", seen)
+
+    def test_oldest_forgotten(self):
+        seen = SeenMessages(limit=2)
+        seen.add(b"a")
+        seen.add(b"b")
+        # seeing id again keeps it fresh
+        seen.add(b"a")
+        seen.add(b"c")
+        self.assertEqual(2, len(seen))
+        self.assertIn(b"a", seen)
+        self.assertNotIn(b"b", seen)
+
+    def test_one_of_concurrent_copies_is_new(self):
+        seen = SeenMessages()
+        ids = [bytes([i % 50]) for i in range(2000)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            added = list(executor.map(seen.add, ids))
+        self.assertEqual(50, sum(added))
+
+
+class TestRooms(unittest.TestCase):
+    def setUp(self):
+        self.initial_name = gossip.ROOMS_FILE
+        gossip.ROOMS_FILE = "rooms_test.json"
+
+    def tearDown(self):
+        if os.path.exists(gossip.ROOMS_FILE):
+            os.remove(gossip.ROOMS_FILE)
+        gossip.ROOMS_FILE = self.initial_name
+
+    def test_save_load(self):
+        rooms = Rooms()
+        rooms.join("friends", [Contact("127.0.0.1", 8001, "alice")])
+        rooms.join("friends", [Contact("127.0.0.1", 8002, "bob")])
+        rooms.save_rooms()
+
+        loaded = Rooms()
+        room = loaded.get_room("friends")
+        self.assertEqual(["alice", "bob"],
+                         [member.username for member in room.members])
+        self.assertIsNone(loaded.get_room("work"))
+
+    def test_invitation_saved_once_joined(self):
+        rooms = Rooms()
+        rooms.invite("friends", [Contact("127.0.0.1", 8001, "alice")])
+        rooms.save_rooms()
+        self.assertIsNone(Rooms().get_room("friends"))
+
+        room = rooms.join("friends", [Contact("127.0.0.1", 8002, "bob")])
+        self.assertEqual(2, len(room.members))
+        self.assertEqual({}, rooms.invited)
+        rooms.save_rooms()
+        self.assertEqual(2, len(Rooms().get_room("friends").members))
+
+    def test_load_broken_file(self):
+        with open(gossip.ROOMS_FILE, "w") as f:
+            f.write("[{")
+        self.assertEqual({}, Rooms().rooms)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,33 @@
+import io
 import os
+import shutil
 import socket
+import tempfile
 import threading
 import time
 import unittest
+from datetime import datetime
 from unittest.mock import patch, Mock, MagicMock
 
 from chat_classes import Message
-from node import Node, MESSAGE_REGEX, HEADER_REGEX, \
+from compression import encode_compressed_frame
+from contacts import Contact
+from disk_writer import DiskWriter
+from node import Node, ReceiveState, MESSAGE_REGEX, HEADER_REGEX, \
     MSG_TYPE_TEXT, MSG_TYPE_FILE_META, MSG_TYPE_FILE_DATA, MSG_TYPE_FILE_END
+from framing import MSG_TYPE_MANIFEST, MSG_TYPE_FILE_RANGE, \
+    MSG_TYPE_HAVE, MSG_TYPE_BATCH, MSG_TYPE_ROOM, MSG_TYPE_ACK, \
+    MSG_TYPE_HEARTBEAT, MSG_TYPE_TEXT_CHUNK, TEXT_CHUNK_SIZE, \
+    MAX_FRAME_SIZES, FRAME_HEADER, FrameDecoder, encode_frame, \
+    encode_text_chunks
+from gossip import Room, RoomMessage
+from outbox import MAX_ATTEMPTS
+from presence import ONLINE, OFFLINE, UNKNOWN
+from tls import CertificateMismatch
+from transfers import IncomingFile, IncomingTransfer, Manifest, \
+    HAVE_HEADER, RANGE_HEADER, chunk_hash, decode_bitmap
+from wire import Envelope, WIRE_VERSION, FLAG_ACKS, FLAG_BATCH, \
+    FLAG_COMPRESSION, FLAG_DATAGRAM, FLAG_STREAMED_TEXT
 
 
 class TestNode(unittest.TestCase):
@@ -24,11 +44,24 @@ class TestNode(unittest.TestCase):
             f.write("test content")
 
     def tearDown(self):
+        self.node.close()
         if os.path.exists(self.test_file):
             os.remove(self.test_file)
         if os.path.exists(self.test_dir):
             os.remove(self.test_dir)
 
+    def start_receiver(
+            self,
+            downloads: str = "/test",
+            **kwargs
+    ) -> tuple[Node, threading.Thread, int]:
+        receiver = Node(port=0, public_ip="127.0.0.1", **kwargs)
+        thread = threading.Thread(target=receiver.receive_messages,
+                                  args=(downloads,), daemon=True)
+        thread.start()
+        time.sleep(0.1)
+        return receiver, thread, receiver._server_socket.getsockname()[1]
+
     def test_initialization(self):
         self.assertEqual(self.node.host, "localhost")
         self.assertEqual(self.node.port, 8000)
@@ -54,39 +87,40 @@ class TestNode(unittest.TestCase):
     @patch("socket.socket")
     def test_send_message(self, mock_socket):
         mock_conn = Mock()
-        mock_socket.return_value.__enter__.return_value = mock_conn
+        mock_socket.return_value = mock_conn
 
         self.node.send_message("127.0.0.1", 8001, "Test message")
 
-        expected_message = (
-            "SENDER:test_user 127.0.0.1:8000 | MESSAGE:Test message"
-        ).encode("utf-8")
+        expected_message = Envelope(
+            "test_user", "127.0.0.1", 8000, "Test message",
+            FLAG_BATCH | FLAG_ACKS | FLAG_STREAMED_TEXT | FLAG_COMPRESSION,
+            sequence=(self.node._session, 1)
+        ).encode()
         expected_data = (bytes([MSG_TYPE_TEXT])
                          + len(expected_message).to_bytes(4, "big")
                          + expected_message)
 
-        (mock_socket.return_value.__enter__
-         .return_value.connect.assert_called_with(("127.0.0.1", 8001)))
+        mock_conn.connect.assert_called_with(("127.0.0.1", 8001))
         mock_conn.sendall.assert_called_once_with(expected_data)
 
     @patch("socket.socket")
     def test_send_file(self, mock_socket):
         mock_conn = Mock()
-        mock_socket.return_value.__enter__.return_value = mock_conn
+        mock_conn.sendfile.return_value = len(b"test content")
+        mock_socket.return_value = mock_conn
 
         self.node.send_file("127.0.0.1", 8001, self.test_file)
 
-        expected_meta = (
-            "SENDER:test_user 127.0.0.1:8000 | FILENAME:test_file.txt"
-        ).encode("utf-8")
+        expected_meta = Envelope(
+            "test_user", "127.0.0.1", 8000, "test_file.txt",
+            FLAG_BATCH | FLAG_ACKS | FLAG_STREAMED_TEXT | FLAG_COMPRESSION
+        ).encode()
         expected_meta_header = (bytes([MSG_TYPE_FILE_META])
                                 + len(expected_meta).to_bytes(4, "big")
                                 + expected_meta)
 
-        expected_data = b"test content"
         expected_data_header = (bytes([MSG_TYPE_FILE_DATA])
-                                + len(expected_data).to_bytes(4, "big")
-                                + expected_data)
+                                + (12).to_bytes(4, "big"))
 
         expected_end_marker = bytes([MSG_TYPE_FILE_END])
 
@@ -95,6 +129,77 @@ class TestNode(unittest.TestCase):
         self.assertEqual(calls[0][0][0], expected_meta_header)
         self.assertEqual(calls[1][0][0], expected_data_header)
         self.assertEqual(calls[2][0][0], expected_end_marker)
+        file, offset, count = mock_conn.sendfile.call_args[0]
+        self.assertEqual(self.test_file, file.name)
+        self.assertEqual((0, 12), (offset, count))
+
+    def test_send_file_chunks(self):
+        mock_conn = Mock()
+        data = b"x" * 5000
+
+        Node._send_file_chunks(mock_conn, io.BytesIO(data))
+
+        calls = mock_conn.sendall.call_args_list
+        self.assertEqual(2, len(calls))
+        self.assertEqual(bytes([MSG_TYPE_FILE_DATA])
+                         + (4096).to_bytes(4, "big") + data[:4096],
+                         calls[0][0][0])
+        self.assertEqual(bytes([MSG_TYPE_FILE_DATA])
+                         + (904).to_bytes(4, "big") + data[4096:],
+                         calls[1][0][0])
+
+    @patch("node.SENDFILE_FRAME_SIZE", 4)
+    def test_send_file_data_frames(self):
+        mock_conn = Mock()
+        mock_conn.sendfile.side_effect = lambda f, offset, count: count
+
+        with open(self.test_file, "rb") as file:
+            Node._send_file_data(mock_conn, file)
+
+        self.assertEqual([(4,), (4,), (4,)], [
+            (call[0][2],) for call in mock_conn.sendfile.call_args_list
+        ])
+        self.assertEqual([0, 4, 8], [
+            call[0][1] for call in mock_conn.sendfile.call_args_list
+        ])
+
+    def test_send_file_data_truncated(self):
+        mock_conn = Mock()
+        mock_conn.sendfile.return_value = 3
+
+        with open(self.test_file, "rb") as file:
+            with self.assertRaises(OSError):
+                Node._send_file_data(mock_conn, file)
+
+    @patch("socket.socket")
+    def test_send_message_to_legacy_peer(self, mock_socket):
+        mock_conn = Mock()
+        mock_socket.return_value = mock_conn
+        self.node.handle_message(
+            "SENDER:user 127.0.0.1:8001 | MESSAGE:Hello".encode("utf-8")
+        )
+
+        self.node.send_message("127.0.0.1", 8001, "Test message")
+
+        expected_message = (
+            "SENDER:test_user 127.0.0.1:8000 | MESSAGE:Test message"
+        ).encode("utf-8")
+        mock_conn.sendall.assert_called_once_with(
+            bytes([MSG_TYPE_TEXT])
+            + len(expected_message).to_bytes(4, "big")
+            + expected_message
+        )
+
+    def test_handle_binary_message(self):
+        data = Envelope("user", "127.0.0.1", 8001, "Hello").encode()
+
+        self.node.handle_message(data)
+
+        message = self.node.get_message()
+        self.assertEqual("Hello", message.content)
+        self.assertEqual(("127.0.0.1", 8001), message.sender.self)
+        self.assertEqual(WIRE_VERSION,
+                         self.node.peer_versions[("127.0.0.1", 8001)])
 
     def test_handle_message(self):
         test_data = (
@@ -137,16 +242,15 @@ class TestNode(unittest.TestCase):
 
     def test_finalize_file(self):
         test_file = "test.txt"
-        with open(test_file, "w") as f:
-            f.write("test data")
-
-        self.node._current_file = {
-            "filename": test_file,
-            "handle": open(test_file, "r")
-        }
+        self.node._current_file = IncomingFile(
+            test_file, Contact("127.0.0.1", 8001, "user"), "."
+        )
+        self.node._transfers.add(self.node._current_file)
 
         self.node.finalize_file()
         self.assertIsNone(self.node._current_file)
+        self.assertEqual(0, len(self.node._transfers))
+        self.assertTrue(os.path.exists(test_file))
         with self.assertRaises(ValueError):
             self.node.finalize_file()
 
@@ -202,6 +306,1416 @@ class TestNode(unittest.TestCase):
         self.assertEqual(message.sender.host, "127.0.0.1")
         self.assertEqual(message.sender.port, 8000)
 
+    def test_file_end_followed_by_next_frame(self):
+        test_downloads = "test_downloads"
+        os.makedirs(test_downloads, exist_ok=True)
+
+        meta_data = (
+            "SENDER:user 127.0.0.1:8001 | FILENAME:received.txt"
+        ).encode("utf-8")
+        message_bytes = (
+            "SENDER:user 127.0.0.1:8001 | MESSAGE:after file"
+        ).encode("utf-8")
+        buffer = (
+                bytes([MSG_TYPE_FILE_META])
+                + len(meta_data).to_bytes(4, "big")
+                + meta_data
+                + bytes([MSG_TYPE_FILE_END])
+                + bytes([MSG_TYPE_TEXT])
+                + len(message_bytes).to_bytes(4, "big")
+                + message_bytes
+        )
+
+        self.node.process_buffer(buffer, test_downloads)
+
+        self.assertEqual("received.txt", self.node.get_message().content)
+        self.assertEqual("after file", self.node.get_message().content)
+        self.assertIsNone(self.node._current_file)
+
+        os.remove(os.path.join(test_downloads, "received.txt"))
+        os.rmdir(test_downloads)
+
+    def test_messages_share_pooled_connection(self):
+        downloads = tempfile.mkdtemp()
+        receiver, server_thread, server_port = self.start_receiver(
+            downloads, username="receiver"
+        )
+
+        try:
+            for i in range(3):
+                self.node.send_message("localhost", server_port, f"msg {i}")
+            self.node.send_file("localhost", server_port, self.test_file)
+            self.node.send_message("localhost", server_port, "last")
+            time.sleep(0.2)
+
+            self.assertEqual(1, len(self.node._pool))
+            self.assertEqual(1, len(receiver._connections))
+            contents = [message.content
+                        for message in receiver.new_messages]
+            self.assertEqual(
+                ["msg 0", "msg 1", "msg 2", "test_file.txt", "last"],
+                contents
+            )
+        finally:
+            receiver.close()
+            server_thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    def test_receive_big_file(self):
+        downloads = tempfile.mkdtemp()
+        receiver, server_thread, server_port = self.start_receiver(
+            downloads, username="receiver"
+        )
+        content = os.urandom(3 * 1024 * 1024 + 5)
+        with open(self.test_file, "wb") as f:
+            f.write(content)
+
+        try:
+            self.node.send_file("localhost", server_port, self.test_file)
+            self.node.send_message("localhost", server_port, "after file")
+            deadline = time.monotonic() + 2.0
+            while (len(receiver.new_messages) < 2
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+
+            self.assertEqual("after file", receiver.new_messages[1].content)
+            with open(os.path.join(downloads, self.test_file), "rb") as f:
+                self.assertEqual(content, f.read())
+        finally:
+            receiver.close()
+            server_thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    def test_small_frames_written_by_disk_writer(self):
+        downloads = tempfile.mkdtemp()
+        receiver, thread, port = self.start_receiver(downloads)
+        content = os.urandom(1024 * 1024 + 5)
+        with open(self.test_file, "wb") as f:
+            f.write(content)
+
+        try:
+            with patch("node.SENDFILE_FRAME_SIZE", 16 * 1024):
+                self.node.send_file("localhost", port, self.test_file)
+            # file message is queued on meta, file is done when it
+            # leaves transfers
+            deadline = time.monotonic() + 2.0
+            while ((not receiver.new_messages or len(receiver._transfers))
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+
+            with open(os.path.join(downloads, self.test_file), "rb") as f:
+                self.assertEqual(content, f.read())
+            self.assertEqual(len(content), receiver.disk_stats.written_bytes)
+            self.assertEqual(0, receiver.disk_stats.queued_chunks)
+            self.assertGreater(receiver.disk_stats.max_queued_bytes, 0)
+        finally:
+            receiver.close()
+            thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    def test_chunks_out_of_order_and_resumed(self):
+        downloads = tempfile.mkdtemp()
+        content = b"0123456789"
+        manifest = Manifest(len(content), 4, [
+            chunk_hash(content[i:i + 4]) for i in range(0, 10, 4)
+        ])
+        meta = encode_frame(
+            MSG_TYPE_MANIFEST,
+            manifest.encode()
+            + Envelope("user", "127.0.0.1", 8001, "chunks.bin").encode()
+        )
+
+        def chunk(offset: int) -> bytes:
+            return encode_frame(
+                MSG_TYPE_FILE_RANGE,
+                RANGE_HEADER.pack(manifest.transfer_id, offset)
+                + content[offset:offset + 4]
+            )
+
+        def have(replies: list[bytes]) -> set[int]:
+            decoder = FrameDecoder()
+            decoder.feed(replies[-1])
+            msg_type, payload = next(decoder.frames())
+            self.assertEqual(MSG_TYPE_HAVE, msg_type)
+            return decode_bitmap(payload[HAVE_HEADER.size:], 3)
+
+        try:
+            replies = []
+            state = ReceiveState(replies.append)
+            self.node._state = state
+            self.node.process_buffer(meta + chunk(8), downloads)
+            self.assertEqual(set(), have(replies))
+            # connection drops, the received chunk stays on disk
+            self.node.close_receive_state(state)
+            self.assertEqual(0, len(self.node._transfers))
+
+            replies = []
+            self.node._state = ReceiveState(replies.append)
+            self.node.process_buffer(meta, downloads)
+            self.assertEqual({2}, have(replies))
+            self.node.process_buffer(chunk(4) + chunk(0), downloads)
+
+            message = self.node.get_message()
+            self.assertEqual("chunks.bin", message.content)
+            self.assertEqual("file", message.message_type)
+            self.assertEqual(0, len(self.node._transfers))
+            with open(os.path.join(downloads, "chunks.bin"), "rb") as f:
+                self.assertEqual(content, f.read())
+
+            # a late manifest of finished transfer gets all chunks
+            self.node.process_buffer(meta, downloads)
+            self.assertEqual({0, 1, 2}, have(replies))
+        finally:
+            shutil.rmtree(downloads)
+
+    def test_queued_chunks_reported_received(self):
+        downloads = tempfile.mkdtemp()
+        content = b"01234567"
+        manifest = Manifest(len(content), 4, [
+            chunk_hash(content[i:i + 4]) for i in range(0, 8, 4)
+        ])
+        meta = encode_frame(
+            MSG_TYPE_MANIFEST,
+            manifest.encode()
+            + Envelope("user", "127.0.0.1", 8001, "slow.bin").encode()
+        )
+        chunks = b"".join(
+            encode_frame(MSG_TYPE_FILE_RANGE,
+                         RANGE_HEADER.pack(manifest.transfer_id, offset)
+                         + content[offset:offset + 4])
+            for offset in (0, 4)
+        )
+        write = IncomingTransfer.write
+
+        def slow_write(transfer, offset, data):
+            time.sleep(0.05)
+            return write(transfer, offset, data)
+
+        replies = []
+        state = ReceiveState(replies.append, DiskWriter())
+        self.node._state = state
+        try:
+            with patch.object(IncomingTransfer, "write", slow_write):
+                self.node.process_buffer(meta + chunks + meta, downloads)
+            payload = replies[-1][FRAME_HEADER.size:]
+            self.assertEqual({0, 1}, decode_bitmap(
+                payload[HAVE_HEADER.size:], 2
+            ))
+            self.assertEqual("slow.bin", self.node.get_message().content)
+        finally:
+            self.node.close_receive_state(state)
+            shutil.rmtree(downloads)
+
+    def test_transfer_complete_after_file_moved(self):
+        downloads = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, downloads)
+        manifest = Manifest(4, 4, [chunk_hash(b"data")])
+        complete = self.node._complete
+
+        def check_moved(transfer_id, path):
+            with open(path, "rb") as f:
+                self.assertEqual(b"data", f.read())
+            self.assertEqual([], os.listdir(os.path.join(downloads,
+                                                         ".partial")))
+            complete(transfer_id, path)
+
+        self.node._state = ReceiveState(lambda data: None)
+        with patch.object(self.node, "_complete",
+                          side_effect=check_moved) as mock_complete:
+            self.node.process_buffer(
+                encode_frame(MSG_TYPE_MANIFEST, manifest.encode()
+                             + Envelope("user", "127.0.0.1", 8001,
+                                        "done.bin").encode())
+                + encode_frame(MSG_TYPE_FILE_RANGE,
+                               RANGE_HEADER.pack(manifest.transfer_id, 0)
+                               + b"data"),
+                downloads
+            )
+        mock_complete.assert_called_once()
+
+    def test_truncated_file_removed_on_disconnect(self):
+        downloads = tempfile.mkdtemp()
+        state = ReceiveState()
+        self.node._state = state
+        try:
+            self.node.process_buffer(
+                encode_frame(MSG_TYPE_FILE_META, Envelope(
+                    "user", "127.0.0.1", 8001, "cut.bin"
+                ).encode())
+                + encode_frame(MSG_TYPE_FILE_DATA, b"part"),
+                downloads
+            )
+            self.node.close_receive_state(state)
+            self.assertEqual([], os.listdir(downloads))
+        finally:
+            shutil.rmtree(downloads)
+
+    def test_receive_limit(self):
+        downloads = tempfile.mkdtemp()
+        node = Node(max_receives=1)
+        self.addCleanup(node.close)
+
+        def file_meta(filename: str) -> bytes:
+            return encode_frame(MSG_TYPE_FILE_META, Envelope(
+                "user", "127.0.0.1", 8001, filename
+            ).encode())
+
+        first, second = ReceiveState(), ReceiveState()
+        try:
+            node._state = first
+            node.process_buffer(file_meta("first.txt"), downloads)
+            node._state = second
+            node.process_buffer(
+                file_meta("second.txt")
+                + encode_frame(MSG_TYPE_FILE_DATA, b"refused")
+                + encode_frame(MSG_TYPE_FILE_END)
+                + encode_frame(MSG_TYPE_TEXT, Envelope(
+                    "user", "127.0.0.1", 8001, "after refused"
+                ).encode()),
+                downloads
+            )
+
+            contents = [message.content for message in node.new_messages]
+            self.assertEqual(["first.txt", "after refused"], contents)
+            self.assertEqual(["first.txt"], os.listdir(downloads))
+
+            replies = []
+            node._state = ReceiveState(replies.append)
+            manifest = Manifest(4, 4, [chunk_hash(b"data")])
+            node.process_buffer(encode_frame(
+                MSG_TYPE_MANIFEST,
+                manifest.encode()
+                + Envelope("user", "127.0.0.1", 8001, "big.bin").encode()
+            ), downloads)
+            refusal = HAVE_HEADER.pack(
+                manifest.transfer_id,
+                FLAG_BATCH | FLAG_ACKS | FLAG_STREAMED_TEXT
+                | FLAG_COMPRESSION
+            )
+            self.assertEqual([encode_frame(MSG_TYPE_HAVE, refusal)], replies)
+        finally:
+            node.close_receive_state(first)
+            shutil.rmtree(downloads)
+
+    def test_idle_transfer_expired(self):
+        downloads = tempfile.mkdtemp()
+        state = ReceiveState()
+        self.node._state = state
+        try:
+            self.node.process_buffer(
+                encode_frame(MSG_TYPE_FILE_META, Envelope(
+                    "user", "127.0.0.1", 8001, "stalled.bin"
+                ).encode())
+                + encode_frame(MSG_TYPE_FILE_DATA, b"part"),
+                downloads
+            )
+            self.node._current_file.last_active -= 1000.0
+            self.node.expire_transfers()
+
+            self.assertTrue(state.current_file.closed)
+            self.assertEqual(0, len(self.node._transfers))
+            self.assertEqual([], os.listdir(downloads))
+
+            # late frames of expired file are dropped
+            self.node.process_buffer(
+                encode_frame(MSG_TYPE_FILE_DATA, b"late")
+                + encode_frame(MSG_TYPE_FILE_END),
+                downloads
+            )
+            self.assertIsNone(state.current_file)
+            self.assertEqual([], os.listdir(downloads))
+        finally:
+            shutil.rmtree(downloads)
+
+    def test_chunk_of_closed_transfer_dropped(self):
+        downloads = tempfile.mkdtemp()
+        content = b"0123456789"
+        manifest = Manifest(len(content), 4, [
+            chunk_hash(content[i:i + 4]) for i in range(0, 10, 4)
+        ])
+        state = ReceiveState()
+        self.node._state = state
+        try:
+            self.node.process_buffer(encode_frame(
+                MSG_TYPE_MANIFEST,
+                manifest.encode()
+                + Envelope("user", "127.0.0.1", 8001, "closed.bin").encode()
+            ), downloads)
+            # transfer is closed while its chunk is on the way
+            transfer = self.node._transfers.get(manifest.transfer_id)
+            transfer.close()
+            self.node.process_buffer(encode_frame(
+                MSG_TYPE_FILE_RANGE,
+                RANGE_HEADER.pack(manifest.transfer_id, 0) + content[:4]
+            ), downloads)
+            self.assertEqual(set(), transfer.done)
+        finally:
+            self.node.close_receive_state(state)
+            shutil.rmtree(downloads)
+
+    @patch("node.CHUNKED_TRANSFER_THRESHOLD", 1024)
+    @patch("node.PARALLEL_TRANSFER_THRESHOLD", 1024)
+    def test_parallel_file_transfer(self):
+        downloads = tempfile.mkdtemp()
+        receiver, server_thread, server_port = self.start_receiver(
+            downloads, username="receiver"
+        )
+        content = os.urandom(3 * 1024 * 1024 + 1)
+        with open(self.test_file, "wb") as f:
+            f.write(content)
+        self.node.transfer_streams = 3
+
+        try:
+            self.node.send_file("localhost", server_port, self.test_file)
+            deadline = time.monotonic() + 2.0
+            while (len(receiver.new_messages) < 1
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+
+            self.assertEqual(1, len(receiver.new_messages))
+            self.assertEqual(self.test_file,
+                             receiver.new_messages[0].content)
+            with open(os.path.join(downloads, self.test_file), "rb") as f:
+                self.assertEqual(content, f.read())
+        finally:
+            receiver.close()
+            server_thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    @patch("node.CHUNKED_TRANSFER_THRESHOLD", 1024)
+    def test_file_already_received_not_sent(self):
+        downloads = tempfile.mkdtemp()
+        content = os.urandom(64 * 1024)
+        with open(self.test_file, "wb") as f:
+            f.write(content)
+        copy_file = "test_file_copy.txt"
+        shutil.copyfile(self.test_file, copy_file)
+
+        try:
+            # the second receiver is a new run of node on same downloads
+            for filename in (self.test_file, copy_file):
+                receiver, server_thread, server_port = self.start_receiver(
+                    downloads, username="receiver", datagrams=False
+                )
+                try:
+                    with patch.object(Node, "_send_chunks",
+                                      wraps=Node._send_chunks) as send:
+                        self.node.send_file("localhost", server_port,
+                                            filename)
+                    deadline = time.monotonic() + 2.0
+                    while (not receiver.new_messages
+                           and time.monotonic() < deadline):
+                        time.sleep(0.01)
+                    self.assertEqual(filename,
+                                     receiver.new_messages[0].content)
+                finally:
+                    receiver.close()
+                    server_thread.join(timeout=1.0)
+
+            self.assertFalse(send.called)
+            copy_path = os.path.join(downloads, copy_file)
+            with open(copy_path, "rb") as f:
+                self.assertEqual(content, f.read())
+            self.assertTrue(os.path.samefile(
+                os.path.join(downloads, self.test_file), copy_path
+            ))
+        finally:
+            os.remove(copy_file)
+            shutil.rmtree(downloads)
+
+    def test_compressed_file_transfer(self):
+        downloads = tempfile.mkdtemp()
+        receiver, server_thread, server_port = self.start_receiver(
+            downloads, username="receiver"
+        )
+        content = b"".join(f"line {i}\n".encode() for i in range(400000))
+
+        try:
+            # the chunked transfer learns flags of receiver from its
+            # answer to the manifest, then the file is sent in order
+            # to the peer which is known to accept compression
+            for threshold in (1024, len(content) + 1):
+                with open(self.test_file, "wb") as f:
+                    f.write(content + str(threshold).encode())
+                with (patch("node.CHUNKED_TRANSFER_THRESHOLD", threshold),
+                      patch("node.encode_compressed_frame",
+                            wraps=encode_compressed_frame) as compress):
+                    self.node.send_file("localhost", server_port,
+                                        self.test_file)
+                    self.assertTrue(compress.called)
+
+                deadline = time.monotonic() + 2.0
+                while (not receiver.new_messages
+                       and time.monotonic() < deadline):
+                    time.sleep(0.01)
+                receiver.new_messages.clear()
+                time.sleep(0.1)
+                path = os.path.join(downloads, self.test_file)
+                with open(path, "rb") as f:
+                    self.assertEqual(content + str(threshold).encode(),
+                                     f.read())
+        finally:
+            receiver.close()
+            server_thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    def test_receive_compressed_message(self):
+        self.node.process_buffer(encode_compressed_frame(
+            MSG_TYPE_TEXT,
+            Envelope("user", "127.0.0.1", 8001, "Hello! " * 100).encode()
+        ), "/test")
+        self.assertEqual("Hello! " * 100, self.node.get_message().content)
+
+    def test_streamed_text_received(self):
+        text = "long text " * 20000
+        payload = Envelope("user", "127.0.0.1", 8001, text).encode()
+        self.node.process_buffer(b"".join(
+            encode_frame(MSG_TYPE_TEXT_CHUNK, chunk)
+            for chunk in encode_text_chunks(payload)
+        ), "/test")
+        self.assertEqual(text, self.node.get_message().content)
+        self.assertIsNone(self.node._state.text_stream)
+
+    def test_streamed_text_over_limit_dropped(self):
+        node = Node(max_text_size=100 * 1024)
+        self.addCleanup(node.close)
+        payload = Envelope("user", "127.0.0.1", 8001, "x" * 200000).encode()
+        with patch("builtins.print") as mock_print:
+            node.process_buffer(b"".join(
+                encode_frame(MSG_TYPE_TEXT_CHUNK, chunk)
+                for chunk in encode_text_chunks(payload)
+            ) + encode_frame(MSG_TYPE_TEXT, Envelope(
+                "user", "127.0.0.1", 8001, "short"
+            ).encode()), "/test")
+        mock_print.assert_called_once()
+        self.assertEqual(["short"], [message.content
+                                     for message in node.new_messages])
+
+    def test_long_text_streamed_to_peer(self):
+        peer = ("127.0.0.1", 8001)
+        self.node.peer_flags[peer] = FLAG_BATCH | FLAG_STREAMED_TEXT
+        long_payload = bytes(3 * TEXT_CHUNK_SIZE)
+        with patch.object(self.node, "_send_frame") as mock_send:
+            self.node._send_texts(*peer, [b"short", long_payload, b"next"])
+        decoder = FrameDecoder()
+        decoder.feed(mock_send.call_args.args[2])
+        frames = [(msg_type, bytes(payload))
+                  for msg_type, payload in decoder.frames()]
+        self.assertEqual(
+            [MSG_TYPE_BATCH] + [MSG_TYPE_TEXT_CHUNK] * 3,
+            [msg_type for msg_type, _ in frames]
+        )
+        self.assertEqual(long_payload, b"".join(
+            payload[1:] for _, payload in frames[1:]
+        ))
+
+    def test_too_long_text_streamed_to_unknown_peer(self):
+        peer = ("127.0.0.1", 8001)
+        long_payload = bytes(MAX_FRAME_SIZES[MSG_TYPE_TEXT] + 1)
+        with patch.object(self.node, "_send_frame") as mock_send:
+            self.node._send_texts(*peer, [long_payload])
+        decoder = FrameDecoder(max_sizes=MAX_FRAME_SIZES)
+        decoder.feed(mock_send.call_args.args[2])
+        self.assertEqual(
+            {MSG_TYPE_TEXT_CHUNK},
+            {msg_type for msg_type, _ in decoder.frames()}
+        )
+
+    def test_too_long_text_kept_for_old_peer(self):
+        peer = ("127.0.0.1", 8001)
+        # peer announced flags without streamed text
+        self.node.peer_flags[peer] = FLAG_BATCH | FLAG_ACKS
+        message = "x" * MAX_FRAME_SIZES[MSG_TYPE_TEXT]
+        with (patch.object(self.node, "_send_frame") as mock_send,
+              patch("builtins.print") as mock_print):
+            with self.assertRaises(OSError):
+                self.node.send_message(*peer, message)
+        mock_send.assert_not_called()
+        self.assertIn("too long", mock_print.call_args.args[0])
+        self.assertEqual(1, len(self.node.outbox))
+
+    def test_too_large_frame_closes_connection(self):
+        receiver, thread, port = self.start_receiver(
+            frame_limits={MSG_TYPE_TEXT: 1024}, datagrams=False
+        )
+        try:
+            with (patch("builtins.print"),
+                  socket.create_connection(("localhost", port)) as conn):
+                # header alone is enough to refuse the frame
+                conn.sendall(FRAME_HEADER.pack(MSG_TYPE_TEXT, 2048))
+                conn.settimeout(2.0)
+                self.assertEqual(b"", conn.recv(1))
+            self.assertEqual(0, len(receiver.new_messages))
+        finally:
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_compression_disabled(self):
+        node = Node(compression=False)
+        self.addCleanup(node.close)
+        node.peer_flags[("127.0.0.1", 8001)] = FLAG_COMPRESSION
+        self.assertFalse(node._accepts_compression("127.0.0.1", 8001))
+        self.node.peer_flags[("127.0.0.1", 8001)] = FLAG_COMPRESSION
+        self.assertTrue(self.node._accepts_compression("127.0.0.1", 8001))
+
+    def test_send_async(self):
+        downloads = tempfile.mkdtemp()
+        receiver, server_thread, server_port = self.start_receiver(
+            downloads, username="receiver"
+        )
+
+        try:
+            futures = [
+                self.node.send_message_async("localhost", server_port,
+                                             f"msg {i}")
+                for i in range(5)
+            ]
+            futures.append(self.node.send_file_async(
+                "localhost", server_port, self.test_file
+            ))
+            missing = self.node.send_file_async(
+                "localhost", server_port, "missing.txt"
+            )
+            self.assertTrue(self.node.wait_for_sends(timeout=2.0))
+            for future in futures:
+                future.result()
+            with self.assertRaises(OSError):
+                missing.result()
+
+            deadline = time.monotonic() + 2.0
+            while (len(receiver.new_messages) < 6
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+            contents = [message.content
+                        for message in receiver.new_messages]
+            self.assertEqual(
+                [f"msg {i}" for i in range(5)] + [self.test_file],
+                contents
+            )
+        finally:
+            receiver.close()
+            server_thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    @patch("batching.FLUSH_WINDOW", 0.5)
+    def test_burst_sent_in_one_write(self):
+        receiver = Node()
+        self.addCleanup(receiver.close)
+        for flags, expected_types in ((FLAG_BATCH, [MSG_TYPE_BATCH]),
+                                      (0, [MSG_TYPE_TEXT] * 10)):
+            self.node.peer_flags[("127.0.0.1", 8001)] = flags
+            with patch.object(self.node._pool, "send") as send:
+                futures = [
+                    self.node.send_message_async("127.0.0.1", 8001,
+                                                 f"msg {i}")
+                    for i in range(10)
+                ]
+                self.assertEqual(1, len(set(futures)))
+                futures[0].result(timeout=2.0)
+
+            send.assert_called_once()
+            decoder = FrameDecoder()
+            decoder.feed(send.call_args[0][2])
+            frames = [(msg_type, bytes(payload))
+                      for msg_type, payload in decoder.frames()]
+            self.assertEqual(expected_types,
+                             [msg_type for msg_type, _ in frames])
+
+            receiver.process_buffer(send.call_args[0][2], "/test")
+            self.assertEqual(
+                [f"msg {i}" for i in range(10)],
+                [message.content for message in receiver.new_messages]
+            )
+            receiver.new_messages.clear()
+
+    def test_broadcast(self):
+        receivers = [self.start_receiver() for _ in range(2)]
+        peers = [
+            Contact("127.0.0.1", port, f"user{i}")
+            for i, (_, _, port) in enumerate(receivers)
+        ]
+        with socket.socket() as closed:
+            closed.bind(("127.0.0.1", 0))
+            dead_port = closed.getsockname()[1]
+        peers.append(Contact("127.0.0.1", dead_port, "offline"))
+
+        try:
+            with patch.object(self.node, "_encode_frame",
+                              wraps=self.node._encode_frame) as encode:
+                report = self.node.broadcast(peers, "Hello, all").result(2.0)
+            encode.assert_called_once()
+
+            self.assertEqual(peers, [result.peer
+                                     for result in report.results])
+            self.assertEqual(peers[:2], [result.peer
+                                         for result in report.sent])
+            self.assertIsInstance(report.failed[0].error, OSError)
+            self.assertGreaterEqual(report.duration,
+                                    max(result.latency
+                                        for result in report.results))
+            for receiver, _, _ in receivers:
+                deadline = time.monotonic() + 2.0
+                while (not receiver.new_messages
+                       and time.monotonic() < deadline):
+                    time.sleep(0.01)
+                self.assertEqual("Hello, all",
+                                 receiver.get_message().content)
+        finally:
+            for receiver, thread, _ in receivers:
+                receiver.close()
+                thread.join(timeout=1.0)
+
+    def test_broadcast_to_nobody(self):
+        report = self.node.broadcast([], "Hello").result(1.0)
+        self.assertEqual([], report.results)
+
+    def test_messages_delivered_in_send_order(self):
+        def frame(number, body):
+            envelope = Envelope("alice", "127.0.0.1", 8001, body,
+                                sequence=(1, number)).encode()
+            return encode_frame(MSG_TYPE_TEXT, envelope)
+
+        self.node.process_buffer(frame(2, "second") + frame(1, "first")
+                                 + frame(1, "first") + frame(4, "fourth"),
+                                 "/test")
+        self.assertEqual(["first", "second"],
+                         [msg.content for msg in self.node.new_messages])
+        self.assertEqual((1, 2), self.node.new_messages[1].sequence)
+
+        with patch("reorder.time.monotonic",
+                   return_value=time.monotonic() + 1.0):
+            for envelope in self.node._reorder.expire():
+                self.node._deliver_message(envelope)
+        self.assertEqual("fourth", self.node.new_messages[2].content)
+
+    def test_sent_messages_numbered_per_peer(self):
+        first = self.node._new_sequence("127.0.0.1", 8001)
+        other = self.node._new_sequence("127.0.0.1", 8002)
+        second = self.node._new_sequence("127.0.0.1", 8001)
+        self.assertEqual((self.node._session, 1), first)
+        self.assertEqual((self.node._session, 1), other)
+        self.assertEqual((self.node._session, 2), second)
+        self.assertEqual(second, Envelope.decode(self.node._envelope(
+            "127.0.0.1", 8001, "c", "MESSAGE", second
+        )).sequence)
+        self.assertIsNone(Envelope.decode(self.node._envelope(
+            "127.0.0.1", 8001, "d", "MESSAGE"
+        )).sequence)
+
+    def test_failed_message_kept_in_outbox(self):
+        with patch.object(self.node._pool, "send",
+                          side_effect=ConnectionRefusedError), \
+                patch("builtins.print"):
+            with self.assertRaises(OSError):
+                self.node.send_message("127.0.0.1", 8001, "Hello")
+        entry, = self.node.outbox.due(time.monotonic() + 60.0)
+        self.assertEqual("Hello", entry.body)
+        self.assertEqual((self.node._session, 1), entry.sequence)
+        self.assertTrue(entry.failed)
+
+        # peer doesn't send acks, so message it took is delivered
+        with patch.object(self.node._pool, "send") as pool_send:
+            self.node._resend([entry])
+            self.assertTrue(self.node.wait_for_sends(1.0))
+        pool_send.assert_called_once()
+        self.assertEqual(0, len(self.node.outbox))
+
+    def test_given_up_message_reported(self):
+        entry = self.node._track("127.0.0.1", 8001, "Hello")
+        entry.attempts = MAX_ATTEMPTS - 1
+        with patch("builtins.print"):
+            self.node._settle(entry, False)
+        self.assertEqual(0, len(self.node.outbox))
+        self.assertEqual([entry], list(self.node.undelivered))
+
+    def test_sent_message_waits_for_ack(self):
+        peer = ("127.0.0.1", 8001)
+        self.node.peer_flags[peer] = FLAG_BATCH | FLAG_ACKS
+        with patch.object(self.node._pool, "send"):
+            self.node.send_message(*peer, "Hello")
+        self.assertEqual(1, len(self.node.outbox))
+
+        self.node.handle_frame(MSG_TYPE_ACK, Envelope(
+            "peer", *peer, "", FLAG_BATCH | FLAG_ACKS,
+            sequence=(self.node._session, 1)
+        ).encode(), "/test")
+        self.assertEqual(0, len(self.node.outbox))
+
+    def test_outbox_woken_by_peer(self):
+        with patch.object(self.node._pool, "send",
+                          side_effect=ConnectionRefusedError), \
+                patch("builtins.print"):
+            with self.assertRaises(OSError):
+                self.node.send_message("127.0.0.1", 8001, "Hello")
+        self.assertEqual([], self.node.outbox.due())
+
+        self.node.handle_message(
+            Envelope("peer", "127.0.0.1", 8001, "I'm back").encode()
+        )
+        self.assertTrue(self.node._outbox_changed.is_set())
+        self.assertEqual(1, len(self.node.outbox.due()))
+
+    def test_received_messages_acknowledged(self):
+        with patch.object(self.node, "_send_frame") as send_frame:
+            for number in (1, 2):
+                self.node.handle_message(Envelope(
+                    "peer", "127.0.0.1", 8001, str(number),
+                    FLAG_BATCH | FLAG_ACKS, sequence=(5, number)
+                ).encode())
+            # old nodes don't get acks
+            self.node.handle_message(Envelope(
+                "old", "127.0.0.1", 8002, "3", FLAG_BATCH, sequence=(5, 1)
+            ).encode())
+            self.assertTrue(self.node.wait_for_sends(1.0))
+
+        acked = []
+        for call in send_frame.call_args_list:
+            self.assertEqual(("127.0.0.1", 8001), call.args[:2])
+            decoder = FrameDecoder()
+            decoder.feed(call.args[2])
+            for msg_type, payload in decoder.frames():
+                self.assertEqual(MSG_TYPE_ACK, msg_type)
+                envelope = Envelope.decode(payload)
+                self.assertEqual(("127.0.0.1", 8000),
+                                 (envelope.host, envelope.port))
+                acked.append(envelope.sequence)
+        self.assertEqual([(5, 1), (5, 2)], acked)
+
+    def test_send_to_offline_peer_queued(self):
+        peer = ("127.0.0.1", 8001)
+        self.node.presence.failed(peer)
+        with patch.object(self.node._pool, "send") as pool_send:
+            with self.assertRaises(ConnectionError):
+                self.node.send_message(*peer, "first")
+            future = self.node.send_message_async(*peer, "second")
+            self.assertIsInstance(future.exception(), ConnectionError)
+        pool_send.assert_not_called()
+        self.assertEqual(2, len(self.node.outbox))
+        self.assertEqual([], self.node.outbox.due())
+
+        # heartbeat of peer sends queued messages at once
+        self.node.handle_frame(MSG_TYPE_HEARTBEAT, Envelope(
+            "peer", *peer, "", FLAG_BATCH
+        ).encode(), "/test")
+        entries = self.node.outbox.due()
+        self.assertEqual(["first", "second"],
+                         [entry.body for entry in entries])
+        self.assertEqual([0, 0], [entry.attempts for entry in entries])
+
+    def test_heartbeat_marks_peer_online(self):
+        peer = ("127.0.0.1", 8001)
+        self.assertEqual(UNKNOWN, self.node.presence.status(peer))
+        self.node.handle_frame(MSG_TYPE_HEARTBEAT, Envelope(
+            "peer", *peer, "", FLAG_BATCH | FLAG_ACKS
+        ).encode(), "/test")
+        self.assertEqual(ONLINE, self.node.presence.status(peer))
+        self.assertEqual(FLAG_BATCH | FLAG_ACKS, self.node.peer_flags[peer])
+
+    def test_heartbeats_sent_to_contacts(self):
+        online = Contact("127.0.0.1", 8001, "online")
+        offline = Contact("127.0.0.1", 8002, "offline")
+        self.node.contacts.contacts = [online, offline,
+                                       Contact("127.0.0.1", 8000, "me")]
+
+        def send_frame(host, port, data):
+            if port == offline.port:
+                raise ConnectionRefusedError
+            decoder = FrameDecoder()
+            decoder.feed(data)
+            (msg_type, payload), = decoder.frames()
+            self.assertEqual(MSG_TYPE_HEARTBEAT, msg_type)
+            self.assertEqual("test_user", Envelope.decode(payload).username)
+
+        with patch.object(self.node, "_send_frame",
+                          side_effect=send_frame) as mock_send:
+            # closed node sends one round and stops
+            self.node._closed.set()
+            self.node._send_heartbeats()
+            self.assertTrue(self.node.wait_for_sends(1.0))
+        self.assertEqual(2, mock_send.call_count)
+        self.assertEqual(ONLINE, self.node.presence.status(online.self))
+        self.assertEqual(OFFLINE, self.node.presence.status(offline.self))
+
+        # offline contact isn't probed in the next round
+        with patch.object(self.node, "_send_frame") as mock_send:
+            self.node._send_heartbeats()
+            self.assertTrue(self.node.wait_for_sends(1.0))
+        mock_send.assert_called_once()
+        self.assertEqual(online.port, mock_send.call_args.args[1])
+
+    def test_heartbeats_limited_to_pool_size(self):
+        places = self.node._pool.max_connections
+        pinned = [Contact("10.0.0.1", port, "pinned", "ab" * 32)
+                  for port in range(8001, 8011)]
+        datagram = [Contact("10.0.0.2", port) for port in range(8001, 8006)]
+        others = [Contact("10.0.0.3", port)
+                  for port in range(8001, 8001 + places)]
+        self.node.contacts.contacts = others + datagram + pinned
+        for contact in datagram:
+            self.node.peer_flags[contact.self] = FLAG_DATAGRAM
+        self.node._datagram_listening.set()
+
+        rounds = []
+        for _ in range(2):
+            with patch.object(self.node, "_probe") as probe:
+                self.node._closed.set()
+                self.node._send_heartbeats()
+            rounds.append([call.args[0] for call in probe.call_args_list])
+
+        for probed in rounds:
+            # datagrams take no pooled connection
+            self.assertEqual(places + len(datagram), len(probed))
+            for contact in pinned + datagram:
+                self.assertIn(contact.self, probed)
+        # the other contacts take turns
+        self.assertEqual({contact.self for contact in others},
+                         set(rounds[0] + rounds[1])
+                         - {contact.self for contact in pinned + datagram})
+
+    def test_discovered_peer_not_saved(self):
+        self.node.contacts.contacts = [Contact("10.0.0.1", 8001, "alice")]
+        with patch("builtins.print"):
+            self.node._on_discovered("10.0.0.2", 8001, "alice", True)
+            self.node._on_discovered("10.0.0.3", 8002, "bob", True)
+        self.assertEqual([("10.0.0.1", 8001)],
+                         [contact.self
+                          for contact in self.node.contacts.contacts])
+        self.assertEqual(ONLINE,
+                         self.node.presence.status(("10.0.0.3", 8002)))
+        self.assertEqual({}, self.node.discovered_peers())
+
+    def test_find_peer_prefers_announced_address(self):
+        self.node.contacts.contacts = [Contact("10.0.0.1", 8001, "alice"),
+                                       Contact("10.0.0.4", 8001, "carol")]
+        discovered = {("10.0.0.2", 8001): "alice",
+                      ("10.0.0.3", 8002): "bob",
+                      ("10.0.0.4", 8001): "carol",
+                      ("10.0.0.5", 8001): "carol"}
+        with patch.object(self.node, "discovered_peers",
+                          return_value=discovered):
+            self.assertEqual(("10.0.0.2", 8001),
+                             self.node.find_peer("alice").self)
+            self.assertEqual(("10.0.0.3", 8002),
+                             self.node.find_peer("bob").self)
+            # contact is kept while its address is announced too
+            self.assertEqual(("10.0.0.4", 8001),
+                             self.node.find_peer("carol").self)
+            self.assertEqual(("10.0.0.1", 8001),
+                             self.node.find_peer("10.0.0.1").self)
+            self.assertIsNone(self.node.find_peer("dave"))
+
+    def test_outbox_saved_on_close(self):
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_dir)
+        path = os.path.join(temp_dir, "outbox.json")
+        node = Node(port=8005, public_ip="127.0.0.1", outbox_path=path)
+        with patch.object(node._pool, "send",
+                          side_effect=ConnectionRefusedError), \
+                patch("builtins.print"):
+            with self.assertRaises(OSError):
+                node.send_message("127.0.0.1", 8001, "Hello")
+        node.close()
+
+        restarted = Node(port=8005, public_ip="127.0.0.1", outbox_path=path)
+        try:
+            entry, = restarted.outbox.due()
+            self.assertEqual("Hello", entry.body)
+            self.assertEqual((restarted._session, 1), entry.sequence)
+            # new messages to peer follow those left by previous run
+            self.assertEqual((restarted._session, 2),
+                             restarted._new_sequence("127.0.0.1", 8001))
+        finally:
+            restarted.close()
+
+    def test_room_message_seen_once(self):
+        alice = Contact("127.0.0.1", 8001, "alice")
+        bob = Contact("127.0.0.1", 8002, "bob")
+        me = Contact("127.0.0.1", 8000, "test_user")
+        envelope = Envelope("alice", "127.0.0.1", 8001, "Hi room").encode()
+        payload = RoomMessage(b"\x01" * 16, 2, Room("friends", [bob, me]),
+                              envelope).encode()
+
+        with patch.object(self.node, "_spread") as spread:
+            self.node.handle_frame(MSG_TYPE_ROOM, payload, "/test")
+            self.node.handle_frame(MSG_TYPE_ROOM, payload, "/test")
+
+        self.assertEqual(1, len(self.node.new_messages))
+        message = self.node.get_message()
+        self.assertEqual("friends", message.room)
+        self.assertEqual(alice, message.sender)
+        self.assertEqual("Hi room", message.content)
+        # room of unknown peer is an invitation of the author only
+        self.assertIsNone(self.node.rooms.get_room("friends"))
+        self.assertEqual([alice],
+                         self.node.rooms.invited["friends"].members)
+
+        spread.assert_called_once()
+        forwarded, exclude = spread.call_args.args
+        self.assertEqual(1, forwarded.ttl)
+        self.assertEqual({me, alice}, exclude)
+        self.assertEqual([bob, me], forwarded.room.members)
+
+    def test_room_members_from_trusted_peers(self):
+        alice = Contact("127.0.0.1", 8001, "alice")
+        bob = Contact("127.0.0.1", 8002, "bob")
+        mallory = Contact("127.0.0.1", 8003, "mallory")
+        self.node.contacts.add_peer(
+            Contact(alice.host, alice.port, "alice", "ab" * 32)
+        )
+
+        def receive(author: Contact, members: list[Contact]):
+            envelope = Envelope(author.username, author.host, author.port,
+                                "Hi").encode()
+            self.node.handle_room_message(RoomMessage(
+                os.urandom(16), 0, Room("friends", members), envelope
+            ).encode())
+
+        # member list of pinned peer is taken into invitation
+        receive(alice, [bob])
+        self.assertEqual([bob, alice],
+                         self.node.rooms.invited["friends"].members)
+        self.node.send_room_message("friends", "Hello")
+        self.assertEqual([bob, alice],
+                         self.node.rooms.get_room("friends").members)
+        self.assertEqual({}, self.node.rooms.invited)
+
+        # others can't add members to room
+        receive(mallory, [mallory, Contact("127.0.0.1", 8004, "eve")])
+        self.assertEqual([bob, alice],
+                         self.node.rooms.get_room("friends").members)
+        receive(bob, [alice, mallory])
+        self.assertEqual([bob, alice, mallory],
+                         self.node.rooms.get_room("friends").members)
+
+    def test_room_message_not_forwarded_without_ttl(self):
+        envelope = Envelope("alice", "127.0.0.1", 8001, "Hi").encode()
+        payload = RoomMessage(b"\x02" * 16, 0, Room("friends"),
+                              envelope).encode()
+        with patch.object(self.node, "_spread") as spread:
+            self.node.handle_room_message(payload)
+        spread.assert_not_called()
+        self.assertEqual("Hi", self.node.get_message().content)
+
+    def test_send_room_message_to_unknown_room(self):
+        with self.assertRaises(ValueError):
+            self.node.send_room_message("nowhere", "Hi")
+
+    def test_room_gossip(self):
+        ports = []
+        for _ in range(5):
+            with socket.socket() as s:
+                s.bind(("127.0.0.1", 0))
+                ports.append(s.getsockname()[1])
+        nodes = [Node(port=port, username=f"user{i}",
+                      public_ip="127.0.0.1")
+                 for i, port in enumerate(ports)]
+        threads = [threading.Thread(target=node.receive_messages,
+                                    args=("/test",), daemon=True)
+                   for node in nodes]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+
+        sender, receivers = nodes[0], nodes[1:]
+        sender.join_room("friends", [
+            Contact("127.0.0.1", port, f"user{i + 1}")
+            for i, port in enumerate(ports[1:])
+        ])
+        try:
+            futures = sender.send_room_message("friends", "Hello, room")
+            # sender uploads to a few members only
+            self.assertEqual(sender.room_fanout, len(futures))
+            for future in futures:
+                future.result(2.0)
+
+            for receiver in receivers:
+                deadline = time.monotonic() + 2.0
+                while (not receiver.new_messages
+                       and time.monotonic() < deadline):
+                    time.sleep(0.01)
+            # let duplicates arrive before checking they were dropped
+            time.sleep(0.2)
+            for receiver in receivers:
+                self.assertEqual(1, len(receiver.new_messages))
+                message = receiver.get_message()
+                self.assertEqual("Hello, room", message.content)
+                self.assertEqual("friends", message.room)
+                # sender isn't pinned, so only it is taken from the
+                # members of invitation
+                self.assertIsNone(receiver.rooms.get_room("friends"))
+                self.assertEqual(
+                    [("127.0.0.1", sender.port)],
+                    [member.self for member
+                     in receiver.rooms.invited["friends"].members]
+                )
+        finally:
+            for node, thread in zip(nodes, threads):
+                node.close()
+                thread.join(timeout=1.0)
+
+    def wait_for_messages(self, node: Node, count: int):
+        deadline = time.monotonic() + 2.0
+        while (len(node.new_messages) < count
+               and time.monotonic() < deadline):
+            time.sleep(0.01)
+
+    def test_message_sent_as_datagram(self):
+        receiver, thread, port = self.start_receiver()
+        sender, sender_thread, _ = self.start_receiver()
+        try:
+            self.assertTrue(receiver._flags & FLAG_DATAGRAM)
+            sender.peer_flags[("127.0.0.1", port)] = receiver._flags
+            with patch.object(sender._pool, "send") as pool_send:
+                sender.send_message("127.0.0.1", port, "Hello over UDP")
+            pool_send.assert_not_called()
+
+            self.wait_for_messages(receiver, 1)
+            self.assertEqual("Hello over UDP",
+                             receiver.get_message().content)
+
+            # frames which don't fit in a datagram go over TCP
+            sender.send_message("127.0.0.1", port, "x" * 2000)
+            self.wait_for_messages(receiver, 1)
+            self.assertEqual("x" * 2000, receiver.get_message().content)
+        finally:
+            for node, node_thread in ((sender, sender_thread),
+                                      (receiver, thread)):
+                node.close()
+                node_thread.join(timeout=1.0)
+
+    def test_delivery_acknowledged(self):
+        receiver, thread, port = self.start_receiver()
+        sender, sender_thread, sender_port = self.start_receiver()
+        # acks come to the port sender announces and tell port of peer
+        sender.port = sender_port
+        receiver.port = port
+        try:
+            sender.peer_flags[("127.0.0.1", port)] = receiver._flags
+            sender.send_message_async("127.0.0.1", port, "Hello").result()
+            deadline = time.monotonic() + 2.0
+            while len(sender.outbox) and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(0, len(sender.outbox))
+            self.assertEqual("Hello", receiver.get_message().content)
+        finally:
+            for node, node_thread in ((sender, sender_thread),
+                                      (receiver, thread)):
+                node.close()
+                node_thread.join(timeout=1.0)
+
+    def flood(self, port: int, frames: int) -> socket.socket:
+        conn = socket.create_connection(("localhost", port))
+        conn.sendall(b"".join(
+            encode_frame(MSG_TYPE_TEXT, Envelope(
+                "flooder", "127.0.0.1", 8001, f"message {i}"
+            ).encode())
+            for i in range(frames)
+        ))
+        return conn
+
+    def test_flooding_peer_dropped(self):
+        receiver, thread, port = self.start_receiver(
+            frame_rate=1.0, over_limit="drop", datagrams=False
+        )
+        try:
+            with self.flood(port, 5):
+                self.wait_for_messages(receiver, 2)
+                time.sleep(0.1)
+            self.assertEqual(["message 0", "message 1"],
+                             [message.content
+                              for message in receiver.new_messages])
+            counters = receiver.limiter.throttled()["127.0.0.1"]
+            self.assertEqual(3, counters.dropped_frames)
+        finally:
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_flooding_peer_delayed(self):
+        receiver, thread, port = self.start_receiver(
+            frame_rate=20.0, datagrams=False
+        )
+        try:
+            start = time.monotonic()
+            with self.flood(port, 45):
+                self.wait_for_messages(receiver, 45)
+            self.assertEqual(45, len(receiver.new_messages))
+            # 40 frames of burst, then 5 more at 20 frames per second
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+            counters = receiver.limiter.throttled()["127.0.0.1"]
+            self.assertEqual(5, counters.delayed_frames)
+        finally:
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_flooding_peer_disconnected(self):
+        receiver, thread, port = self.start_receiver(
+            frame_rate=1.0, over_limit="disconnect", datagrams=False
+        )
+        try:
+            with self.flood(port, 5) as conn:
+                conn.settimeout(2.0)
+                self.assertEqual(b"", conn.recv(1))
+            self.assertEqual(2, len(receiver.new_messages))
+        finally:
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_connections_per_ip_capped(self):
+        receiver, thread, port = self.start_receiver(
+            connections_per_ip=2, datagrams=False
+        )
+        conns = [socket.create_connection(("localhost", port))
+                 for _ in range(3)]
+        try:
+            conns[2].settimeout(2.0)
+            self.assertEqual(b"", conns[2].recv(1))
+            counters = receiver.limiter.throttled()["127.0.0.1"]
+            self.assertEqual(1, counters.refused_connections)
+
+            conns[0].close()
+            time.sleep(0.1)
+            self.assertTrue(receiver.limiter.connect("127.0.0.1"))
+        finally:
+            for conn in conns:
+                conn.close()
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_datagram_falls_back_to_tcp(self):
+        receiver, thread, port = self.start_receiver(datagrams=False)
+        sender, sender_thread, _ = self.start_receiver()
+        peer = ("127.0.0.1", port)
+        try:
+            self.assertFalse(receiver._flags & FLAG_DATAGRAM)
+            # peer claims to receive datagrams, but never acks them
+            sender.peer_flags[peer] = FLAG_BATCH | FLAG_DATAGRAM
+            with patch("datagram.RETRANSMIT_TIMEOUT", 0.01):
+                sender.send_message("127.0.0.1", port, "Hello over TCP")
+            self.wait_for_messages(receiver, 1)
+            self.assertEqual("Hello over TCP",
+                             receiver.get_message().content)
+            self.assertFalse(sender.peer_flags[peer] & FLAG_DATAGRAM)
+        finally:
+            for node, node_thread in ((sender, sender_thread),
+                                      (receiver, thread)):
+                node.close()
+                node_thread.join(timeout=1.0)
+
+    def test_receive_in_processes(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        receiver = Node(port=port, public_ip="127.0.0.1",
+                        receive_processes=2)
+        thread = threading.Thread(target=receiver.receive_messages,
+                                  args=("/test",), daemon=True)
+        thread.start()
+        # failed sends make receiver offline only for a moment
+        senders = [Node(port=9000 + i, username=f"sender{i}",
+                        public_ip="127.0.0.1", heartbeat_interval=0.01)
+                   for i in range(3)]
+        try:
+            # processes are spawned, so they need a while to listen
+            deadline = time.monotonic() + 10.0
+            while time.monotonic() < deadline:
+                try:
+                    with patch("builtins.print"):
+                        senders[0].send_message("127.0.0.1", port, "0")
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            for i in range(1, 20):
+                for sender in senders:
+                    sender.send_message("127.0.0.1", port, str(i))
+            senders[1].send_message("127.0.0.1", port, "0")
+            senders[2].send_message("127.0.0.1", port, "0")
+
+            deadline = time.monotonic() + 5.0
+            while (len(receiver.new_messages) < 60
+                   and time.monotonic() < deadline):
+                time.sleep(0.01)
+            received = dict[str, list[str]]()
+            for message in receiver.new_messages:
+                received.setdefault(message.sender.username, []).append(
+                    message.content
+                )
+            self.assertEqual([str(i) for i in range(20)],
+                             received["sender0"])
+            for name in ("sender1", "sender2"):
+                self.assertEqual([str(i) for i in range(1, 20)] + ["0"],
+                                 received[name])
+            self.assertIn(("127.0.0.1", 9000), receiver.peer_versions)
+        finally:
+            for sender in senders:
+                sender.close()
+            receiver.close()
+            thread.join(timeout=5.0)
+        self.assertFalse(thread.is_alive())
+
+    def test_worker_messages_ordered_and_deduplicated(self):
+        def text(number: int) -> Envelope:
+            return Envelope("alice", "127.0.0.1", 8001, str(number),
+                            FLAG_BATCH, sequence=(7, number))
+
+        # connections of a peer went to different processes
+        for number in (2, 1, 2, 3):
+            self.node._order_message(text(number))
+        self.assertEqual(["1", "2", "3"],
+                         [message.content
+                          for message in self.node.new_messages])
+
+        # room message passed on to both processes is shown once
+        self.node.new_messages.clear()
+        message = Message(Contact("127.0.0.1", 8001, "alice"),
+                          datetime.now(), "Hi room", room="friends",
+                          message_id=b"\x01" * 16)
+        for _ in range(2):
+            self.node._add_worker_message(message, None, None)
+        self.assertEqual([message], list(self.node.new_messages))
+        self.assertIsNone(self.node.rooms.get_room("friends"))
+        self.assertIn("friends", self.node.rooms.invited)
+
+    def tls_settings(self, name: str) -> dict:
+        if not shutil.which("openssl"):
+            self.skipTest("openssl isn't installed")
+        certs = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, certs)
+        return {"tls": True,
+                "cert_path": os.path.join(certs, f"{name}_cert.pem"),
+                "key_path": os.path.join(certs, f"{name}_key.pem")}
+
+    @patch("node.CHUNKED_TRANSFER_THRESHOLD", 1024 * 1024)
+    def test_tls_message_and_file(self):
+        downloads = tempfile.mkdtemp()
+        receiver, thread, port = self.start_receiver(
+            downloads, **self.tls_settings("receiver")
+        )
+        sender = Node(port=0, public_ip="127.0.0.1",
+                      **self.tls_settings("sender"))
+        sender.contacts.contacts = [Contact("localhost", port, "receiver")]
+        content = os.urandom(2 * 1024 * 1024 + 5)
+        with open(self.test_file, "wb") as f:
+            f.write(content)
+        try:
+            self.assertFalse(receiver._flags & FLAG_DATAGRAM)
+            sender.send_message("localhost", port, "secret")
+            sender.send_file("localhost", port, self.test_file)
+            self.wait_for_messages(receiver, 2)
+            self.assertEqual(["secret", self.test_file],
+                             [message.content
+                              for message in receiver.new_messages])
+            with open(os.path.join(downloads, self.test_file), "rb") as f:
+                self.assertEqual(content, f.read())
+            # receiver was pinned on first connection
+            self.assertEqual(receiver.fingerprint,
+                             sender.contacts.contacts[0].fingerprint)
+        finally:
+            sender.close()
+            receiver.close()
+            thread.join(timeout=1.0)
+            shutil.rmtree(downloads)
+
+    def test_tls_reconnect_resumes_session(self):
+        receiver, thread, port = self.start_receiver(
+            **self.tls_settings("receiver")
+        )
+        sender = Node(port=0, public_ip="127.0.0.1",
+                      **self.tls_settings("sender"))
+        try:
+            sender.send_message("localhost", port, "first")
+            sender._pool.close()
+            sender.send_message("localhost", port, "second")
+            self.wait_for_messages(receiver, 2)
+            self.assertEqual(2, len(receiver.new_messages))
+            self.assertEqual((2, 1), (sender._tls.handshakes,
+                                      sender._tls.resumed))
+        finally:
+            sender.close()
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_tls_pinned_certificate_mismatch(self):
+        receiver, thread, port = self.start_receiver(
+            **self.tls_settings("receiver")
+        )
+        sender = Node(port=0, public_ip="127.0.0.1",
+                      **self.tls_settings("sender"))
+        sender.contacts.contacts = [
+            Contact("localhost", port, "receiver", "00" * 32)
+        ]
+        try:
+            with (patch("builtins.print"),
+                  self.assertRaises(CertificateMismatch)):
+                sender.send_message("localhost", port, "secret")
+            time.sleep(0.1)
+            self.assertEqual(0, len(receiver.new_messages))
+        finally:
+            sender.close()
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_tls_contact_moved_to_announced_address(self):
+        receiver, thread, port = self.start_receiver(
+            **self.tls_settings("receiver")
+        )
+        sender = Node(port=0, public_ip="127.0.0.1",
+                      **self.tls_settings("sender"))
+        old_address = ("10.0.0.1", 8001)
+        sender.contacts.contacts = [
+            Contact(*old_address, "receiver", "00" * 32)
+        ]
+        discovered = {("localhost", port): "receiver"}
+        try:
+            with patch.object(sender, "discovered_peers",
+                              return_value=discovered):
+                peer = sender.find_peer("receiver")
+                # peer announcing username has another certificate
+                with (patch("builtins.print"),
+                      self.assertRaises(CertificateMismatch)):
+                    sender.send_message(peer.host, peer.port, "secret")
+                self.assertEqual(old_address,
+                                 sender.contacts.contacts[0].self)
+
+                sender.contacts.contacts[0].fingerprint = (
+                    receiver.fingerprint
+                )
+                # next announcement shows peer is online again
+                sender._on_discovered("localhost", port, "receiver", False)
+                sender.send_message(peer.host, peer.port, "secret")
+            self.wait_for_messages(receiver, 1)
+            self.assertEqual("secret", receiver.get_message().content)
+            self.assertEqual([("localhost", port)],
+                             [contact.self
+                              for contact in sender.contacts.contacts])
+        finally:
+            sender.close()
+            receiver.close()
+            thread.join(timeout=1.0)
+
+    def test_invalid_transfer_settings(self):
+        with self.assertRaises(ValueError):
+            Node(transfer_streams=0)
+        with self.assertRaises(ValueError):
+            Node(max_receives=0)
+        with self.assertRaises(ValueError):
+            Node(compression=1)
+        with self.assertRaises(ValueError):
+            Node(datagrams="yes")
+        with self.assertRaises(ValueError):
+            Node(receive_processes=0)
+        with self.assertRaises(ValueError):
+            Node(port=0, receive_processes=2)
+        with self.assertRaises(ValueError):
+            Node(frame_rate=0)
+        with self.assertRaises(ValueError):
+            Node(over_limit="ignore")
+        with self.assertRaises(ValueError):
+            Node(frame_limits={MSG_TYPE_TEXT: 0})
+        with self.assertRaises(ValueError):
+            Node(max_text_size=0)
+        with self.assertRaises(ValueError):
+            Node(tls="yes")
+
     def test_close_stops_server(self):
         mock_socket = MagicMock()
         self.node._server_socket = mock_socket
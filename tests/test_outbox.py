@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from outbox import Outbox, OutboxEntry, retry_delay, MAX_ATTEMPTS, \
+    MAX_RETRY_DELAY
+
+PEER = ("127.0.0.1", 8001)
+
+
+def make_entry(number: int, body: str = "Hi", port: int = 8001):
+    return OutboxEntry("127.0.0.1", port, body, (7, number))
+
+
+class TestRetryDelay(unittest.TestCase):
+    def test_doubles_with_jitter(self):
+        for attempts in range(1, 4):
+            delay = retry_delay(attempts)
+            self.assertGreaterEqual(delay, 2 ** (attempts - 1) / 2)
+            self.assertLessEqual(delay, 2 ** (attempts - 1))
+
+    def test_capped(self):
+        self.assertLessEqual(retry_delay(30), MAX_RETRY_DELAY)
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "outbox.json")
+        self.outbox = Outbox(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_added_entry_waits_for_send(self):
+        entry = make_entry(1)
+        self.outbox.add(entry)
+        self.assertEqual(1, len(self.outbox))
+        self.assertEqual([], self.outbox.due())
+
+    def test_failed_entry_due_after_backoff(self):
+        entry = make_entry(1)
+        self.outbox.add(entry)
+        self.assertTrue(self.outbox.retry_later(entry, now=100.0))
+        self.assertEqual([], self.outbox.due(100.0))
+        self.assertEqual([entry], self.outbox.due(101.0))
+        # entry being sent isn't returned twice
+        self.assertEqual([], self.outbox.due(101.0))
+
+    def test_dropped_after_max_attempts(self):
+        entry = make_entry(1)
+        self.outbox.add(entry)
+        for _ in range(MAX_ATTEMPTS - 1):
+            self.assertTrue(self.outbox.retry_later(entry))
+            entry.in_flight = True
+        self.assertFalse(self.outbox.retry_later(entry))
+        self.assertEqual(0, len(self.outbox))
+
+    def test_ack(self):
+        first, second = make_entry(1), make_entry(2)
+        self.outbox.add(first)
+        self.outbox.add(second)
+        self.assertTrue(self.outbox.ack(PEER, (7, 2)))
+        self.assertFalse(self.outbox.ack(PEER, (7, 2)))
+        self.assertFalse(self.outbox.ack(PEER, (8, 1)))
+        self.assertEqual(1, len(self.outbox))
+
+    def test_ack_from_other_host_name(self):
+        self.outbox.add(make_entry(1))
+        self.assertTrue(self.outbox.ack(("localhost", 8001), (7, 1)))
+
+    def test_ambiguous_ack_ignored(self):
+        self.outbox.add(make_entry(1))
+        self.outbox.add(OutboxEntry("10.0.0.2", 8001, "Hi", (7, 1)))
+        self.assertFalse(self.outbox.ack(("localhost", 8001), (7, 1)))
+        self.assertTrue(self.outbox.ack(("10.0.0.2", 8001), (7, 1)))
+
+    def test_wake_only_failed_entries(self):
+        failed, sent = make_entry(1), make_entry(2)
+        other = make_entry(1, port=8002)
+        for entry in (failed, sent, other):
+            self.outbox.add(entry)
+        self.outbox.retry_later(failed, now=100.0)
+        self.outbox.retry_later(sent, failed=False, now=100.0)
+        self.outbox.retry_later(other, now=100.0)
+
+        self.assertTrue(self.outbox.wake(PEER, 100.0))
+        self.assertEqual([failed], self.outbox.due(100.0))
+        self.assertFalse(self.outbox.wake(("127.0.0.1", 8003), 100.0))
+
+    def test_queued_counts_failed_entries(self):
+        failed, sent = make_entry(1), make_entry(2)
+        for entry in (failed, sent, make_entry(1, port=8002)):
+            self.outbox.add(entry)
+        self.assertEqual(0, self.outbox.queued(PEER))
+        self.outbox.retry_later(failed)
+        self.outbox.retry_later(sent, failed=False)
+        self.assertEqual(1, self.outbox.queued(PEER))
+
+    def test_next_attempt(self):
+        self.assertIsNone(self.outbox.next_attempt())
+        entry = make_entry(1)
+        self.outbox.add(entry)
+        self.assertIsNone(self.outbox.next_attempt())
+        self.outbox.retry_later(entry, now=100.0)
+        self.assertGreater(self.outbox.next_attempt(), 100.0)
+
+    def test_oldest_dropped_when_full(self):
+        first = make_entry(1)
+        self.outbox.add(first)
+        with patch("outbox.MAX_OUTBOX_SIZE", 2):
+            self.assertIsNone(self.outbox.add(make_entry(2)))
+            self.assertIs(first, self.outbox.add(make_entry(3)))
+        self.assertEqual(2, len(self.outbox))
+
+    def test_save_and_load(self):
+        entry = make_entry(5, "Привет")
+        self.outbox.add(entry)
+        self.outbox.retry_later(entry)
+        self.outbox.save()
+
+        numbers = iter(range(1, 10))
+        loaded = Outbox(self.path)
+        entries = loaded.load(lambda host, port: (9, next(numbers)))
+        self.assertEqual(1, len(loaded))
+        self.assertEqual("Привет", entries[0].body)
+        self.assertEqual(("127.0.0.1", 8001),
+                         (entries[0].peer_host, entries[0].peer_port))
+        self.assertEqual((9, 1), entries[0].sequence)
+        self.assertEqual(1, entries[0].attempts)
+        self.assertEqual(entries, loaded.due())
+
+    def test_saved_only_when_changed(self):
+        self.outbox.save()
+        self.assertFalse(os.path.exists(self.path))
+        entry = make_entry(1)
+        self.outbox.add(entry)
+        self.outbox.save()
+        self.outbox.remove(entry)
+        self.outbox.save()
+        with open(self.path) as f:
+            self.assertEqual([], json.load(f))
+
+    def test_load_broken_file(self):
+        with open(self.path, "w") as f:
+            f.write("[{\"host\": ")
+        self.assertEqual([], self.outbox.load(lambda host, port: (1, 1)))
+        self.assertEqual(0, len(self.outbox))
+
+    def test_in_memory(self):
+        outbox = Outbox()
+        outbox.add(make_entry(1))
+        outbox.save()
+        self.assertEqual([], outbox.load(lambda host, port: (1, 1)))
+        self.assertEqual(1, len(outbox))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from presence import PresenceTable, MISSED_HEARTBEATS, ONLINE, OFFLINE, \
+    UNKNOWN
+
+PEER = ("127.0.0.1", 8001)
+
+
+class TestPresenceTable(unittest.TestCase):
+    def setUp(self):
+        self.table = PresenceTable(interval=10.0)
+
+    def test_unknown_peer(self):
+        self.assertEqual(UNKNOWN, self.table.status(PEER))
+        self.assertIsNone(self.table.last_seen(PEER))
+        self.assertEqual(UNKNOWN, self.table.describe(PEER))
+
+    def test_seen_peer_online(self):
+        self.assertFalse(self.table.seen(PEER, 100.0))
+        self.assertEqual(ONLINE, self.table.status(PEER, 100.0))
+        self.assertIsNotNone(self.table.last_seen(PEER))
+
+    def test_silent_peer_no_longer_online(self):
+        self.table.seen(PEER, 100.0)
+        timeout = 10.0 * MISSED_HEARTBEATS
+        self.assertEqual(ONLINE, self.table.status(PEER, 100.0 + timeout))
+        self.assertEqual(UNKNOWN,
+                         self.table.status(PEER, 101.0 + timeout))
+
+    def test_failed_peer_offline_until_seen(self):
+        self.table.seen(PEER)
+        self.table.failed(PEER)
+        self.assertEqual(OFFLINE, self.table.status(PEER))
+        self.assertTrue(self.table.is_offline(PEER))
+        self.assertTrue(self.table.describe(PEER).startswith(
+            "offline, last seen "
+        ))
+
+        self.assertTrue(self.table.seen(PEER))
+        self.assertEqual(ONLINE, self.table.status(PEER))
+        self.assertFalse(self.table.seen(PEER))
+
+    def test_failure_forgotten(self):
+        self.table.failed(PEER, 100.0)
+        timeout = 10.0 * MISSED_HEARTBEATS
+        self.assertEqual(OFFLINE, self.table.status(PEER, 100.0 + timeout))
+        self.assertEqual(UNKNOWN,
+                         self.table.status(PEER, 101.0 + timeout))
+
+    def test_never_reached_peer_offline(self):
+        self.table.failed(PEER)
+        self.assertEqual(OFFLINE, self.table.describe(PEER))
+
+    def test_invalid_interval(self):
+        with self.assertRaises(ValueError):
+            PresenceTable(interval=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
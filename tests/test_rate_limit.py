@@ -0,0 +1,121 @@
+import unittest
+
+from rate_limit import RateLimiter, TokenBucket, BURST_SECONDS, \
+    POLICY_DELAY, POLICY_DISCONNECT, POLICY_DROP
+
+HOST = "192.168.0.5"
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=10.0, burst=20.0)
+        bucket.refill(bucket.updated)
+        self.assertEqual(0.0, bucket.wait_time(20))
+        bucket.take(20)
+        self.assertAlmostEqual(0.1, bucket.wait_time(1))
+
+        bucket.refill(bucket.updated + 0.5)
+        self.assertEqual(5.0, bucket.tokens)
+
+    def test_refill_capped_at_burst(self):
+        bucket = TokenBucket(rate=10.0, burst=20.0)
+        bucket.refill(bucket.updated + 100.0)
+        self.assertEqual(20.0, bucket.tokens)
+
+    def test_amount_bigger_than_burst(self):
+        bucket = TokenBucket(rate=10.0, burst=20.0)
+        self.assertEqual(0.0, bucket.wait_time(50))
+
+
+class TestRateLimiter(unittest.TestCase):
+    def flood(self, limiter: RateLimiter, frames: int, size: int = 10):
+        return [limiter.admit(HOST, size, now=100.0)
+                for _ in range(frames)]
+
+    def test_within_limit_admitted(self):
+        limiter = RateLimiter(frame_rate=10.0)
+        burst = int(10 * BURST_SECONDS)
+        self.assertEqual([0.0] * burst, self.flood(limiter, burst))
+        self.assertEqual({}, limiter.throttled())
+
+    def test_drop(self):
+        limiter = RateLimiter(frame_rate=10.0, policy=POLICY_DROP)
+        results = self.flood(limiter, 25)
+        self.assertEqual([None] * 5, results[20:])
+
+        counters = limiter.throttled()[HOST]
+        self.assertEqual(5, counters.dropped_frames)
+        self.assertEqual(50, counters.dropped_bytes)
+        # dropped frames don't take tokens
+        self.assertEqual(0.1, limiter.admit(HOST, 10, POLICY_DELAY,
+                                            now=100.0))
+
+    def test_delay_grows_with_debt(self):
+        limiter = RateLimiter(frame_rate=10.0)
+        results = self.flood(limiter, 23)
+        self.assertEqual([0.1, 0.2, 0.3],
+                         [round(wait, 3) for wait in results[20:]])
+
+        counters = limiter.throttled()[HOST]
+        self.assertEqual(3, counters.delayed_frames)
+        self.assertAlmostEqual(0.6, counters.delay_time)
+
+    def test_bytes_limited(self):
+        limiter = RateLimiter(byte_rate=1000.0, policy=POLICY_DROP)
+        self.assertEqual(0.0, limiter.admit(HOST, 2000, now=100.0))
+        self.assertIsNone(limiter.admit(HOST, 1, now=100.0))
+        self.assertEqual(0.0, limiter.admit(HOST, 1000, now=101.0))
+
+    def test_disconnect(self):
+        limiter = RateLimiter(frame_rate=1.0, policy=POLICY_DISCONNECT)
+        self.assertEqual([0.0, 0.0, None], self.flood(limiter, 3))
+        self.assertEqual(1, limiter.throttled()[HOST].disconnects)
+
+    def test_peers_limited_separately(self):
+        limiter = RateLimiter(frame_rate=1.0, policy=POLICY_DROP)
+        self.flood(limiter, 3)
+        self.assertEqual(0.0, limiter.admit("192.168.0.6", 10, now=100.0))
+        self.assertEqual([HOST], list(limiter.throttled()))
+
+    def test_connections_capped(self):
+        limiter = RateLimiter(max_connections=2)
+        self.assertTrue(limiter.connect(HOST))
+        self.assertTrue(limiter.connect(HOST))
+        self.assertFalse(limiter.connect(HOST))
+        self.assertTrue(limiter.connect("192.168.0.6"))
+
+        limiter.disconnect(HOST)
+        self.assertTrue(limiter.connect(HOST))
+        self.assertEqual(1, limiter.throttled()[HOST].refused_connections)
+
+    def test_idle_peers_forgotten(self):
+        limiter = RateLimiter(max_peers=2)
+        limiter.connect(HOST)
+        limiter.admit("192.168.0.6", 10)
+        limiter.admit("192.168.0.7", 10)
+        limiter.admit("192.168.0.8", 10)
+        self.assertEqual(2, len(limiter._peers))
+        self.assertIn(HOST, limiter._peers)
+
+    def test_summary(self):
+        limiter = RateLimiter(frame_rate=1.0, policy=POLICY_DROP)
+        self.assertEqual("No peer went over rate limits",
+                         limiter.summary())
+        self.flood(limiter, 3)
+        self.assertTrue(limiter.summary().startswith(
+            f"{HOST}: 1 frames (0 KiB) dropped"
+        ))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(frame_rate=0)
+        with self.assertRaises(ValueError):
+            RateLimiter(byte_rate=-1)
+        with self.assertRaises(ValueError):
+            RateLimiter(max_connections=0)
+        with self.assertRaises(ValueError):
+            RateLimiter(policy="ignore")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock
+
+from chat_classes import Message
+from contacts import Contact
+from receive_workers import AckSink, MessageSink, OrderSink, \
+    ReceiveWorkers, EVENT_ACK, EVENT_MESSAGE, EVENT_TEXT
+
+
+class TestMessageSink(unittest.TestCase):
+    def test_append_passes_sender_info(self):
+        node = MagicMock()
+        node.peer_versions = {("127.0.0.1", 8001): 1}
+        node.peer_flags = {("127.0.0.1", 8001): 3}
+        events = MagicMock()
+        message = Message(Contact("127.0.0.1", 8001, "alice"),
+                          datetime.now(), "Hi")
+
+        MessageSink(node, events).append(message)
+        events.put.assert_called_once_with((EVENT_MESSAGE, message, 1, 3))
+
+    def test_unknown_sender(self):
+        node = MagicMock()
+        node.peer_versions = {}
+        node.peer_flags = {}
+        events = MagicMock()
+        message = Message(Contact("127.0.0.1", 8001), datetime.now(), "Hi")
+
+        MessageSink(node, events).append(message)
+        events.put.assert_called_once_with((EVENT_MESSAGE, message, None,
+                                                 None))
+
+
+class TestAckSink(unittest.TestCase):
+    def test_ack_passed_to_main_process(self):
+        events = MagicMock()
+        sink = AckSink(events)
+
+        self.assertTrue(sink.ack(("127.0.0.1", 8001), (7, 2)))
+        events.put.assert_called_once_with(
+            (EVENT_ACK, ("127.0.0.1", 8001), (7, 2))
+        )
+
+
+class TestOrderSink(unittest.TestCase):
+    def test_messages_ordered_by_main_process(self):
+        events = MagicMock()
+        sink = OrderSink(events)
+
+        self.assertEqual([], sink.push(("127.0.0.1", 8001), 7, 2, "second"))
+        self.assertEqual([], sink.push(("127.0.0.1", 8001), 7, 1, "first"))
+        self.assertEqual([], sink.expire())
+        self.assertEqual([((EVENT_TEXT, "second"),), ((EVENT_TEXT, "first"),)],
+                         [call.args for call in events.put.call_args_list])
+
+
+class TestReceiveWorkers(unittest.TestCase):
+    def test_invalid_processes(self):
+        with self.assertRaises(ValueError):
+            ReceiveWorkers(object, {}, 0)
+
+    def test_get_timeout(self):
+        workers = ReceiveWorkers(object, {}, 1)
+        self.assertIsNone(workers.get(0.01))
+        workers.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from reorder import ReorderBuffer, MAX_SKIPPED
+
+PEER = ("127.0.0.1", 8001)
+
+
+class TestReorderBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = ReorderBuffer(timeout=0.5, max_pending=4)
+
+    def test_in_order(self):
+        for number in range(1, 4):
+            self.assertEqual([number],
+                             self.buffer.push(PEER, 1, number, number, 0.0))
+
+    def test_out_of_order(self):
+        self.assertEqual([], self.buffer.push(PEER, 1, 3, "c", 0.0))
+        self.assertEqual([], self.buffer.push(PEER, 1, 2, "b", 0.0))
+        self.assertEqual(["a", "b", "c"],
+                         self.buffer.push(PEER, 1, 1, "a", 0.0))
+
+    def test_duplicates_dropped(self):
+        self.buffer.push(PEER, 1, 1, "a", 0.0)
+        self.assertEqual([], self.buffer.push(PEER, 1, 1, "a", 0.0))
+        self.buffer.push(PEER, 1, 3, "c", 0.0)
+        self.assertEqual([], self.buffer.push(PEER, 1, 3, "c", 0.0))
+
+    def test_peers_are_independent(self):
+        other = ("127.0.0.1", 8002)
+        self.assertEqual([], self.buffer.push(PEER, 1, 2, "b", 0.0))
+        self.assertEqual(["x"], self.buffer.push(other, 1, 1, "x", 0.0))
+
+    def test_missing_skipped_after_timeout(self):
+        self.buffer.push(PEER, 1, 1, "a", 0.0)
+        self.buffer.push(PEER, 1, 3, "c", 0.0)
+        self.buffer.push(PEER, 1, 4, "d", 0.3)
+        self.assertEqual([], self.buffer.expire(0.4))
+        self.assertEqual(["c", "d"], self.buffer.expire(0.5))
+        self.assertEqual([], self.buffer.expire(10.0))
+
+        # late message is still delivered, but only once
+        self.assertEqual(["b"], self.buffer.push(PEER, 1, 2, "b", 1.0))
+        self.assertEqual([], self.buffer.push(PEER, 1, 2, "b", 1.0))
+        self.assertEqual(["e"], self.buffer.push(PEER, 1, 5, "e", 1.0))
+
+    def test_too_many_pending(self):
+        ready = []
+        for number in range(2, 7):
+            ready += self.buffer.push(PEER, 1, number, number, 0.0)
+        self.assertEqual([2, 3, 4, 5, 6], ready)
+
+    def test_restarted_peer(self):
+        self.buffer.push(PEER, 1, 1, "a", 0.0)
+        self.buffer.push(PEER, 1, 2, "b", 0.0)
+        self.assertEqual(["new"], self.buffer.push(PEER, 2, 1, "new", 0.0))
+
+    def test_restarted_receiver(self):
+        # numbers of a long running sender don't start from one
+        self.assertEqual([], self.buffer.push(PEER, 1, 1000, "x", 0.0))
+        self.assertEqual(["x"], self.buffer.expire(1.0))
+        self.assertEqual(["y"], self.buffer.push(PEER, 1, 1001, "y", 1.0))
+        self.assertEqual(["late"], self.buffer.push(PEER, 1, 999, "late",
+                                                    1.0))
+        self.assertEqual([], self.buffer.push(PEER, 1, 999 - MAX_SKIPPED,
+                                              "too late", 1.0))
+
+    def test_invalid_settings(self):
+        with self.assertRaises(ValueError):
+            ReorderBuffer(timeout=0)
+        with self.assertRaises(ValueError):
+            ReorderBuffer(max_pending=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
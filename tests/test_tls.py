@@ -0,0 +1,118 @@
+import os
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from tls import TlsContext, create_certificate, fingerprint
+
+
+def tls_available() -> bool:
+    return shutil.which("openssl") is not None
+
+
+@unittest.skipUnless(tls_available(), "openssl isn't installed")
+class TestTlsContext(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.tls = TlsContext(os.path.join(self.dir, "cert.pem"),
+                              os.path.join(self.dir, "key.pem"))
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(self.server.close)
+        self.address = self.server.getsockname()
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.drain, args=(conn,),
+                             daemon=True).start()
+
+    def drain(self, conn: socket.socket):
+        try:
+            with self.tls.wrap_server(conn) as tls_conn:
+                while tls_conn.recv(1024):
+                    pass
+        except OSError:
+            pass
+
+    def connect(self) -> ssl.SSLSocket:
+        sock = socket.create_connection(self.address)
+        return self.tls.wrap_client(sock, self.address)
+
+    def test_certificate_created_once(self):
+        with open(os.path.join(self.dir, "cert.pem"), "rb") as f:
+            created = f.read()
+        again = TlsContext(os.path.join(self.dir, "cert.pem"),
+                           os.path.join(self.dir, "key.pem"))
+        with open(os.path.join(self.dir, "cert.pem"), "rb") as f:
+            self.assertEqual(created, f.read())
+        self.assertEqual(self.tls.fingerprint, again.fingerprint)
+        self.assertEqual(0o600, os.stat(
+            os.path.join(self.dir, "key.pem")
+        ).st_mode & 0o777)
+
+    def test_peer_fingerprint(self):
+        with self.connect() as tls_sock:
+            self.assertEqual("TLSv1.3", tls_sock.version())
+            self.assertEqual(self.tls.fingerprint,
+                             TlsContext.peer_fingerprint(tls_sock))
+
+    def test_reconnect_resumes_session(self):
+        with self.connect() as first:
+            self.assertFalse(first.session_reused)
+        for _ in range(2):
+            with self.connect() as again:
+                again.sendall(b"hello")
+                self.assertTrue(again.session_reused)
+                # pinned fingerprint is checked on resumed sessions too
+                self.assertEqual(self.tls.fingerprint,
+                                 TlsContext.peer_fingerprint(again))
+        self.assertEqual((3, 2), (self.tls.handshakes, self.tls.resumed))
+
+        self.tls.forget(self.address)
+        with self.connect() as full:
+            self.assertFalse(full.session_reused)
+
+    def test_read_tickets_detects_close(self):
+        with self.connect() as tls_sock:
+            self.assertTrue(TlsContext.read_tickets(tls_sock))
+
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            address = server.getsockname()
+
+            def close_after_handshake():
+                conn, _ = server.accept()
+                self.tls.wrap_server(conn).close()
+
+            thread = threading.Thread(target=close_after_handshake)
+            thread.start()
+            sock = socket.create_connection(address)
+            with self.tls.wrap_client(sock, address) as tls_sock:
+                thread.join()
+                self.assertFalse(TlsContext.read_tickets(tls_sock, 1.0))
+
+
+class TestCertificate(unittest.TestCase):
+    def test_fingerprint(self):
+        self.assertEqual(
+            "2cf24dba5fb0a30e26e83b2ac5b9e29e"
+            "1b161e5c1fa7425e73043362938b9824",
+            fingerprint(b"hello")
+        )
+
+    def test_openssl_missing(self):
+        with patch("subprocess.run", side_effect=FileNotFoundError):
+            with self.assertRaises(OSError):
+                create_certificate("cert.pem", "key.pem", "node")
+
+
+if __name__ == "__main__":
+    unittest.main()
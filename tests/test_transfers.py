@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from contacts import Contact
+from transfers import IncomingFile, IncomingTransfer, Manifest, \
+    TransferTable, PARTIAL_DIR, chunk_hash, decode_bitmap, encode_bitmap, \
+    split_ranges
+
+
+def make_manifest(data: bytes, chunk_size: int) -> Manifest:
+    return Manifest(len(data), chunk_size, [
+        chunk_hash(data[i:i + chunk_size])
+        for i in range(0, len(data), chunk_size)
+    ])
+
+
+class TestSplitRanges(unittest.TestCase):
+    def test_even(self):
+        self.assertEqual([(0, 5), (5, 10)], split_ranges(10, 2))
+
+    def test_uneven(self):
+        self.assertEqual([(0, 4), (4, 7), (7, 10)], split_ranges(10, 3))
+
+    def test_more_parts_than_bytes(self):
+        self.assertEqual([(0, 1), (1, 2)], split_ranges(2, 4))
+
+    def test_invalid_parts(self):
+        with self.assertRaises(ValueError):
+            split_ranges(10, 0)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.manifest = make_manifest(b"0123456789", 4)
+
+    def test_chunks(self):
+        self.assertEqual(3, self.manifest.chunk_count)
+        self.assertEqual((8, 10), self.manifest.chunk_range(2))
+
+    def test_round_trip(self):
+        data = self.manifest.encode() + b"envelope"
+        decoded, end = Manifest.decode(memoryview(data))
+        self.assertEqual(b"envelope", data[end:])
+        self.assertEqual(self.manifest.transfer_id, decoded.transfer_id)
+        self.assertEqual(self.manifest.hashes, decoded.hashes)
+
+    def test_transfer_id_depends_on_content(self):
+        self.assertEqual(self.manifest.transfer_id,
+                         make_manifest(b"0123456789", 4).transfer_id)
+        self.assertNotEqual(self.manifest.transfer_id,
+                            make_manifest(b"0123456780", 4).transfer_id)
+
+    def test_transfer_id_mismatch(self):
+        data = bytearray(self.manifest.encode())
+        data[-1] ^= 0xFF
+        with self.assertRaises(ValueError):
+            Manifest.decode(bytes(data))
+
+    def test_truncated(self):
+        with self.assertRaises(ValueError):
+            Manifest.decode(self.manifest.encode()[:-1])
+
+    def test_from_file(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(test_dir, "file.bin")
+            with open(path, "wb") as f:
+                f.write(b"0123456789")
+            self.assertEqual(self.manifest.transfer_id,
+                             Manifest.from_file(path, 4).transfer_id)
+        finally:
+            shutil.rmtree(test_dir)
+
+    def test_bitmap(self):
+        bitmap = encode_bitmap({0, 9}, 10)
+        self.assertEqual(b"\x80\x40", bitmap)
+        self.assertEqual({0, 9}, decode_bitmap(bitmap, 10))
+
+
+class TestIncomingTransfer(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.manifest = make_manifest(b"0123456789", 4)
+        self.transfer = self.make_transfer()
+
+    def tearDown(self):
+        self.transfer.close()
+        shutil.rmtree(self.test_dir)
+
+    def make_transfer(self) -> IncomingTransfer:
+        return IncomingTransfer(
+            self.manifest,
+            "file.bin",
+            Contact("127.0.0.1", 8001, "user"),
+            self.test_dir
+        )
+
+    def test_preallocated(self):
+        self.assertEqual(10, os.path.getsize(self.transfer.part_path))
+        self.assertEqual("file.bin", self.transfer.filename)
+
+    def test_out_of_order_chunks(self):
+        self.assertFalse(self.transfer.write(8, b"89"))
+        self.assertFalse(self.transfer.write(0, b"0123"))
+        self.assertTrue(self.transfer.write(4, b"4567"))
+        self.transfer.finish()
+
+        with open(os.path.join(self.test_dir, "file.bin"), "rb") as f:
+            self.assertEqual(b"0123456789", f.read())
+        self.assertEqual([], os.listdir(
+            os.path.join(self.test_dir, PARTIAL_DIR)
+        ))
+
+    def test_corrupted_chunk_stays_missing(self):
+        self.assertFalse(self.transfer.write(0, b"0000"))
+        self.assertEqual(set(), self.transfer.done)
+
+    def test_resume(self):
+        self.transfer.write(0, b"0123")
+        self.transfer.write(8, b"89")
+        self.transfer.close()
+
+        self.transfer = self.make_transfer()
+        self.assertEqual({0, 2}, self.transfer.done)
+        self.assertEqual(b"\xa0", self.transfer.have_bitmap())
+        self.assertTrue(self.transfer.write(4, b"4567"))
+
+    def test_closed_after_last_writer(self):
+        with self.transfer.file() as fd:
+            self.transfer.close()
+            self.assertTrue(self.transfer.closed)
+            # file stays open for the thread writing to it
+            os.pwrite(fd, b"0123", 0)
+            with self.transfer.file() as late_fd:
+                self.assertIsNone(late_fd)
+        self.assertIsNone(self.transfer.fd)
+        self.assertFalse(self.transfer.write(8, b"89"))
+        self.assertFalse(self.transfer.complete_chunk(0))
+
+    def test_chunk_out_of_manifest(self):
+        for offset, data in ((1, b"1234"), (4, b"45"), (12, b"ab")):
+            with self.assertRaises(ValueError):
+                self.transfer.write(offset, data)
+
+
+class TestTransferTable(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.table = TransferTable(max_active=2, idle_timeout=10.0)
+        self.sender = Contact("127.0.0.1", 8001, "user")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_file(self, filename: str) -> IncomingFile:
+        incoming = IncomingFile(filename, self.sender, self.test_dir)
+        self.addCleanup(incoming.handle.close)
+        return incoming
+
+    def test_limit(self):
+        first = self.make_file("first.txt")
+        self.table.add(first)
+        self.table.add(self.make_file("second.txt"))
+        self.assertTrue(self.table.is_full)
+        with self.assertRaises(ValueError):
+            self.table.add(self.make_file("third.txt"))
+
+        self.assertTrue(self.table.remove(first))
+        self.assertFalse(self.table.remove(first))
+        self.assertFalse(self.table.is_full)
+
+    def test_expire(self):
+        idle = self.make_file("idle.txt")
+        active = self.make_file("active.txt")
+        self.table.add(idle)
+        self.table.add(active)
+        idle.last_active -= 20.0
+
+        self.assertEqual([idle], self.table.expire())
+        self.assertIsNone(self.table.get(idle.transfer_id))
+        self.assertIs(active, self.table.get(active.transfer_id))
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            TransferTable(max_active=0)
+        with self.assertRaises(ValueError):
+            TransferTable(idle_timeout=0)
+
+    def test_unfinished_file_removed(self):
+        finished = self.make_file("finished.txt")
+        finished.write(b"data")
+        finished.finish()
+        finished.close()
+        unfinished = self.make_file("unfinished.txt")
+        unfinished.write(b"da")
+        unfinished.close()
+
+        self.assertEqual(["finished.txt"], os.listdir(self.test_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -29,6 +29,73 @@ class TestUserConfig(unittest.TestCase):
         self.assertEqual("Anonymous", self.config.username)
         self.assertEqual(8001, self.config.server_port)
 
+    def test_save_load_transfer_streams(self):
+        self.config.transfer_streams = 8
+        self.config.save_config("Anonymous", 8001)
+        self.config.transfer_streams = 1
+
+        self.config.load_config()
+        self.assertEqual(8, self.config.transfer_streams)
+
+    def test_save_load_receive_processes(self):
+        self.config.receive_processes = 4
+        self.config.save_config("Anonymous", 8001)
+        self.config.receive_processes = 1
+
+        self.config.load_config()
+        self.assertEqual(4, self.config.receive_processes)
+
+    def test_save_load_discovery(self):
+        self.config.discovery = False
+        self.config.save_config("Anonymous", 8001)
+        self.config.discovery = True
+
+        self.config.load_config()
+        self.assertFalse(self.config.discovery)
+
+    def test_save_load_rate_limits(self):
+        self.config.frame_rate = 50.0
+        self.config.over_limit = "drop"
+        self.config.save_config("Anonymous", 8001)
+        self.config.frame_rate = 200.0
+        self.config.over_limit = "delay"
+
+        self.config.load_config()
+        self.assertEqual(50.0, self.config.frame_rate)
+        self.assertEqual("drop", self.config.over_limit)
+
+    def test_save_load_tls(self):
+        self.config.tls = True
+        self.config.save_config("Anonymous", 8001)
+        self.config.tls = False
+
+        self.config.load_config()
+        self.assertTrue(self.config.tls)
+
+    def test_save_load_heartbeat_interval(self):
+        self.config.heartbeat_interval = 5.0
+        self.config.save_config("Anonymous", 8001)
+        self.config.heartbeat_interval = 15.0
+
+        self.config.load_config()
+        self.assertEqual(5.0, self.config.heartbeat_interval)
+
+    def test_save_load_datagrams(self):
+        self.config.datagrams = False
+        self.config.save_config("Anonymous", 8001)
+        self.config.datagrams = True
+
+        self.config.load_config()
+        self.assertFalse(self.config.datagrams)
+
+    def test_save_load_compression(self):
+        self.config.compression = False
+        self.config.save_config("Anonymous", 8001)
+        self.config.compression = True
+
+        self.config.load_config()
+        self.assertFalse(self.config.compression)
+
 
 if __name__ == "__main__":
     unittest.main()
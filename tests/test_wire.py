@@ -0,0 +1,82 @@
+import unittest
+
+from wire import Envelope, HEADER_REGEX, LEGACY_VERSION, WIRE_VERSION
+
+
+class TestEnvelope(unittest.TestCase):
+    def setUp(self):
+        self.envelope = Envelope("user", "192.168.0.5", 8001, "Hello | world")
+
+    def test_round_trip(self):
+        decoded = Envelope.decode(self.envelope.encode())
+        self.assertEqual("user", decoded.username)
+        self.assertEqual("192.168.0.5", decoded.host)
+        self.assertEqual(8001, decoded.port)
+        self.assertEqual("Hello | world", decoded.body)
+        self.assertEqual(0, decoded.flags)
+        self.assertEqual(WIRE_VERSION, decoded.version)
+
+    def test_round_trip_memoryview(self):
+        decoded = Envelope.decode(memoryview(self.envelope.encode()))
+        self.assertEqual("Hello | world", decoded.body)
+
+    def test_flags(self):
+        self.envelope.flags = 0x05
+        self.assertEqual(0x05, Envelope.decode(self.envelope.encode()).flags)
+
+    def test_sequence(self):
+        self.assertIsNone(Envelope.decode(self.envelope.encode()).sequence)
+        self.envelope.sequence = (7, 2 ** 40)
+        decoded = Envelope.decode(self.envelope.encode())
+        self.assertEqual((7, 2 ** 40), decoded.sequence)
+        self.assertEqual("Hello | world", decoded.body)
+
+    def test_unicode(self):
+        envelope = Envelope("юзер", "localhost", 8000, "привет 👋")
+        decoded = Envelope.decode(envelope.encode())
+        self.assertEqual("юзер", decoded.username)
+        self.assertEqual("привет 👋", decoded.body)
+
+    def test_smaller_than_legacy(self):
+        self.assertLess(len(self.envelope.encode()),
+                        len(self.envelope.encode_legacy("MESSAGE")))
+
+    def test_decode_legacy_message(self):
+        decoded = Envelope.decode(
+            b"SENDER:user 127.0.0.1:8000 | MESSAGE:multi\nline"
+        )
+        self.assertEqual("user", decoded.username)
+        self.assertEqual("127.0.0.1", decoded.host)
+        self.assertEqual(8000, decoded.port)
+        self.assertEqual("multi\nline", decoded.body)
+        self.assertEqual(LEGACY_VERSION, decoded.version)
+
+    def test_decode_legacy_file_meta(self):
+        decoded = Envelope.decode(
+            self.envelope.encode_legacy("FILENAME"), HEADER_REGEX
+        )
+        self.assertEqual("Hello | world", decoded.body)
+
+    def test_malformed_legacy(self):
+        with self.assertRaises(ValueError):
+            Envelope.decode(b"Hello")
+
+    def test_unsupported_version(self):
+        data = bytearray(self.envelope.encode())
+        data[0] = WIRE_VERSION + 1
+        with self.assertRaises(ValueError):
+            Envelope.decode(bytes(data))
+
+    def test_truncated(self):
+        data = self.envelope.encode()
+        for size in (0, 3, 6, len(data) - 1):
+            with self.assertRaises(ValueError):
+                Envelope.decode(data[:size])
+
+    def test_too_long_username(self):
+        with self.assertRaises(ValueError):
+            Envelope("u" * 256, "localhost", 8000, "Hello").encode()
+
+
+if __name__ == "__main__":
+    unittest.main()
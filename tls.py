@@ -0,0 +1,146 @@
+import hashlib
+import os
+import select
+import socket
+import ssl
+import subprocess
+import time
+from threading import Lock
+
+CERT_FILE = "node_cert.pem"
+KEY_FILE = "node_key.pem"
+CERT_DAYS = 3650
+HANDSHAKE_TIMEOUT = 10.0
+# after the first full handshake with a peer, its session tickets
+# are waited for at most this long, so later connections resume
+MAX_TICKET_WAIT = 0.1
+
+
+class CertificateMismatch(ConnectionError):
+    """Peer presented another certificate than the one pinned for it"""
+
+
+def create_certificate(cert_path: str, key_path: str, common_name: str):
+    """
+    Creates self-signed certificate and its key with openssl,
+    raises OSError if it can't be done
+    """
+    try:
+        subprocess.run([
+            "openssl", "req", "-x509", "-newkey", "ec",
+            "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes",
+            "-days", str(CERT_DAYS), "-subj", f"/CN={common_name}",
+            "-keyout", key_path, "-out", cert_path
+        ], check=True, capture_output=True)
+    except FileNotFoundError as e:
+        raise OSError("TLS needs openssl to create a certificate") from e
+    except subprocess.CalledProcessError as e:
+        raise OSError(f"Can't create certificate: "
+                      f"{e.stderr.decode(errors='replace')}") from e
+    os.chmod(key_path, 0o600)
+
+
+def fingerprint(certificate: bytes) -> str:
+    """Returns SHA-256 of DER certificate as hex"""
+    return hashlib.sha256(certificate).hexdigest()
+
+
+class TlsContext:
+    """
+    TLS 1.3 of a node with its self-signed certificate. Certificates
+    aren't checked against CAs, peers are recognized by fingerprints
+    pinned by the caller. Sessions of peers are kept, so reconnects
+    resume them with the short handshake
+    """
+
+    def __init__(
+            self,
+            cert_path: str = CERT_FILE,
+            key_path: str = KEY_FILE,
+            common_name: str = "p2p-chat"
+    ):
+        if not (os.path.exists(cert_path) and os.path.exists(key_path)):
+            create_certificate(cert_path, key_path, common_name)
+        with open(cert_path, "r") as f:
+            certificate = ssl.PEM_cert_to_DER_cert(f.read())
+        self.fingerprint = fingerprint(certificate)
+
+        self.server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.server_context.minimum_version = ssl.TLSVersion.TLSv1_3
+        self.server_context.load_cert_chain(cert_path, key_path)
+        self.client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.client_context.minimum_version = ssl.TLSVersion.TLSv1_3
+        # self-signed certificates are checked by pinned fingerprint
+        self.client_context.check_hostname = False
+        self.client_context.verify_mode = ssl.CERT_NONE
+
+        self._sessions = dict[tuple[str, int], ssl.SSLSession]()
+        self._lock = Lock()
+        # outbound handshakes and how many of them resumed a session
+        self.handshakes = 0
+        self.resumed = 0
+
+    def wrap_server(self, sock: socket.socket) -> ssl.SSLSocket:
+        """Performs handshake of accepted connection"""
+        sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            return self.server_context.wrap_socket(sock, server_side=True)
+        except BaseException:
+            sock.close()
+            raise
+
+    def wrap_client(
+            self,
+            sock: socket.socket,
+            address: tuple[str, int]
+    ) -> ssl.SSLSocket:
+        """
+        Performs handshake of connection to peer at address,
+        resuming the last session with it if there is one
+        """
+        with self._lock:
+            session = self._sessions.get(address)
+        started = time.monotonic()
+        tls_sock = self.client_context.wrap_socket(sock, session=session)
+        with self._lock:
+            self.handshakes += 1
+            if tls_sock.session_reused:
+                self.resumed += 1
+                return tls_sock
+
+        # TLS 1.3 tickets come after the handshake and are read only
+        # when socket is, so they are waited for about a round trip
+        wait = min(time.monotonic() - started, MAX_TICKET_WAIT)
+        self.read_tickets(tls_sock, wait)
+        if tls_sock.session and tls_sock.session.has_ticket:
+            with self._lock:
+                self._sessions[address] = tls_sock.session
+        return tls_sock
+
+    def forget(self, address: tuple[str, int]):
+        """Drops session of peer, so the next handshake is a full one"""
+        with self._lock:
+            self._sessions.pop(address, None)
+
+    @staticmethod
+    def peer_fingerprint(tls_sock: ssl.SSLSocket) -> str:
+        return fingerprint(tls_sock.getpeercert(binary_form=True))
+
+    @staticmethod
+    def read_tickets(tls_sock: ssl.SSLSocket, timeout: float = 0.0) -> bool:
+        """
+        Processes records which have arrived, such as session tickets.
+        Must be called only on connections peer doesn't send data to.
+        Returns False if peer has closed connection
+        """
+        readable, _, _ = select.select([tls_sock], [], [], timeout)
+        if not readable:
+            return True
+        timeout = tls_sock.gettimeout()
+        tls_sock.setblocking(False)
+        try:
+            return tls_sock.recv(1) != b""
+        except ssl.SSLWantReadError:
+            return True
+        finally:
+            tls_sock.settimeout(timeout)
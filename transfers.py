@@ -0,0 +1,425 @@
+import hashlib
+import os
+import struct
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from threading import Lock
+from typing import Iterator
+
+from contacts import Contact
+from file_receiver import read_at, write_at
+
+CHUNK_SIZE = 1024 * 1024
+HASH_SIZE = 16
+# transfer id, file size, chunk size and chunks count,
+# followed by chunk hashes
+MANIFEST_HEADER = struct.Struct("!16sQII")
+# transfer id and offset of chunk in file, followed by chunk data
+RANGE_HEADER = struct.Struct("!16sQ")
+# transfer id and envelope flags of receiver, followed by bitmap
+# of chunks it already has. Without bitmap the transfer is refused
+HAVE_HEADER = struct.Struct("!16sB")
+
+PARTIAL_DIR = ".partial"
+MAX_ACTIVE_TRANSFERS = 8
+# transfer which didn't receive data for this long is dropped
+TRANSFER_IDLE_TIMEOUT = 120.0
+
+
+def chunk_hash(data: bytes | memoryview) -> bytes:
+    """Returns hash of a single chunk"""
+    return hashlib.blake2b(data, digest_size=HASH_SIZE).digest()
+
+
+def split_ranges(size: int, parts: int) -> list[tuple[int, int]]:
+    """Splits file of given size into at most parts (start, end) ranges"""
+    if parts < 1:
+        raise ValueError(f"Parts count must be positive, but was:{parts}")
+
+    parts = max(1, min(parts, size))
+    step, rest = divmod(size, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + step + (1 if i < rest else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def encode_bitmap(indexes: set[int], count: int) -> bytes:
+    """Packs set of chunk indexes into bitmap"""
+    bitmap = bytearray((count + 7) // 8)
+    for index in indexes:
+        bitmap[index // 8] |= 0x80 >> (index % 8)
+    return bytes(bitmap)
+
+
+def decode_bitmap(bitmap: bytes | memoryview, count: int) -> set[int]:
+    """Unpacks set of chunk indexes from bitmap"""
+    if len(bitmap) * 8 < count:
+        raise ValueError("Bitmap is shorter than chunks count")
+    return {
+        index for index in range(count)
+        if bitmap[index // 8] & (0x80 >> (index % 8))
+    }
+
+
+class Manifest:
+    """
+    Size and per-chunk hashes of a file.
+    Transfer id is derived from them, so sending the same file again
+    resumes the transfer left unfinished
+    """
+
+    def __init__(self, size: int, chunk_size: int, hashes: list[bytes]):
+        if chunk_size < 1:
+            raise ValueError(f"Chunk size must be positive, "
+                             f"but was:{chunk_size}")
+        expected = (size + chunk_size - 1) // chunk_size
+        if len(hashes) != expected:
+            raise ValueError(f"Expected {expected} hashes, "
+                             f"but got {len(hashes)}")
+
+        self.size = size
+        self.chunk_size = chunk_size
+        self.hashes = hashes
+        self.transfer_id = hashlib.blake2b(
+            struct.pack("!QI", size, chunk_size) + b"".join(hashes),
+            digest_size=16
+        ).digest()
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.hashes)
+
+    def chunk_range(self, index: int) -> tuple[int, int]:
+        """Returns (start, end) of chunk in file"""
+        start = index * self.chunk_size
+        return start, min(start + self.chunk_size, self.size)
+
+    def encode(self) -> bytes:
+        """Casts this manifest to bytes"""
+        return (MANIFEST_HEADER.pack(self.transfer_id, self.size,
+                                     self.chunk_size, self.chunk_count)
+                + b"".join(self.hashes))
+
+    @classmethod
+    def decode(cls, data: bytes | memoryview) -> tuple["Manifest", int]:
+        """Creates a manifest from bytes, returns it with its length"""
+        try:
+            transfer_id, size, chunk_size, count = (
+                MANIFEST_HEADER.unpack_from(data)
+            )
+        except struct.error as e:
+            raise ValueError(f"Truncated manifest: {e}") from e
+
+        end = MANIFEST_HEADER.size + count * HASH_SIZE
+        if end > len(data):
+            raise ValueError("Truncated manifest hashes")
+        hashes = [
+            bytes(data[offset:offset + HASH_SIZE])
+            for offset in range(MANIFEST_HEADER.size, end, HASH_SIZE)
+        ]
+        manifest = cls(size, chunk_size, hashes)
+        if manifest.transfer_id != transfer_id:
+            raise ValueError("Transfer id doesn't match manifest")
+        return manifest, end
+
+    @classmethod
+    def from_file(cls, path: str, chunk_size: int = CHUNK_SIZE):
+        """Hashes file chunk by chunk"""
+        hashes = []
+        size = 0
+        with open(path, "rb") as file:
+            while chunk := file.read(chunk_size):
+                hashes.append(chunk_hash(chunk))
+                size += len(chunk)
+        return cls(size, chunk_size, hashes)
+
+
+@lru_cache(maxsize=16)
+def cached_manifest(path: str, size: int, mtime_ns: int) -> Manifest:
+    """
+    Returns manifest of file, hashing it only once while it stays
+    unchanged, so a retried transfer starts right away
+    """
+    return Manifest.from_file(path)
+
+
+class IncomingTransfer:
+    """
+    A file received by chunks, which may arrive over several
+    connections in any order. Chunks are written into a preallocated
+    file under downloads/.partial and every verified chunk is journaled,
+    so an interrupted transfer resumes from what was already received
+    """
+
+    def __init__(
+            self,
+            manifest: Manifest,
+            filename: str,
+            sender: Contact,
+            downloads_path: str
+    ):
+        self.manifest = manifest
+        self.transfer_id = manifest.transfer_id
+        self.filename = os.path.basename(filename)
+        self.path = os.path.join(downloads_path, self.filename)
+        self.sender = sender
+        self.connections = 0
+        self.last_active = time.monotonic()
+
+        partial_dir = os.path.join(downloads_path, PARTIAL_DIR)
+        os.makedirs(partial_dir, exist_ok=True)
+        base = os.path.join(partial_dir, self.transfer_id.hex())
+        self.part_path = base + ".part"
+        self._journal_path = base + ".done"
+
+        self.done = set[int]()
+        if (os.path.exists(self.part_path)
+                and os.path.exists(self._journal_path)):
+            self.done = self._load_journal()
+        else:
+            open(self._journal_path, "wb").close()
+
+        self.fd = os.open(
+            self.part_path,
+            os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0),
+            0o644
+        )
+        if os.fstat(self.fd).st_size != manifest.size:
+            os.ftruncate(self.fd, manifest.size)
+        self._journal = open(self._journal_path, "ab")
+        self._lock = Lock()
+        # threads writing to the file, which is closed after them
+        self._users = 0
+        self._is_closed = False
+
+    @property
+    def is_complete(self) -> bool:
+        return len(self.done) == self.manifest.chunk_count
+
+    @property
+    def closed(self) -> bool:
+        return self._is_closed
+
+    @contextmanager
+    def file(self) -> Iterator[int | None]:
+        """
+        Gives descriptor of the part file, which stays open until it
+        is released, or None if transfer is already closed
+        """
+        with self._lock:
+            if self._is_closed:
+                fd = None
+            else:
+                fd = self.fd
+                self._users += 1
+        try:
+            yield fd
+        finally:
+            if fd is not None:
+                with self._lock:
+                    self._users -= 1
+                    if self._is_closed and self._users == 0:
+                        self._close_file()
+
+    def have_bitmap(self) -> bytes:
+        """Returns bitmap of chunks which are already received"""
+        with self._lock:
+            return encode_bitmap(self.done, self.manifest.chunk_count)
+
+    def touch(self):
+        """Marks transfer as active"""
+        self.last_active = time.monotonic()
+
+    def check_chunk(self, offset: int, size: int) -> int:
+        """
+        Returns index of chunk with given offset and size,
+        raises ValueError if they don't describe a whole chunk
+        """
+        index, rest = divmod(offset, self.manifest.chunk_size)
+        if (rest or index >= self.manifest.chunk_count
+                or self.manifest.chunk_range(index)[1] != offset + size):
+            raise ValueError(f"Chunk {offset}+{size} doesn't match "
+                             f"manifest of {self.filename}")
+        return index
+
+    def write(self, offset: int, data: bytes | memoryview) -> bool:
+        """
+        Writes whole chunk and returns True if the file is complete.
+        Chunk of closed transfer is dropped
+        """
+        index = self.check_chunk(offset, len(data))
+        with self.file() as fd:
+            if fd is None:
+                return False
+            write_at(fd, data, offset)
+        return self.complete_chunk(index)
+
+    def complete_chunk(self, index: int) -> bool:
+        """
+        Verifies chunk written to file and returns True if the file
+        is complete. Corrupted chunk stays missing and is sent again
+        """
+        self.touch()
+        start, end = self.manifest.chunk_range(index)
+        with self.file() as fd:
+            if fd is None:
+                return False
+            data = read_at(fd, end - start, start)
+        if chunk_hash(data) != self.manifest.hashes[index]:
+            return self.is_complete
+
+        with self._lock:
+            if self._is_closed:
+                return False
+            if index not in self.done:
+                self.done.add(index)
+                self._journal.write(struct.pack("!I", index))
+                self._journal.flush()
+            return self.is_complete
+
+    def finish(self):
+        """Moves complete file to downloads and removes transfer state"""
+        self.close()
+        os.replace(self.part_path, self.path)
+        if os.path.exists(self._journal_path):
+            os.remove(self._journal_path)
+
+    def close(self):
+        """
+        Closes file once no thread writes to it,
+        state on disk is kept to resume later
+        """
+        with self._lock:
+            self._is_closed = True
+            if self._users == 0:
+                self._close_file()
+            if not self._journal.closed:
+                self._journal.close()
+
+    def _close_file(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _load_journal(self) -> set[int]:
+        """Reads indexes of chunks verified before"""
+        with open(self._journal_path, "rb") as f:
+            data = f.read()
+        # the last record may be cut off by a crash
+        data = data[:len(data) - len(data) % 4]
+        return {
+            index for (index,) in struct.iter_unpack("!I", data)
+            if index < self.manifest.chunk_count
+        }
+
+
+class IncomingFile:
+    """A file received in order over a single connection"""
+
+    def __init__(self, filename: str, sender: Contact, downloads_path: str):
+        # such files are never resumed, so their id is just unique
+        self.transfer_id = os.urandom(HASH_SIZE)
+        self.filename = os.path.basename(filename)
+        self.path = os.path.join(downloads_path, self.filename)
+        self.sender = sender
+        self.last_active = time.monotonic()
+        self.handle = open(self.path, "wb")
+
+    @property
+    def closed(self) -> bool:
+        return self.handle.closed
+
+    def touch(self):
+        """Marks file as active"""
+        self.last_active = time.monotonic()
+
+    def write(self, data: bytes | memoryview):
+        """Appends data to file"""
+        self.touch()
+        self.handle.write(data)
+
+    def finish(self):
+        """Closes fully received file"""
+        self.handle.close()
+
+    def close(self):
+        """Closes and removes file which wasn't received to its end"""
+        if self.handle.closed:
+            return
+        self.handle.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class TransferTable:
+    """
+    Inbound transfers in progress, keyed by transfer id.
+    Limits how many files are received at once and finds transfers
+    which stopped receiving data. Not thread safe, callers lock it
+    """
+
+    def __init__(
+            self,
+            max_active: int = MAX_ACTIVE_TRANSFERS,
+            idle_timeout: float = TRANSFER_IDLE_TIMEOUT
+    ):
+        if max_active < 1:
+            raise ValueError(f"Max active transfers must be positive, "
+                             f"but was:{max_active}")
+        if idle_timeout <= 0:
+            raise ValueError(f"Idle timeout must be positive, "
+                             f"but was:{idle_timeout}")
+
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self._transfers = dict[bytes, IncomingTransfer | IncomingFile]()
+
+    @property
+    def is_full(self) -> bool:
+        return len(self._transfers) >= self.max_active
+
+    def get(
+            self,
+            transfer_id: bytes
+    ) -> IncomingTransfer | IncomingFile | None:
+        """Returns transfer with given id if it is in progress"""
+        return self._transfers.get(transfer_id)
+
+    def add(self, transfer: IncomingTransfer | IncomingFile):
+        """Adds new transfer, raises ValueError if table is full"""
+        if self.is_full:
+            raise ValueError(f"Already receiving {self.max_active} files")
+        self._transfers[transfer.transfer_id] = transfer
+
+    def remove(self, transfer: IncomingTransfer | IncomingFile) -> bool:
+        """
+        Removes transfer, returns False if it was already
+        removed, e.g. because it had expired
+        """
+        if self._transfers.get(transfer.transfer_id) is not transfer:
+            return False
+        del self._transfers[transfer.transfer_id]
+        return True
+
+    def expire(
+            self,
+            now: float | None = None
+    ) -> list[IncomingTransfer | IncomingFile]:
+        """Removes and returns transfers idle for longer than timeout"""
+        if now is None:
+            now = time.monotonic()
+        expired = [
+            transfer for transfer in self._transfers.values()
+            if now - transfer.last_active > self.idle_timeout
+        ]
+        for transfer in expired:
+            del self._transfers[transfer.transfer_id]
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._transfers)
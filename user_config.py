@@ -10,6 +10,26 @@ class UserConfig:
     def __init__(self):
         self.username: str = "JohnDoe"
         self.server_port: int = 8000
+        # connections used to send one big file
+        self.transfer_streams: int = 4
+        # compress frames for peers which accept it
+        self.compression: bool = True
+        # send small messages over UDP to peers which accept it
+        self.datagrams: bool = True
+        # processes which decode received frames, needs SO_REUSEPORT
+        self.receive_processes: int = 1
+        # seconds between heartbeats which tell contacts are online
+        self.heartbeat_interval: float = 15.0
+        # announce on LAN and add peers found there to contacts
+        self.discovery: bool = True
+        # frames and bytes per second every peer may send,
+        # connections it may keep open and what happens over limit
+        self.frame_rate: float = 200.0
+        self.byte_rate: float = 32 * 1024 * 1024
+        self.connections_per_ip: int = 16
+        self.over_limit: str = "delay"
+        # encrypt connections with TLS, UDP fast path is off then
+        self.tls: bool = False
         self.downloads_dir = "./chat_downloads"
         os.makedirs(self.downloads_dir, exist_ok=True)
         self.load_config()
@@ -20,13 +40,60 @@ class UserConfig:
                 config = json.load(f)
                 username = config["username"]
                 server_port = config["server_port"]
+                transfer_streams = config.get("transfer_streams")
+                compression = config.get("compression")
+                datagrams = config.get("datagrams")
+                receive_processes = config.get("receive_processes")
+                heartbeat_interval = config.get("heartbeat_interval")
+                discovery = config.get("discovery")
+                frame_rate = config.get("frame_rate")
+                byte_rate = config.get("byte_rate")
+                connections_per_ip = config.get("connections_per_ip")
+                over_limit = config.get("over_limit")
+                tls = config.get("tls")
                 if username:
                     self.username = username
                 if server_port:
                     self.server_port = int(server_port)
+                if transfer_streams:
+                    self.transfer_streams = int(transfer_streams)
+                if compression is not None:
+                    self.compression = bool(compression)
+                if datagrams is not None:
+                    self.datagrams = bool(datagrams)
+                if receive_processes:
+                    self.receive_processes = int(receive_processes)
+                if heartbeat_interval:
+                    self.heartbeat_interval = float(heartbeat_interval)
+                if discovery is not None:
+                    self.discovery = bool(discovery)
+                if frame_rate:
+                    self.frame_rate = float(frame_rate)
+                if byte_rate:
+                    self.byte_rate = float(byte_rate)
+                if connections_per_ip:
+                    self.connections_per_ip = int(connections_per_ip)
+                if over_limit:
+                    self.over_limit = str(over_limit)
+                if tls is not None:
+                    self.tls = bool(tls)
 
     def save_config(self, username: str, port: int):
         self.username = username
         self.server_port = port
         with open(CONFIG_FILE, "w") as f:
-            json.dump({"username": username, "server_port": port}, f)
+            json.dump({
+                "username": username,
+                "server_port": port,
+                "transfer_streams": self.transfer_streams,
+                "compression": self.compression,
+                "datagrams": self.datagrams,
+                "receive_processes": self.receive_processes,
+                "heartbeat_interval": self.heartbeat_interval,
+                "discovery": self.discovery,
+                "frame_rate": self.frame_rate,
+                "byte_rate": self.byte_rate,
+                "connections_per_ip": self.connections_per_ip,
+                "over_limit": self.over_limit,
+                "tls": self.tls
+            }, f)
@@ -0,0 +1,160 @@
+import re
+import struct
+
+MESSAGE_REGEX = re.compile(
+    r"SENDER:(?P<username>[^ ]+?) "
+    r"(?P<host>[^:]+?):(?P<port>\d+?)"
+    r" \| MESSAGE:(?P<message>.+)",
+    re.DOTALL)
+HEADER_REGEX = re.compile(
+    r"SENDER:(?P<username>[^ ]+?) "
+    r"(?P<host>[^:]+?):(?P<port>\d+?)"
+    r" \| FILENAME:(?P<filename>.+)")
+
+# text headers of old nodes start with "SENDER:"
+LEGACY_VERSION = 0
+WIRE_VERSION = 1
+# binary headers start with a version byte below any printable character
+MAX_BINARY_VERSION = 0x1F
+
+# sender accepts frames with compressed payload
+FLAG_COMPRESSION = 0x01
+# sender accepts batch frames with several text messages
+FLAG_BATCH = 0x02
+# sender receives small frames as UDP datagrams on its port
+FLAG_DATAGRAM = 0x04
+# sender acknowledges numbered text messages it has received
+FLAG_ACKS = 0x08
+# sender accepts long text streamed in text chunk frames
+FLAG_STREAMED_TEXT = 0x10
+
+# version, flags, sender port
+FIXED_HEADER = struct.Struct("!BBH")
+SHORT_LENGTH = struct.Struct("!B")
+LONG_LENGTH = struct.Struct("!I")
+# optional trailer of text messages: session of sender and number of
+# message in it. Older nodes stop reading after body and ignore it
+SEQUENCE = struct.Struct("!IQ")
+
+
+class Envelope:
+    """Sender info and body of a text or file meta frame"""
+
+    def __init__(
+            self,
+            username: str,
+            host: str,
+            port: int,
+            body: str,
+            flags: int = 0,
+            version: int = WIRE_VERSION,
+            sequence: tuple[int, int] | None = None
+    ):
+        self.username = username
+        self.host = host
+        self.port = port
+        self.body = body
+        self.flags = flags
+        self.version = version
+        # (session, number) of message sent to one peer
+        self.sequence = sequence
+
+    def __repr__(self):
+        return (f"Envelope:{self.username} ({self.host}:{self.port}) "
+                f"v{self.version}")
+
+    def encode(self) -> bytes:
+        """Casts this envelope to bytes using its wire version"""
+        if self.version == LEGACY_VERSION:
+            raise ValueError("Legacy envelopes are encoded with "
+                             "encode_legacy()")
+
+        username = self.username.encode("utf-8")
+        host = self.host.encode("utf-8")
+        body = self.body.encode("utf-8")
+        if len(username) > 255 or len(host) > 255:
+            raise ValueError("Username and host must be at most "
+                             "255 bytes long")
+
+        return b"".join((
+            FIXED_HEADER.pack(self.version, self.flags, self.port),
+            SHORT_LENGTH.pack(len(username)), username,
+            SHORT_LENGTH.pack(len(host)), host,
+            LONG_LENGTH.pack(len(body)), body,
+            SEQUENCE.pack(*self.sequence) if self.sequence else b""
+        ))
+
+    def encode_legacy(self, field: str) -> bytes:
+        """
+        Casts this envelope to the text header understood by old nodes.
+        Field is MESSAGE for text frames and FILENAME for file meta
+        """
+        return (f"SENDER:{self.username} {self.host}:{self.port} | "
+                f"{field}:{self.body}").encode("utf-8")
+
+    @classmethod
+    def decode(
+            cls,
+            data: bytes | memoryview,
+            legacy_regex: re.Pattern = MESSAGE_REGEX
+    ):
+        """
+        Creates an envelope from frame payload.
+        Payloads of old nodes are parsed with legacy_regex
+        """
+        if len(data) == 0:
+            raise ValueError("Empty envelope")
+
+        version = data[0]
+        if version > MAX_BINARY_VERSION:
+            return cls._decode_legacy(data, legacy_regex)
+        if version == LEGACY_VERSION or version > WIRE_VERSION:
+            raise ValueError(f"Unsupported wire version: {version}")
+
+        try:
+            _, flags, port = FIXED_HEADER.unpack_from(data, 0)
+            offset = FIXED_HEADER.size
+            username, offset = cls._read_field(data, offset, SHORT_LENGTH)
+            host, offset = cls._read_field(data, offset, SHORT_LENGTH)
+            body, offset = cls._read_field(data, offset, LONG_LENGTH)
+            sequence = None
+            if len(data) - offset >= SEQUENCE.size:
+                sequence = SEQUENCE.unpack_from(data, offset)
+        except struct.error as e:
+            raise ValueError(f"Truncated envelope: {e}") from e
+
+        return cls(username, host, port, body, flags, version, sequence)
+
+    @staticmethod
+    def _read_field(
+            data: bytes | memoryview,
+            offset: int,
+            length_format: struct.Struct
+    ) -> tuple[str, int]:
+        """Reads length prefixed UTF-8 string and returns it with new offset"""
+        (length,) = length_format.unpack_from(data, offset)
+        start = offset + length_format.size
+        if start + length > len(data):
+            raise ValueError("Truncated envelope field")
+        return str(data[start:start + length], "utf-8"), start + length
+
+    @classmethod
+    def _decode_legacy(
+            cls,
+            data: bytes | memoryview,
+            legacy_regex: re.Pattern
+    ):
+        """Creates an envelope from text header of old nodes"""
+        match = legacy_regex.match(str(data, "utf-8"))
+        if not match:
+            raise ValueError("Malformed legacy header")
+
+        groups = match.groupdict()
+        body = groups.get("message", groups.get("filename"))
+        return cls(
+            groups["username"],
+            groups["host"],
+            int(groups["port"]),
+            body,
+            version=LEGACY_VERSION
+        )